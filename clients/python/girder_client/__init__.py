@@ -21,6 +21,7 @@ import diskcache
 import errno
 import getpass
 import glob
+import hashlib
 import json
 import mimetypes
 import os
@@ -28,7 +29,10 @@ import re
 import requests
 import shutil
 import six
+import sys
 import tempfile
+import threading
+import time
 
 from contextlib import contextmanager
 from requests_toolbelt import MultipartEncoder
@@ -38,6 +42,7 @@ __license__ = 'Apache 2.0'
 
 DEFAULT_PAGE_LIMIT = 50  # Number of results to fetch per request
 REQ_BUFFER_SIZE = 65536  # Chunk size when iterating a download body
+METADATA_BATCH_SIZE = 1000  # Number of documents sent with each bulk metadata request
 
 _safeNameRegex = re.compile(r'^[/\\]+')
 
@@ -52,6 +57,20 @@ def _compareDicts(x, y):
     return len(x) == len(y) == len(set(x.items()) & set(y.items()))
 
 
+def _readJson(path):
+    """
+    Return the JSON value stored in a file, or None if it is missing or is not
+    valid JSON.
+
+    :param path: The path of the file.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
 def _safeMakedirs(path):
     """
     Wraps os.makedirs in such a way that it will not raise exceptions if the
@@ -76,6 +95,12 @@ class IncorrectUploadLengthError(RuntimeError):
         self.upload = upload
 
 
+class IncorrectDownloadLengthError(RuntimeError):
+    def __init__(self, message, file=None):
+        super(IncorrectDownloadLengthError, self).__init__(message)
+        self.file = file
+
+
 class HttpError(requests.HTTPError):
     """
     Raised if the server returns an error status code from a request.
@@ -136,6 +161,127 @@ class _ProgressMultiPartEncoder(MultipartEncoder):
         return _chunk
 
 
+class _ChunkReader(object):
+    """
+    Reads chunks from a stream in a background thread, so that reading the
+    next chunk overlaps with sending the current one. Iterating over this
+    yields ``(offset, chunk)`` tuples.
+    """
+    def __init__(self, stream, size, chunkSize, offset=0, readAhead=2):
+        self._stream = stream
+        self._size = size
+        self._chunkSize = chunkSize
+        self._offset = offset
+        self._queue = six.moves.queue.Queue(maxsize=readAhead)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, value):
+        while not self._stopped:
+            try:
+                self._queue.put(value, timeout=0.1)
+                return
+            except six.moves.queue.Full:
+                pass
+
+    def _readChunk(self, length):
+        # Streams such as pipes may return less than was requested before
+        # their end, but every chunk except the last must be full length.
+        parts = []
+        while length > 0:
+            data = self._stream.read(length)
+            if not data:
+                break
+            if isinstance(data, six.text_type):
+                data = data.encode('utf8')
+            parts.append(data)
+            length -= len(data)
+        return b''.join(parts)
+
+    def _read(self):
+        offset = self._offset
+        try:
+            while True:
+                chunk = self._readChunk(min(self._chunkSize, (self._size - offset)))
+                if not chunk:
+                    break
+                self._put((offset, chunk))
+                offset += len(chunk)
+            self._put(None)
+        except Exception:
+            self._put(sys.exc_info())
+
+    def __iter__(self):
+        while True:
+            value = self._queue.get()
+            if value is None:
+                return
+            if len(value) == 3:
+                six.reraise(*value)
+            yield value
+
+    def close(self):
+        self._stopped = True
+        self._thread.join()
+
+
+class _WorkerPool(object):
+    """
+    A fixed number of threads that run submitted tasks. At most one task per
+    worker may be waiting, so that callers producing large tasks (such as
+    chunks of a file) do not run ahead of the workers. After any task fails,
+    the remaining tasks are skipped and the failure is raised by the next call
+    to :py:meth:`submit` or :py:meth:`join`.
+    """
+    def __init__(self, workers):
+        self._queue = six.moves.queue.Queue(maxsize=workers)
+        self._errors = []
+        self._threads = [threading.Thread(target=self._work) for _ in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            if not self._errors:
+                try:
+                    task()
+                except Exception:
+                    self._errors.append(sys.exc_info())
+
+    def _raiseIfFailed(self):
+        if self._errors:
+            six.reraise(*self._errors[0])
+
+    def submit(self, task):
+        self._raiseIfFailed()
+        self._queue.put(task)
+
+    def join(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._raiseIfFailed()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.join()
+        else:
+            # Let the workers finish without running any more tasks
+            self._errors.append((exc_type, exc_value, tb))
+            for _ in self._threads:
+                self._queue.put(None)
+
+
 class GirderClient(object):
     """
     A class for interacting with the Girder RESTful API.
@@ -191,7 +337,9 @@ class GirderClient(object):
             return "https"
 
     def __init__(self, host=None, port=None, apiRoot=None, scheme=None, apiUrl=None,
-                 cacheSettings=None, progressReporterCls=None):
+                 cacheSettings=None, progressReporterCls=None, uploadWorkers=1,
+                 uploadRetries=3, uploadRetryBackoff=1.0, downloadWorkers=1,
+                 uploadDeduplication=True):
         """
         Construct a new GirderClient object, given a host name and port number,
         as well as a username and password which will be used in all requests
@@ -219,6 +367,28 @@ class GirderClient(object):
             a class attribute `reportProgress` set to True (It can conveniently be
             initialized using `sys.stdout.isatty()`).
             This defaults to :class:`_NoopProgressReporter`.
+        :param uploadWorkers: The number of chunks of a file to send at once
+            when the assetstore accepts chunks out of order, which is the case
+            for multipart uploads to S3. Chunks sent through Girder must
+            arrive in order; they are sent one at a time, while the next chunk
+            is read in the background.
+        :type uploadWorkers: int
+        :param uploadRetries: The number of times to retry sending a chunk of
+            an upload after a connection failure or server error. This is 3 by
+            default, as for ``girder-cli upload``; pass 0 to fail immediately.
+        :type uploadRetries: int
+        :param uploadRetryBackoff: The number of seconds to wait before the
+            first retry of a chunk. The wait doubles with each further retry.
+        :type uploadRetryBackoff: float
+        :param downloadWorkers: The number of files to download at once when
+            downloading items, folders, and other resources recursively.
+        :type downloadWorkers: int
+        :param uploadDeduplication: Whether to send the SHA-512 digest of new
+            files before their contents, so that the server can create the file
+            without receiving the data if it already holds it. The digest is
+            computed by reading the file once before uploading it, which is
+            only done for streams that can seek back.
+        :type uploadDeduplication: bool
         """
         self.host = None
         self.scheme = None
@@ -259,6 +429,12 @@ class GirderClient(object):
 
         self.progressReporterCls = progressReporterCls
         self._session = None
+        self.uploadWorkers = uploadWorkers
+        self.uploadRetries = uploadRetries
+        self.uploadRetryBackoff = uploadRetryBackoff
+        self.downloadWorkers = downloadWorkers
+        self.uploadDeduplication = uploadDeduplication
+        self._downloadPool = None
 
     @contextmanager
     def session(self, session=None):
@@ -908,11 +1084,10 @@ class GirderClient(object):
             }
             if reference:
                 params['reference'] = reference
-            obj = self.post('file', params)
-            if '_id' not in obj:
-                raise Exception(
-                    'After creating an upload token for a new file, expected '
-                    'an object with an id. Got instead: ' + json.dumps(obj))
+            with open(filepath, 'rb') as f:
+                obj = self._createUpload(params, f, filesize)
+            if obj.get('_modelType') == 'file':
+                return obj
 
         with open(filepath, 'rb') as f:
             return self._uploadContents(obj, f, filesize, progressCallback=progressCallback)
@@ -955,14 +1130,55 @@ class GirderClient(object):
                 return self.post(
                     'file', params, data=_ProgressBytesIO(chunk, reporter=reporter))
 
-        obj = self.post('file', params)
+        obj = self._createUpload(params, stream, size)
+        if obj.get('_modelType') == 'file':
+            return obj
+
+        return self._uploadContents(obj, stream, size, progressCallback=progressCallback)
+
+    def _createUpload(self, params, stream, size):
+        """
+        Start the upload of a new file. If ``uploadDeduplication`` is enabled
+        and the stream can seek, the SHA-512 digest of the next ``size``
+        bytes of the stream is sent as well, and the stream is returned to its
+        position. The server then returns the created file instead of an
+        upload if it already holds these contents.
+        """
+        if self.uploadDeduplication and size > 0:
+            sha512 = self._streamSha512(stream, size)
+            if sha512 is not None:
+                params = dict(params, sha512=sha512)
 
+        obj = self.post('file', params)
         if '_id' not in obj:
             raise Exception(
                 'After creating an upload token for a new file, expected '
                 'an object with an id. Got instead: ' + json.dumps(obj))
+        return obj
 
-        return self._uploadContents(obj, stream, size, progressCallback=progressCallback)
+    @staticmethod
+    def _streamSha512(stream, size):
+        try:
+            start = stream.tell()
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+
+        checksum = hashlib.sha512()
+        remaining = size
+        while remaining > 0:
+            data = stream.read(min(REQ_BUFFER_SIZE, remaining))
+            if not data:
+                break
+            if isinstance(data, six.text_type):
+                data = data.encode('utf8')
+            checksum.update(data)
+            remaining -= len(data)
+        stream.seek(start)
+
+        if remaining:
+            # The stream is too short; let the upload report the error
+            return None
+        return checksum.hexdigest()
 
     def uploadFileToFolder(self, folderId, filepath, reference=None, mimeType=None, filename=None,
                            progressCallback=None):
@@ -1001,7 +1217,7 @@ class GirderClient(object):
             return self.uploadStreamToFolder(folderId, f, filename, filesize, reference, mimeType,
                                              progressCallback)
 
-    def _uploadContents(self, uploadObj, stream, size, progressCallback=None):
+    def _uploadContents(self, uploadObj, stream, size, progressCallback=None, offset=0):
         """
         Uploads contents of a file.
 
@@ -1017,52 +1233,209 @@ class GirderClient(object):
             with progress information. It passes a single positional argument
             to the callable which is a dict of information about progress.
         :type progressCallback: callable
+        :param offset: The number of bytes of the file that the server has
+            already received, when resuming an upload.
+        :type offset: int
         """
-        offset = 0
+        s3Info = uploadObj.get('s3') or {}
+        if (uploadObj.get('behavior') == 's3' and s3Info.get('chunked') and
+                self.uploadWorkers > 1 and not offset):
+            return self._uploadContentsToS3(uploadObj, stream, size, progressCallback)
+
+        upload = uploadObj
         uploadId = uploadObj['_id']
+        # Prior to version 2.2 the server only supported multipart uploads
+        multipart = self.getServerVersion() < ['2', '2']
 
         with self.progressReporterCls(label=uploadObj.get('name', ''), length=size) as reporter:
+            reporter.update(offset)
+            chunks = _ChunkReader(stream, size, self.MAX_CHUNK_SIZE, offset)
+            try:
+                for offset, chunk in chunks:
+                    uploadObj = self._sendChunkWithRetries(
+                        upload, offset, chunk, reporter, multipart,
+                        final=offset + len(chunk) == size)
+                    offset += len(chunk)
+
+                    if callable(progressCallback):
+                        progressCallback({
+                            'current': offset,
+                            'total': size,
+                            'uploadId': uploadId
+                        })
+            finally:
+                chunks.close()
 
-            while True:
-                chunk = stream.read(min(self.MAX_CHUNK_SIZE, (size - offset)))
+        if offset != size:
+            self.delete('file/upload/' + uploadId)
+            raise IncorrectUploadLengthError(
+                'Expected upload to be %d bytes, but received %d.' % (size, offset),
+                upload=uploadObj)
 
-                if not chunk:
-                    break
+        return uploadObj
 
-                if isinstance(chunk, six.text_type):
-                    chunk = chunk.encode('utf8')
+    def _sendChunk(self, uploadId, offset, chunk, reporter, multipart):
+        if not multipart:
+            uploadObj = self.post(
+                'file/chunk?offset=%d&uploadId=%s' % (offset, uploadId),
+                data=_ProgressBytesIO(chunk, reporter=reporter))
+        else:
+            parameters = {
+                'offset': offset,
+                'uploadId': uploadId
+            }
 
-                if self.getServerVersion() >= ['2', '2']:
-                    uploadObj = self.post(
-                        'file/chunk?offset=%d&uploadId=%s' % (offset, uploadId),
-                        data=_ProgressBytesIO(chunk, reporter=reporter))
-                else:
-                    # Prior to version 2.2 the server only supported multipart uploads
-                    parameters = {
-                        'offset': offset,
-                        'uploadId': uploadId
-                    }
+            m = _ProgressMultiPartEncoder(
+                reporter=reporter,
+                fields={'chunk': ('chunk', chunk, 'application/octet-stream')},
+            )
+
+            uploadObj = self.post('file/chunk', parameters=parameters,
+                                  data=m, headers={'Content-Type': m.content_type})
+
+        if '_id' not in uploadObj:
+            raise Exception(
+                'After uploading a file chunk, did not receive object with _id. '
+                'Got instead: ' + json.dumps(uploadObj))
+        return uploadObj
 
-                    m = _ProgressMultiPartEncoder(
-                        reporter=reporter,
-                        fields={'chunk': ('chunk', chunk, 'application/octet-stream')},
-                    )
+    def _sendChunkWithRetries(self, upload, offset, chunk, reporter, multipart, final=False):
+        """
+        Send a chunk of an upload through Girder. After a failure, the offset
+        the server has recorded is requested, so that a chunk that was stored
+        before the failure is not sent again.
+
+        If the response to the final chunk is lost, the server may already
+        have finalized the upload and deleted it. The file it created is then
+        looked up by the ID of the upload.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._sendChunk(upload['_id'], offset, chunk, reporter, multipart)
+            except Exception as exc:
+                if attempt >= self.uploadRetries or not self._isRetryable(exc):
+                    raise
+                time.sleep(self.uploadRetryBackoff * 2 ** attempt)
+                attempt += 1
+
+                try:
+                    received = self.getUploadOffset(upload['_id'])
+                except HttpError as offsetExc:
+                    file = None
+                    if final and offsetExc.status == 400:
+                        file = self._findUploadedFile(upload)
+                    if file is None:
+                        raise exc
+                    return file
+                if received == offset + len(chunk):
+                    if final:
+                        # The data was stored, but the upload was not finalized
+                        return self.post('file/completion', parameters={'uploadId': upload['_id']})
+                    return upload
+                if not offset <= received < offset + len(chunk):
+                    raise
+                chunk = chunk[received - offset:]
+                offset = received
+
+    def _findUploadedFile(self, upload):
+        """
+        Find the file created by finalizing an upload.
+
+        :param upload: The upload object, with at least its _id.
+        :type upload: dict
+        :returns: The file, or None if the upload did not create one.
+        """
+        try:
+            return self.get('file/upload/%s/file' % upload['_id'])
+        except HttpError as exc:
+            if exc.status == 400:
+                return None
+            raise
 
-                    uploadObj = self.post('file/chunk', parameters=parameters,
-                                          data=m, headers={'Content-Type': m.content_type})
+    def _retry(self, func):
+        """
+        Call a function, retrying it with exponential backoff after a
+        connection failure or server error.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as exc:
+                if attempt >= self.uploadRetries or not self._isRetryable(exc):
+                    raise
+                time.sleep(self.uploadRetryBackoff * 2 ** attempt)
+                attempt += 1
 
-                if '_id' not in uploadObj:
-                    raise Exception(
-                        'After uploading a file chunk, did not receive object with _id. '
-                        'Got instead: ' + json.dumps(uploadObj))
+    @staticmethod
+    def _isRetryable(exc):
+        if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return True
+        return (isinstance(exc, requests.HTTPError) and exc.response is not None and
+                exc.response.status_code >= 500)
 
-                offset += len(chunk)
+    def _uploadContentsToS3(self, uploadObj, stream, size, progressCallback=None):
+        """
+        Uploads the contents of a file directly to S3 as a multipart upload,
+        sending up to ``uploadWorkers`` parts at once. Girder only signs the
+        request for each part.
+        """
+        uploadId = uploadObj['_id']
+        s3Info = uploadObj['s3']
+        chunkLength = s3Info['chunkLength']
 
-                if callable(progressCallback):
-                    progressCallback({
-                        'current': offset,
-                        'total': size
+        def s3Request(method, url, **kwargs):
+            resp = requests.request(method, url, **kwargs)
+            resp.raise_for_status()
+            return resp
+
+        request = s3Info['request']
+        resp = self._retry(lambda: s3Request(
+            request['method'], request['url'], headers=request.get('headers')))
+        s3UploadId = re.search('<UploadId>(.*)</UploadId>', resp.text).group(1)
+
+        eTags = {}
+        lock = threading.Lock()
+        progress = {'current': 0}
+
+        with self.progressReporterCls(label=uploadObj.get('name', ''), length=size) as reporter:
+            def sendPart(partNumber, data):
+                def send():
+                    signed = self.post('file/chunk', parameters={
+                        'offset': 0,
+                        'uploadId': uploadId,
+                        'chunk': json.dumps({
+                            's3UploadId': s3UploadId,
+                            'partNumber': partNumber,
+                            'contentLength': len(data)
+                        })
                     })
+                    partRequest = signed['s3']['request']
+                    return s3Request(partRequest['method'], partRequest['url'], data=data,
+                                     headers={'Content-Length': str(len(data))})
+
+                eTag = self._retry(send).headers['ETag']
+                with lock:
+                    eTags[partNumber] = eTag
+                    progress['current'] += len(data)
+                    reporter.update(len(data))
+                    if callable(progressCallback):
+                        progressCallback({
+                            'current': progress['current'],
+                            'total': size,
+                            'uploadId': uploadId
+                        })
+
+            offset = 0
+            chunks = _ChunkReader(stream, size, chunkLength)
+            try:
+                with _WorkerPool(self.uploadWorkers) as pool:
+                    for partNumber, (offset, chunk) in enumerate(chunks, 1):
+                        pool.submit(lambda n=partNumber, c=chunk: sendPart(n, c))
+                        offset += len(chunk)
+            finally:
+                chunks.close()
 
         if offset != size:
             self.delete('file/upload/' + uploadId)
@@ -1070,7 +1443,59 @@ class GirderClient(object):
                 'Expected upload to be %d bytes, but received %d.' % (size, offset),
                 upload=uploadObj)
 
-        return uploadObj
+        file = self.post('file/completion', parameters={'uploadId': uploadId})
+        request = file.pop('s3FinalizeRequest')
+        body = '<CompleteMultipartUpload>%s</CompleteMultipartUpload>' % ''.join(
+            '<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>' % (
+                partNumber, eTags[partNumber]) for partNumber in sorted(eTags))
+        self._retry(lambda: s3Request(
+            request['method'], request['url'], data=body, headers=request.get('headers')))
+        return file
+
+    def getUploadOffset(self, uploadId):
+        """
+        Get the number of bytes of an upload that the server has received.
+
+        :param uploadId: The ID of the upload.
+        :type uploadId: str
+        :returns: The offset at which the upload should be resumed.
+        :rtype: int
+        """
+        return self.get('file/offset', parameters={'uploadId': uploadId})['offset']
+
+    def resumeUpload(self, uploadId, stream, size, progressCallback=None):
+        """
+        Resume an upload that was interrupted, for instance by a crash of the
+        uploading process, sending only the data the server has not received.
+        The ID of an upload is available in the information passed to the
+        ``progressCallback`` of the upload methods. If the upload was already
+        completed, the file it created is returned. Direct multipart uploads
+        to S3 cannot be resumed this way.
+
+        :param uploadId: The ID of the upload.
+        :type uploadId: str
+        :param stream: Readable stream object positioned at the start of the
+            file. It must be seekable if any data has already been received.
+        :type stream: file-like
+        :param size: The length of the file.
+        :type size: int
+        :param progressCallback: If passed, will be called after each chunk
+            with progress information.
+        :type progressCallback: callable
+        :returns: The file that was created on the server.
+        """
+        try:
+            offset = self.getUploadOffset(uploadId)
+        except HttpError as exc:
+            # The upload may already have been completed
+            file = self._findUploadedFile({'_id': uploadId}) if exc.status == 400 else None
+            if file is None:
+                raise
+            return file
+        if offset:
+            stream.seek(stream.tell() + offset, os.SEEK_SET)
+        return self._uploadContents(
+            {'_id': uploadId}, stream, size, progressCallback=progressCallback, offset=offset)
 
     def uploadFile(self, parentId, stream, name, size, parentType='item',
                    progressCallback=None, reference=None, mimeType=None):
@@ -1109,11 +1534,9 @@ class GirderClient(object):
         }
         if reference is not None:
             params['reference'] = reference
-        obj = self.post('file', params)
-        if '_id' not in obj:
-            raise Exception(
-                'After creating an upload token for a new file, expected '
-                'an object with an id. Got instead: ' + json.dumps(obj))
+        obj = self._createUpload(params, stream, size)
+        if obj.get('_modelType') == 'file':
+            return obj
 
         return self._uploadContents(obj, stream, size, progressCallback=progressCallback)
 
@@ -1169,6 +1592,64 @@ class GirderClient(object):
         obj = self.put(path, json=metadata)
         return obj
 
+    def addMetadataToItems(self, updates=None, query=None, metadata=None, allowNull=False,
+                           batchSize=METADATA_BATCH_SIZE):
+        """
+        Set metadata on many items with as few requests as possible. Either
+        pass the metadata for each item in ``updates``, which is sent in
+        batches of ``batchSize`` items, or pass a ``query`` selecting the items
+        and the ``metadata`` to set on all of them that the user can write.
+
+        :param updates: The metadata to set on each item, keyed by item ID, or
+            an iterable of (itemId, metadata) pairs.
+        :type updates: dict or iterable
+        :param query: A MongoDB query selecting the items to update. IDs in the
+            query must be passed as ``{"$oid": id}``.
+        :type query: dict
+        :param metadata: The metadata to set on the items matched by ``query``.
+        :type metadata: dict
+        :param allowNull: Whether ``None`` values are set rather than deleting
+            the metadata field.
+        :type allowNull: bool
+        :param batchSize: The maximum number of items updated by each request.
+        :type batchSize: int
+        :returns: The number of items that were updated.
+        """
+        return self._setMetadataMany('item', updates, query, metadata, allowNull, batchSize)
+
+    def addMetadataToFolders(self, updates=None, query=None, metadata=None, allowNull=False,
+                             batchSize=METADATA_BATCH_SIZE):
+        """
+        Set metadata on many folders with as few requests as possible. This
+        takes the same parameters as :py:meth:`addMetadataToItems`.
+
+        :returns: The number of folders that were updated.
+        """
+        return self._setMetadataMany('folder', updates, query, metadata, allowNull, batchSize)
+
+    def _setMetadataMany(self, resourceType, updates, query, metadata, allowNull, batchSize):
+        path = resourceType + '/metadata'
+        params = {'allowNull': json.dumps(allowNull)}
+        if query is not None:
+            params.update({
+                'query': json.dumps(query),
+                'metadata': json.dumps(metadata)
+            })
+            return self.put(path, data=params)['updated']
+
+        if isinstance(updates, dict):
+            updates = six.viewitems(updates)
+        updated = 0
+        batch = []
+        for resourceId, resourceMetadata in updates:
+            batch.append({'_id': resourceId, 'metadata': resourceMetadata})
+            if len(batch) == batchSize:
+                updated += self.put(path, data=dict(params, updates=json.dumps(batch)))['updated']
+                batch = []
+        if batch:
+            updated += self.put(path, data=dict(params, updates=json.dumps(batch)))['updated']
+        return updated
+
     def transformFilename(self, name):
         """
         Sanitize a resource name from Girder into a name that is safe to use
@@ -1197,14 +1678,65 @@ class GirderClient(object):
             # assume `path` is a file-like object
             shutil.copyfileobj(fp, path)
 
+    @contextmanager
+    def _concurrentDownloads(self):
+        """
+        Within this context, files that :py:meth:`downloadFile` writes to a
+        local path are fetched by a pool of ``downloadWorkers`` threads while
+        the caller keeps walking the hierarchy. The workers share a session
+        whose connection pool has one connection per worker. Every download
+        has finished when the context exits. Nested contexts share the
+        outermost pool.
+        """
+        if self.downloadWorkers <= 1 or self._downloadPool is not None:
+            yield
+            return
+
+        ownSession = self._session is None
+        if ownSession:
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.downloadWorkers)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+        try:
+            with _WorkerPool(self.downloadWorkers) as pool:
+                self._downloadPool = pool
+                yield
+        finally:
+            self._downloadPool = None
+            if ownSession:
+                self._session.close()
+                self._session = None
+
     def downloadFile(self, fileId, path, created=None):
         """
         Download a file to the given local path or file-like object.
 
+        When downloading to a path, the data is first written to
+        ``<path>.partial``, which is renamed once the download is complete. If
+        that file already exists from an interrupted download of the same
+        version of the file, only the rest of the file is requested from the
+        server. The version is recorded in ``<path>.partial.json``.
+
         :param fileId: The ID of the Girder file to download.
         :param path: The path to write the file to, or a file-like object.
+        :raises IncorrectDownloadLengthError: If the downloaded data does not
+            have the size of the file. A download that stopped early can be
+            resumed by calling this again.
         """
-        created = created or self.getFile(fileId)['created']
+        self._submitDownload(fileId, path, {'created': created} if created else None)
+
+    def _submitDownload(self, fileId, path, file):
+        if self._downloadPool is not None and isinstance(path, six.string_types):
+            self._downloadPool.submit(lambda: self._downloadFile(
+                fileId, path, file, _NoopProgressReporter))
+        else:
+            self._downloadFile(fileId, path, file, self.progressReporterCls)
+
+    def _downloadFile(self, fileId, path, file, progressReporterCls):
+        if not file or ('size' not in file and 'linkUrl' not in file):
+            file = self.getFile(fileId)
+        created = file['created']
         cacheKey = '\n'.join([self.urlBase, fileId, created])
 
         # see if file is in local cache
@@ -1215,38 +1747,86 @@ class GirderClient(object):
                     self._copyFile(fp, path)
                 return
 
-        # download to a tempfile
         progressFileName = fileId
+        offset = 0
+        infoPath = None
         if isinstance(path, six.string_types):
             progressFileName = os.path.basename(path)
+            _safeMakedirs(os.path.dirname(path))
+            tmpPath = path + '.partial'
+            infoPath = tmpPath + '.json'
+            # A partial file is only resumed if it is of the same version of
+            # the file on the server
+            version = {'_id': fileId, 'created': created, 'size': file.get('size')}
+            if os.path.isfile(tmpPath) and _readJson(infoPath) == version:
+                offset = os.path.getsize(tmpPath)
+            with open(infoPath, 'w') as f:
+                json.dump(version, f)
+        else:
+            # download to a tempfile
+            with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                tmpPath = tmp.name
 
         url = '%sfile/%s/download' % (self.urlBase, fileId)
-        req = self._requestFunc('get')(url, stream=True, headers={'Girder-Token': self.token})
+        headers = {'Girder-Token': self.token}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        req = self._requestFunc('get')(url, stream=True, headers=headers)
+        if req.status_code == 416:
+            # The partial file is not shorter than the file; start over
+            req.close()
+            del headers['Range']
+            req = self._requestFunc('get')(url, stream=True, headers=headers)
         if not req.ok:
             raise HttpError(req.status_code, req.text, url, 'GET', response=req)
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            with self.progressReporterCls(
+        if req.status_code != 206:
+            offset = 0
+
+        with open(tmpPath, 'ab' if offset else 'wb') as tmp:
+            with progressReporterCls(
                     label=progressFileName,
-                    length=int(req.headers.get('content-length', 0))) as reporter:
+                    length=offset + int(req.headers.get('content-length', 0))) as reporter:
+                reporter.update(offset)
                 for chunk in req.iter_content(chunk_size=REQ_BUFFER_SIZE):
                     reporter.update(len(chunk))
                     tmp.write(chunk)
 
+        self._checkDownloadLength(file, tmpPath, infoPath)
+
         # save file in cache
         if self.cache is not None:
-            with open(tmp.name, 'rb') as fp:
+            with open(tmpPath, 'rb') as fp:
                 self.cache.set(cacheKey, fp, read=True)
 
         if isinstance(path, six.string_types):
-            # we can just rename the tempfile
-            _safeMakedirs(os.path.dirname(path))
-            shutil.move(tmp.name, path)
+            # we can just rename the partial file
+            shutil.move(tmpPath, path)
+            os.remove(infoPath)
         else:
             # write to file-like object
-            with open(tmp.name, 'rb') as fp:
+            with open(tmpPath, 'rb') as fp:
                 shutil.copyfileobj(fp, path)
             # delete the temp file
-            os.remove(tmp.name)
+            os.remove(tmpPath)
+
+    @staticmethod
+    def _checkDownloadLength(file, tmpPath, infoPath):
+        """
+        Raise an IncorrectDownloadLengthError if the data downloaded to a
+        temporary file does not have the size of the file. A partial file that
+        is too short is kept, so that the download can be resumed.
+        """
+        # Links are downloaded from elsewhere, so their size is not known
+        received = os.path.getsize(tmpPath)
+        if file.get('linkUrl') or received == file['size']:
+            return
+        if received > file['size'] or infoPath is None:
+            os.remove(tmpPath)
+            if infoPath is not None:
+                os.remove(infoPath)
+        raise IncorrectDownloadLengthError(
+            'Expected download to be %d bytes, but received %d.' % (file['size'], received),
+            file=file)
 
     def downloadItem(self, itemId, dest, name=None):
         """
@@ -1261,6 +1841,10 @@ class GirderClient(object):
         :param name: If the item name is known in advance, you may pass it here
             which will save a lookup to the server.
         """
+        with self._concurrentDownloads():
+            self._downloadItem(itemId, dest, name)
+
+    def _downloadItem(self, itemId, dest, name):
         if name is None:
             item = self.get('item/' + itemId)
             name = item['name']
@@ -1275,20 +1859,20 @@ class GirderClient(object):
 
             if first:
                 if len(files) == 1 and files[0]['name'] == name:
-                    self.downloadFile(
+                    self._submitDownload(
                         files[0]['_id'],
                         os.path.join(dest, self.transformFilename(name)),
-                        created=files[0]['created'])
+                        files[0])
                     break
                 else:
                     dest = os.path.join(dest, self.transformFilename(name))
                     _safeMakedirs(dest)
 
             for file in files:
-                self.downloadFile(
+                self._submitDownload(
                     file['_id'],
                     os.path.join(dest, self.transformFilename(file['name'])),
-                    created=file['created'])
+                    file)
 
             first = False
             offset += len(files)
@@ -1307,6 +1891,10 @@ class GirderClient(object):
             cache and skip download provided that metadata is identical.
         :type sync: bool
         """
+        with self._concurrentDownloads():
+            self._downloadFolderRecursive(folderId, dest, sync)
+
+    def _downloadFolderRecursive(self, folderId, dest, sync):
         offset = 0
         folderId = self._checkResourcePath(folderId)
         while True:
@@ -1321,7 +1909,7 @@ class GirderClient(object):
                 local = os.path.join(dest, self.transformFilename(folder['name']))
                 _safeMakedirs(local)
 
-                self.downloadFolderRecursive(folder['_id'], local, sync=sync)
+                self._downloadFolderRecursive(folder['_id'], local, sync=sync)
 
             offset += len(folders)
             if len(folders) < DEFAULT_PAGE_LIMIT:
@@ -1342,7 +1930,7 @@ class GirderClient(object):
                 if (sync and _id in self.localMetadata and
                         _compareDicts(item, self.localMetadata[_id])):
                     continue
-                self.downloadItem(item['_id'], dest, name=item['name'])
+                self._downloadItem(item['_id'], dest, item['name'])
 
             offset += len(items)
             if len(items) < DEFAULT_PAGE_LIMIT:
@@ -1364,6 +1952,10 @@ class GirderClient(object):
             cache and skip download if the metadata is identical.
         :type sync: bool
         """
+        with self._concurrentDownloads():
+            self._downloadResource(resourceId, dest, resourceType, sync)
+
+    def _downloadResource(self, resourceId, dest, resourceType, sync):
         if resourceType == 'folder':
             self.downloadFolderRecursive(resourceId, dest, sync)
         elif resourceType in ('collection', 'user'):
@@ -233,8 +233,11 @@ _short_help = 'Download files from Girder'
 @main.command('download', short_help=_short_help, help='%s\n\n%s' % (
     _short_help, _common_help.replace('LOCAL_FOLDER', 'LOCAL_FOLDER (default: ".")')))
 @_CommonParameters(additional_parent_types=['collection', 'user', 'item'], path_default='.')
+@click.option('--parallel', default=1, show_default=True, type=click.IntRange(min=1),
+              help='number of files to download at once')
 @click.pass_obj
-def _download(gc, parent_type, parent_id, local_folder):
+def _download(gc, parent_type, parent_id, local_folder, parallel):
+    gc.downloadWorkers = parallel
     if parent_type == 'auto':
         parent_type = _lookup_parent_type(gc, parent_id)
     if parent_type == 'item':
@@ -248,8 +251,11 @@ _short_help = 'Synchronize local folder with remote Girder folder'
 
 @main.command('localsync', short_help=_short_help, help='%s\n\n%s' % (_short_help, _common_help))
 @_CommonParameters(additional_parent_types=[])
+@click.option('--parallel', default=1, show_default=True, type=click.IntRange(min=1),
+              help='number of files to download at once')
 @click.pass_obj
-def _localsync(gc, parent_type, parent_id, local_folder):
+def _localsync(gc, parent_type, parent_id, local_folder, parallel):
+    gc.downloadWorkers = parallel
     if parent_type != 'folder':
         raise Exception('localsync command only accepts parent-type of folder')
     gc.loadLocalMetadata(local_folder)
@@ -275,9 +281,17 @@ _short_help = 'Upload files to Girder'
               help='comma-separated list of filenames to ignore')
 @click.option('--reference', default=None,
               help='optional reference to send along with the upload')
+@click.option('--parallel', default=1, show_default=True, type=click.IntRange(min=1),
+              help='number of chunks of a file to send at once to assetstores that '
+                   'accept chunks out of order, such as S3')
+@click.option('--retries', default=3, show_default=True, type=click.IntRange(min=0),
+              help='number of times to retry sending a chunk after a connection '
+                   'failure or server error')
 @click.pass_obj
 def _upload(gc, parent_type, parent_id, local_folder,
-            leaf_folders_as_items, reuse, blacklist, dry_run, reference):
+            leaf_folders_as_items, reuse, blacklist, dry_run, reference, parallel, retries):
+    gc.uploadWorkers = parallel
+    gc.uploadRetries = retries
     if parent_type == 'auto':
         parent_type = _lookup_parent_type(gc, parent_id)
     gc.upload(
@@ -199,8 +199,7 @@ def getCurrentToken(allowCookie=False):
     if not tokenStr:
         return None
 
-    return ModelImporter.model('token').load(tokenStr, force=True,
-                                             objectId=False)
+    return ModelImporter.model('token').loadCached(tokenStr)
 
 
 @_cacheAuthUser
@@ -238,7 +237,7 @@ def getCurrentUser(returnToken=False):
         except AccessException:
             return retVal(None, token)
 
-        user = ModelImporter.model('user').load(token['userId'], force=True)
+        user = ModelImporter.model('user').loadCached(token['userId'])
         return retVal(user, token)
 
 
@@ -610,8 +609,10 @@ def endpoint(fun):
         try:
             val = fun(self, args, kwargs)
 
-            # If this is a partial response, we set the status appropriately
-            if 'Content-Range' in cherrypy.response.headers:
+            # If this is a partial response, we set the status appropriately.
+            # A Content-Range of "bytes */<size>" accompanies a 416 instead.
+            contentRange = cherrypy.response.headers.get('Content-Range')
+            if contentRange and not contentRange.startswith('bytes */'):
                 cherrypy.response.status = 206
 
             if callable(val):
@@ -99,10 +99,7 @@ class _FileHandle(paramiko.SFTPHandle, ModelImporter):
             raise IOError(
                 'Requested chunk length (%d) is larger than the maximum allowed.' % length)
 
-        if offset != self._handle.tell() and offset < self.file['size']:
-            self._handle.seek(offset)
-
-        return self._handle.read(length)
+        return self._handle.pread(length, offset)
 
     def stat(self):
         return _stat(self.file, 'file')
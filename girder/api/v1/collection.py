@@ -120,12 +120,19 @@ class Collection(Resource):
         setResponseHeader('Content-Type', 'application/zip')
         setContentDisposition(collection['name'] + '.zip')
 
+        if ziputil.seekableDownloads():
+            zip = ziputil.SeekableZipGenerator(collection['name'])
+            zip.addFileList(self.model('collection').fileList(
+                collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter,
+                data=False))
+            return zip.download()
+
         def stream():
             zip = ziputil.ZipGenerator(collection['name'])
-            for (path, file) in self.model('collection').fileList(
-                    collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter):
-                for data in zip.addFile(file, path):
-                    yield data
+            for data in zip.addFiles(self.model('collection').fileList(
+                    collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter,
+                    data=False)):
+                yield data
             yield zip.footer()
         return stream
 
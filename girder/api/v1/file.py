@@ -20,8 +20,10 @@
 import cherrypy
 import errno
 import os
+import re
 import six
 
+from bson.objectid import ObjectId
 from ..describe import Description, autoDescribeRoute, describeRoute
 from ..rest import Resource, RestException, filtermodel
 from ...constants import AccessType, TokenScope
@@ -45,6 +47,7 @@ class File(Resource):
         self.route('GET', (':id',), self.getFile)
         self.route('GET', (':id', 'download'), self.download)
         self.route('GET', (':id', 'download', ':name'), self.downloadWithName)
+        self.route('GET', ('upload', ':id', 'file'), self.getUploadedFile)
         self.route('POST', (), self.initUpload)
         self.route('POST', ('chunk',), self.readChunk)
         self.route('POST', ('completion',), self.finalizeUpload)
@@ -86,12 +89,16 @@ class File(Resource):
                required=False)
         .param('assetstoreId', 'Direct the upload to a specific assetstore (admin-only).',
                required=False)
+        .param('sha512', 'The hex SHA-512 digest of the file contents. If the assetstore '
+               'already holds these contents in a file that you can read, the file is '
+               'created from them and returned, and no data needs to be sent.',
+               required=False)
         .errorResponse()
         .errorResponse('Write access was denied on the parent folder.', 403)
         .errorResponse('Failed to create upload.', 500)
     )
     def initUpload(self, parentType, parentId, name, size, mimeType, linkUrl, reference,
-                   assetstoreId):
+                   assetstoreId, sha512):
         """
         Before any bytes of the actual file are sent, a request should be made
         to initialize the upload. This creates the temporary record of the
@@ -116,6 +123,16 @@ class File(Resource):
                     user, message='You must be an admin to select a destination assetstore.')
                 assetstore = self.model('assetstore').load(assetstoreId)
 
+            if sha512 and size > 0:
+                if not re.match(r'^[0-9a-fA-F]{128}$', sha512):
+                    raise RestException('The sha512 parameter must be a hex SHA-512 digest.')
+                file = self.model('upload').uploadFromDuplicate(
+                    user=user, name=name, parentType=parentType, parent=parent, size=size,
+                    sha512=sha512, mimeType=mimeType, reference=reference,
+                    assetstore=assetstore)
+                if file is not None:
+                    return self.model('file').filter(file, user)
+
             chunk = None
             if size > 0 and cherrypy.request.headers.get('Content-Length'):
                 ct = cherrypy.request.body.content_type.value
@@ -178,6 +195,28 @@ class File(Resource):
         extraKeys = file.get('additionalFinalizeKeys', ())
         return self.model('file').filter(file, user, additionalKeys=extraKeys)
 
+    @access.user(scope=TokenScope.DATA_READ)
+    @filtermodel(model='file')
+    @autoDescribeRoute(
+        Description('Get the file created by a completed upload.')
+        .notes('A client whose request to send the last chunk of an upload or '
+               'to finalize it failed can use this to find out whether the '
+               'upload was completed.')
+        .param('id', 'The ID of the upload.', paramType='path')
+        .errorResponse('No file was created by the upload.')
+        .errorResponse('You are not the user who initiated the upload.', 403)
+    )
+    def getUploadedFile(self, id):
+        user = self.getCurrentUser()
+        file = None
+        if ObjectId.is_valid(id):
+            file = self.model('file').findOne({'uploadId': ObjectId(id)})
+        if file is None:
+            raise RestException('No file was created by the upload.')
+        if file['creatorId'] != user['_id'] and not user['admin']:
+            raise AccessException('You did not initiate this upload.')
+        return file
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
         Description('Request required offset before resuming an upload.')
@@ -17,10 +17,13 @@
 #  limitations under the License.
 ###############################################################################
 
+from bson.objectid import ObjectId
+
 from ..describe import Description, autoDescribeRoute
 from ..rest import Resource, RestException, filtermodel, setResponseHeader, setContentDisposition
 from girder.api import access
 from girder.constants import AccessType, TokenScope
+from girder.models.model_base import AccessException
 from girder.utility import ziputil
 from girder.utility.progress import ProgressContext
 
@@ -44,6 +47,7 @@ class Folder(Resource):
         self.route('PUT', (':id', 'access'), self.updateFolderAccess)
         self.route('POST', (':id', 'copy'), self.copyFolder)
         self.route('PUT', (':id', 'metadata'), self.setMetadata)
+        self.route('PUT', ('metadata',), self.setMetadataMany)
         self.route('DELETE', (':id', 'metadata'), self.deleteMetadata)
 
     @access.public(scope=TokenScope.DATA_READ)
@@ -130,12 +134,17 @@ class Folder(Resource):
         setContentDisposition(folder['name'] + '.zip')
         user = self.getCurrentUser()
 
+        if ziputil.seekableDownloads():
+            zip = ziputil.SeekableZipGenerator(folder['name'])
+            zip.addFileList(self.model('folder').fileList(
+                folder, user=user, subpath=False, mimeFilter=mimeFilter, data=False))
+            return zip.download()
+
         def stream():
             zip = ziputil.ZipGenerator(folder['name'])
-            for (path, file) in self.model('folder').fileList(
-                    folder, user=user, subpath=False, mimeFilter=mimeFilter):
-                for data in zip.addFile(file, path):
-                    yield data
+            for data in zip.addFiles(self.model('folder').fileList(
+                    folder, user=user, subpath=False, mimeFilter=mimeFilter, data=False)):
+                yield data
             yield zip.footer()
         return stream
 
@@ -303,6 +312,66 @@ class Folder(Resource):
     def setMetadata(self, folder, metadata, allowNull):
         return self.model('folder').setMetadata(folder, metadata, allowNull=allowNull)
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Set metadata fields on many folders.')
+        .notes('Pass either a list of updates, or a query and the metadata to set on '
+               'every folder it matches that you have write access to. Set metadata '
+               'fields to null in order to delete them. Returns the number of '
+               'folders that were updated.')
+        .jsonParam('updates', 'A JSON list of objects, each with the "_id" of a folder '
+                   'and the "metadata" to set on it.', required=False, schema={
+                       'type': 'array',
+                       'items': {
+                           'type': 'object',
+                           'properties': {
+                               '_id': {'type': 'string', 'pattern': '^[0-9a-f]{24}$'},
+                               'metadata': {'type': 'object'}
+                           },
+                           'required': ['_id', 'metadata']
+                       }
+                   })
+        .jsonParam('query', 'A JSON object containing the MongoDB query that selects '
+                   'the folders to update. Unless you are an admin, it must match one '
+                   '"parentId" and may otherwise only match exact values of "meta.*" '
+                   'fields.', required=False, requireObject=True)
+        .jsonParam('metadata', 'A JSON object containing the metadata keys to add to '
+                   'the folders matched by the query.', required=False, requireObject=True)
+        .param('allowNull', 'Whether "null" is allowed as a metadata value.', required=False,
+               dataType='boolean', default=False)
+        .errorResponse(('Neither updates nor a query were passed.',
+                        'The query was not allowed.',
+                        'ID was invalid.',
+                        'Metadata key name was invalid.'))
+        .errorResponse('Write access was denied for a folder.', 403)
+    )
+    def setMetadataMany(self, updates, query, metadata, allowNull):
+        model = self.model('folder')
+        user = self.getCurrentUser()
+        if query is not None:
+            if metadata is None:
+                raise RestException('The metadata parameter is required with a query.')
+            if not user['admin']:
+                model.validateMetadataQuery(query, 'parentId')
+            updates = [(folder['_id'], metadata) for folder in model.findWithPermissions(
+                query, fields=['_id'], user=user, level=AccessType.WRITE)]
+        elif updates is not None:
+            updates = [(ObjectId(update['_id']), update['metadata']) for update in updates]
+            ids = [id for id, _ in updates]
+            found = {folder['_id'] for folder in model.find(
+                {'_id': {'$in': ids}}, fields=['_id'])}
+            writable = {folder['_id'] for folder in model.findWithPermissions(
+                {'_id': {'$in': ids}}, fields=['_id'], user=user, level=AccessType.WRITE)}
+            for id, _ in updates:
+                if id not in found:
+                    raise RestException('Invalid folder id (%s).' % id)
+                if id not in writable:
+                    raise AccessException('Write access denied for folder %s.' % id)
+        else:
+            raise RestException('Either updates or a query must be passed.')
+
+        return {'updated': model.setMetadataMany(updates, allowNull=allowNull)}
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @filtermodel(model='folder')
     @autoDescribeRoute(
@@ -17,10 +17,13 @@
 #  limitations under the License.
 ###############################################################################
 
+from bson.objectid import ObjectId
+
 from ..describe import Description, autoDescribeRoute
 from ..rest import Resource, RestException, filtermodel, setResponseHeader, setContentDisposition
 from girder.utility import ziputil
 from girder.constants import AccessType, TokenScope
+from girder.models.model_base import AccessException
 from girder.api import access
 
 
@@ -39,6 +42,7 @@ class Item(Resource):
         self.route('PUT', (':id',), self.updateItem)
         self.route('POST', (':id', 'copy'), self.copyItem)
         self.route('PUT', (':id', 'metadata'), self.setMetadata)
+        self.route('PUT', ('metadata',), self.setMetadataMany)
         self.route('DELETE', (':id', 'metadata'), self.deleteMetadata)
 
     @access.public(scope=TokenScope.DATA_READ)
@@ -176,6 +180,67 @@ class Item(Resource):
     def setMetadata(self, item, metadata, allowNull):
         return self.model('item').setMetadata(item, metadata, allowNull=allowNull)
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Set metadata fields on many items.')
+        .notes('Pass either a list of updates, or a query and the metadata to set on '
+               'every item it matches that you have write access to. Set metadata '
+               'fields to null in order to delete them. Returns the number of '
+               'items that were updated.')
+        .jsonParam('updates', 'A JSON list of objects, each with the "_id" of an item '
+                   'and the "metadata" to set on it.', required=False, schema={
+                       'type': 'array',
+                       'items': {
+                           'type': 'object',
+                           'properties': {
+                               '_id': {'type': 'string', 'pattern': '^[0-9a-f]{24}$'},
+                               'metadata': {'type': 'object'}
+                           },
+                           'required': ['_id', 'metadata']
+                       }
+                   })
+        .jsonParam('query', 'A JSON object containing the MongoDB query that selects '
+                   'the items to update. Unless you are an admin, it must match one '
+                   '"folderId" and may otherwise only match exact values of "meta.*" '
+                   'fields.', required=False, requireObject=True)
+        .jsonParam('metadata', 'A JSON object containing the metadata keys to add to '
+                   'the items matched by the query.', required=False, requireObject=True)
+        .param('allowNull', 'Whether "null" is allowed as a metadata value.', required=False,
+               dataType='boolean', default=False)
+        .errorResponse(('Neither updates nor a query were passed.',
+                        'The query was not allowed.',
+                        'ID was invalid.',
+                        'Metadata key name was invalid.'))
+        .errorResponse('Write access was denied for an item.', 403)
+    )
+    def setMetadataMany(self, updates, query, metadata, allowNull):
+        model = self.model('item')
+        user = self.getCurrentUser()
+        if query is not None:
+            if metadata is None:
+                raise RestException('The metadata parameter is required with a query.')
+            if not user['admin']:
+                model.validateMetadataQuery(query, 'folderId')
+            cursor = model.find(query, fields=['folderId'])
+            updates = [(item['_id'], metadata) for item in model.filterResultsByPermission(
+                cursor, user, AccessType.WRITE)]
+        elif updates is not None:
+            updates = [(ObjectId(update['_id']), update['metadata']) for update in updates]
+            items = list(model.find(
+                {'_id': {'$in': [id for id, _ in updates]}}, fields=['folderId']))
+            writable = {item['_id'] for item in model.filterResultsByPermission(
+                iter(items), user, AccessType.WRITE)}
+            found = {item['_id'] for item in items}
+            for id, _ in updates:
+                if id not in found:
+                    raise RestException('Invalid item id (%s).' % id)
+                if id not in writable:
+                    raise AccessException('Write access denied for item %s.' % id)
+        else:
+            raise RestException('Either updates or a query must be passed.')
+
+        return {'updated': model.setMetadataMany(updates, allowNull=allowNull)}
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @filtermodel('item')
     @autoDescribeRoute(
@@ -203,11 +268,16 @@ class Item(Resource):
         setResponseHeader('Content-Type', 'application/zip')
         setContentDisposition(item['name'] + '.zip')
 
+        if ziputil.seekableDownloads():
+            zip = ziputil.SeekableZipGenerator(item['name'])
+            zip.addFileList(self.model('item').fileList(item, subpath=False, data=False))
+            return zip.download()
+
         def stream():
             zip = ziputil.ZipGenerator(item['name'])
-            for (path, file) in self.model('item').fileList(item, subpath=False):
-                for data in zip.addFile(file, path):
-                    yield data
+            for data in zip.addFiles(self.model('item').fileList(
+                    item, subpath=False, data=False)):
+                yield data
             yield zip.footer()
         return stream
 
@@ -24,15 +24,14 @@ from datetime import datetime
 
 from ..describe import Description, autoDescribeRoute
 from ..rest import Resource, setResponseHeader
-from girder.utility import JsonEncoder
+from girder.utility import JsonEncoder, notification_stream
 from girder.api import access
 
 # If no timeout param is passed to stream, we default to this value
 DEFAULT_STREAM_TIMEOUT = 300
-# When new events are seen, we will poll at the minimum interval
-MIN_POLL_INTERVAL = 0.5
-# The interval increases when no new events are seen, capping at this value
-MAX_POLL_INTERVAL = 2
+# While waiting for notifications, streams check at least this often whether
+# the server is stopping
+MAX_WAIT_INTERVAL = 2
 
 
 def sseMessage(event):
@@ -59,8 +58,8 @@ class Notification(Resource):
         .notes('This uses long-polling to keep the connection open for '
                'several minutes at a time (or longer) and should be requested '
                'with an EventSource object or other SSE-capable client. '
-               '<p>Notifications are returned within a few seconds of when '
-               'they occur.  When no notification occurs for the timeout '
+               '<p>Notifications are sent as soon as they occur.  When no '
+               'notification occurs for the timeout '
                'duration, the stream is closed. '
                '<p>This connection can stay open indefinitely long.')
         .param('timeout', 'The duration without a notification before the stream is closed.',
@@ -81,20 +80,36 @@ class Notification(Resource):
             since = datetime.utcfromtimestamp(since)
 
         def streamGen():
-            lastUpdate = since
-            start = time.time()
-            wait = MIN_POLL_INTERVAL
-            while cherrypy.engine.state == cherrypy.engine.states.STARTED:
-                wait = min(wait + MIN_POLL_INTERVAL, MAX_POLL_INTERVAL)
-                for event in self.model('notification').get(
-                        user, lastUpdate, token=token):
-                    if lastUpdate is None or event['updated'] > lastUpdate:
-                        lastUpdate = event['updated']
-                    wait = MIN_POLL_INTERVAL
-                    start = time.time()
-                    yield sseMessage(event)
-                if time.time() - start > timeout:
-                    break
+            # Subscribe before reading the outstanding notifications so that
+            # none are missed in between; duplicates are skipped below.
+            subscription = notification_stream.subscribe(user, token)
+            try:
+                lastUpdate = since
+                sent = {}
+                start = time.time()
+                events = self.model('notification').get(user, lastUpdate, token=token)
+                while cherrypy.engine.state == cherrypy.engine.states.STARTED:
+                    for event in events:
+                        previous = sent.get(event['_id'])
+                        if previous is not None and event['updated'] <= previous:
+                            continue
+                        sent[event['_id']] = event['updated']
+                        if lastUpdate is None or event['updated'] > lastUpdate:
+                            lastUpdate = event['updated']
+                        start = time.time()
+                        yield sseMessage(event)
 
-                time.sleep(wait)
+                    remaining = timeout - (time.time() - start)
+                    if remaining < 0:
+                        break
+                    event = subscription.get(min(remaining, MAX_WAIT_INTERVAL))
+                    if event is notification_stream.RESYNC:
+                        events = self.model('notification').get(
+                            user, lastUpdate, token=token)
+                    elif event is None:
+                        events = ()
+                    else:
+                        events = (event, )
+            finally:
+                notification_stream.unsubscribe(subscription)
         return streamGen
@@ -200,16 +200,27 @@ class Resource(BaseResource):
         setResponseHeader('Content-Type', 'application/zip')
         setContentDisposition('Resources.zip')
 
-        def stream():
-            zip = ziputil.ZipGenerator()
+        seekable = ziputil.seekableDownloads()
+
+        def fileList():
             for kind in resources:
                 model = self.model(kind)
                 for id in resources[kind]:
                     doc = model.load(id=id, user=user, level=AccessType.READ)
                     for (path, file) in model.fileList(
-                            doc=doc, user=user, includeMetadata=includeMetadata, subpath=True):
-                        for data in zip.addFile(file, path):
-                            yield data
+                            doc=doc, user=user, includeMetadata=includeMetadata, subpath=True,
+                            data=False):
+                        yield (path, file)
+
+        if seekable:
+            zip = ziputil.SeekableZipGenerator()
+            zip.addFileList(fileList())
+            return zip.download()
+
+        def stream():
+            zip = ziputil.ZipGenerator()
+            for data in zip.addFiles(fileList()):
+                yield data
             yield zip.footer()
         return stream
 
@@ -30,7 +30,8 @@ from girder.api import access
 from girder.constants import GIRDER_ROUTE_ID, GIRDER_STATIC_ROUTE_ID, \
     SettingKey, TokenScope, ACCESS_FLAGS, VERSION
 from girder.models.model_base import GirderException
-from girder.utility import config, install, plugin_utilities, system
+from girder.utility import config, install, plugin_utilities, process_cache, \
+    size_accounting, system
 from girder.utility.path import NotFoundException
 from girder.utility.progress import ProgressContext
 from ..describe import API_VERSION, Description, autoDescribeRoute
@@ -63,6 +64,7 @@ class System(Resource):
         self.route('GET', ('log',), self.getLog)
         self.route('GET', ('log', 'level'), self.getLogLevel)
         self.route('PUT', ('log', 'level'), self.setLogLevel)
+        self.route('GET', ('cache',), self.getCacheStats)
         self.route('POST', ('web_build',), self.buildWebCode)
         self.route('GET', ('setting', 'collection_creation_policy', 'access'),
                    self.getCollectionCreationPolicyAccess)
@@ -378,11 +380,13 @@ class System(Resource):
         title = 'Running system consistency check'
         with ProgressContext(progress, user=user, title=title) as pc:
             results = {}
-            pc.update(title='Checking for orphaned records (Step 1 of 3)')
+            pc.update(title='Checking for orphaned records (Step 1 of 4)')
             results['orphansRemoved'] = self._pruneOrphans(pc)
-            pc.update(title='Checking for incorrect base parents (Step 2 of 3)')
+            pc.update(title='Checking for incorrect ancestors (Step 2 of 4)')
+            results['ancestorsFixed'] = self._fixAncestors(pc)
+            pc.update(title='Checking for incorrect base parents (Step 3 of 4)')
             results['baseParentsFixed'] = self._fixBaseParents(pc)
-            pc.update(title='Checking for incorrect sizes (Step 3 of 3)')
+            pc.update(title='Checking for incorrect sizes (Step 4 of 4)')
             results['sizesChanged'] = self._recalculateSizes(pc)
             return results
         # TODO:
@@ -456,6 +460,18 @@ class System(Resource):
         level = girder.logger.getEffectiveLevel()
         return logging.getLevelName(level)
 
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get statistics about the in-memory caches of the process '
+                    'that handles this request.')
+        .notes('Must be a system administrator to call this. Each server '
+               'process keeps its own caches, so the statistics of other '
+               'processes may differ.')
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def getCacheStats(self):
+        return process_cache.getStats()
+
     @access.admin
     @autoDescribeRoute(
         Description('Get the current log level.')
@@ -522,6 +538,49 @@ class System(Resource):
 
         return acList
 
+    def _fixAncestors(self, progress):
+        fixes = 0
+        folderModel = self.model('folder')
+        parents = {
+            doc['_id']: doc['parentId'] if doc['parentCollection'] == 'folder' else None
+            for doc in folderModel.find(fields=['parentId', 'parentCollection'])
+        }
+        chains = {}
+
+        def folderChain(folderId):
+            # Returns the ids from the top-level folder down to and including
+            # folderId. This iterates rather than recursing, since hierarchies
+            # can be very deep.
+            path = []
+            while folderId is not None and folderId not in chains and folderId not in path:
+                path.append(folderId)
+                folderId = parents.get(folderId)
+            chain = chains.get(folderId, [])
+            for id in reversed(path):
+                chain = chain + [id]
+                chains[id] = chain
+            return chain
+
+        models = ['folder', 'item']
+        steps = sum(self.model(model).find().count() for model in models)
+        progress.update(total=steps, current=0)
+        for model in models:
+            parentField = 'parentId' if model == 'folder' else 'folderId'
+            for doc in self.model(model).find(fields=[parentField, 'parentCollection',
+                                                      'ancestors']):
+                progress.update(increment=1)
+                if model == 'folder' and doc['parentCollection'] != 'folder':
+                    ancestors = []
+                else:
+                    ancestors = folderChain(doc[parentField])
+                if doc.get('ancestors') != ancestors:
+                    self.model(model).update({'_id': doc['_id']}, update={
+                        '$set': {'ancestors': ancestors}
+                    }, multi=False)
+                    fixes += 1
+        folderModel.hasCompleteAncestors()
+        return fixes
+
     def _fixBaseParents(self, progress):
         fixes = 0
         models = ['folder', 'item']
@@ -557,6 +616,8 @@ class System(Resource):
         return count
 
     def _recalculateSizes(self, progress):
+        # Write outstanding size changes so that they aren't counted twice
+        size_accounting.flush()
         fixes = 0
         models = ['collection', 'user']
         steps = sum(self.model(model).find().count() for model in models)
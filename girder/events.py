@@ -38,12 +38,17 @@ And if the event should be handled asynchronously, use:
 For obvious reasons, the asynchronous method does not return a value to the
 caller. Instead, the caller may optionally pass the callback argument as a
 function to be called when the task is finished. That callback function will
-receive the Event object as its only argument.
+receive the Event object as its only argument. Asynchronous events are handled
+by a pool of worker threads; pass a ``key``, such as the id of the document the
+event refers to, to ensure that events with the same key are handled in order.
 """
 
+import collections
 import contextlib
 import girder
+import six
 import threading
+import time
 
 
 from girder.utility import config
@@ -116,7 +121,7 @@ class ForegroundEventsDaemon(object):
     config file chooses to disable using the background thread for the daemon.
     It executes all bound handlers in the current thread, and provides
     no-op start() and stop() implementations to remain compatible with the
-    API of AsyncEventsThread.
+    API of AsyncEventsDaemon.
     """
     def start(self):
         pass
@@ -124,63 +129,186 @@ class ForegroundEventsDaemon(object):
     def stop(self):
         pass
 
-    def trigger(self, eventName, info=None, callback=None):
+    def trigger(self, eventName, info=None, callback=None, key=None):
         event = trigger(eventName, info, async=False, daemon=True)
         if callable(callback):
             callback(event)
 
+    def stats(self):
+        return {'workers': 0, 'queued': 0}
 
-class AsyncEventsThread(threading.Thread):
+
+class AsyncEventsDaemon(object):
     """
-    This class is used to execute the pipeline for events asynchronously.
-    This should not be invoked directly by callers; instead, they should use
-    girder.events.daemon.trigger().
+    This class is used to execute the pipeline for events asynchronously on a
+    pool of worker threads. This should not be invoked directly by callers;
+    instead, they should use girder.events.daemon.trigger().
+
+    Events that are triggered with the same key are handled one at a time in
+    the order they were triggered; other events may be handled concurrently
+    when there is more than one worker.
+
+    :param workers: The number of worker threads.
+    :type workers: int
+    :param maxQueueSize: The maximum number of events waiting to be handled.
+        Once it is reached, trigger() blocks until a worker finishes an event,
+        unless it is called by an event handler. 0 means no limit.
+    :type maxQueueSize: int
     """
-    def __init__(self):
-        threading.Thread.__init__(self)
-
-        self.daemon = True
+    def __init__(self, workers=1, maxQueueSize=0):
+        self.workers = max(int(workers), 1)
+        self.maxQueueSize = max(int(maxQueueSize), 0)
         self.terminate = False
         self.eventQueue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._notFull = threading.Condition(self._lock)
+        self._local = threading.local()
+        # The number of events that have been triggered but not yet handled
+        self._pending = 0
+        # Maps the key of each event that is queued or being handled to the
+        # events with the same key that were triggered after it. Only the first
+        # of these is put on the queue; the worker that takes it handles the
+        # rest in order.
+        self._activeKeys = {}
+        self._metrics = {
+            'handled': 0,
+            'failed': 0,
+            'totalWait': 0.0,
+            'maxWait': 0.0,
+            'totalDuration': 0.0,
+            'maxDuration': 0.0
+        }
 
-    def run(self):
+    def start(self):
+        """
+        Start the worker threads, if they aren't already running.
+        """
+        with self._lock:
+            self.terminate = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
         """
         Loops over all queued events. If the queue is empty, this thread gets
         put to sleep until someone calls trigger() on it with a new event to
         dispatch.
         """
         girder.logprint.info('Started asynchronous event manager thread.')
+        self._local.isWorker = True
 
         while not self.terminate:
-            eventName, info, callback = self.eventQueue.get(block=True)
-            try:
-                event = trigger(eventName, info, async=True, daemon=True)
-                if callable(callback):
-                    callback(event)
-            except Exception:
-                # Must continue the event loop even if handler failed
-                girder.logger.exception('In handler for event "%s":' % eventName)
+            task = self.eventQueue.get(block=True)
+            if task is _STOP:
+                continue
+            key = task[3]
+            while task is not None:
+                self._handle(task)
+                with self._notFull:
+                    self._pending -= 1
+                    self._notFull.notify()
+                    task = None
+                    if key is not None:
+                        waiting = self._activeKeys[key]
+                        if waiting:
+                            task = waiting.popleft()
+                        else:
+                            del self._activeKeys[key]
 
         girder.logprint.info('Stopped asynchronous event manager thread.')
 
-    def trigger(self, eventName, info=None, callback=None):
+    def _handle(self, task):
+        eventName, info, callback, key, queued = task
+        start = time.time()
+        failed = False
+        try:
+            event = trigger(eventName, info, async=True, daemon=True)
+            if callable(callback):
+                callback(event)
+        except Exception:
+            # Must continue the event loop even if handler failed
+            failed = True
+            girder.logger.exception('In handler for event "%s":' % eventName)
+        end = time.time()
+
+        with self._lock:
+            metrics = self._metrics
+            metrics['handled'] += 1
+            metrics['failed'] += failed
+            metrics['totalWait'] += start - queued
+            metrics['maxWait'] = max(metrics['maxWait'], start - queued)
+            metrics['totalDuration'] += end - start
+            metrics['maxDuration'] = max(metrics['maxDuration'], end - start)
+
+    def trigger(self, eventName, info=None, callback=None, key=None):
         """
-        Adds a new event on the queue to trigger asynchronously.
+        Adds a new event on the queue to trigger asynchronously. If the queue
+        is full, this blocks until there is room, unless it is called from an
+        event handler running on this daemon: that handler's worker may be the
+        one that would make room, so the event is queued regardless.
 
         :param eventName: The event name to pass to the girder.events.trigger
         :param info: The info object to pass to girder.events.trigger
         :param callback: Optional callable to be called upon completion of
             all bound event handlers. It takes one argument, which is the
             event object itself.
+        :param key: If set, this event will not be handled until all events
+            previously triggered with an equal key have been handled, such as
+            the id of a file that the event refers to.
+        :type key: hashable
         """
-        self.eventQueue.put((eventName, info, callback))
+        task = (eventName, info, callback, key, time.time())
+        with self._notFull:
+            if self.maxQueueSize and not getattr(self._local, 'isWorker', False):
+                while self._pending >= self.maxQueueSize:
+                    self._notFull.wait()
+            self._pending += 1
+            if key is not None:
+                if key in self._activeKeys:
+                    self._activeKeys[key].append(task)
+                    return
+                self._activeKeys[key] = collections.deque()
+            self.eventQueue.put(task)
 
     def stop(self):
         """
-        Gracefully stops this thread. Will finish the currently processing
-        event before stopping.
+        Gracefully stops the worker threads. Each will finish the event it is
+        currently processing before stopping.
         """
-        self.terminate = True
+        with self._lock:
+            self.terminate = True
+            threads = self._threads
+        for _ in threads:
+            # Wake idle workers so that they see the request to stop
+            self.eventQueue.put(_STOP)
+
+    def stats(self):
+        """
+        Return the number of queued events and how long events have waited and
+        taken to be handled since the daemon was created.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['waitingForKey'] = sum(len(w) for w in six.viewvalues(self._activeKeys))
+            metrics['workers'] = len([t for t in self._threads if t.is_alive()])
+        handled = metrics['handled']
+        metrics['meanWait'] = metrics['totalWait'] / handled if handled else None
+        metrics['meanDuration'] = metrics['totalDuration'] / handled if handled else None
+        metrics['queued'] = self.eventQueue.qsize() + metrics['waitingForKey']
+        metrics['maxQueueSize'] = self.maxQueueSize
+        return metrics
+
+
+# This name is kept for backward compatibility
+AsyncEventsThread = AsyncEventsDaemon
+
+# Put on the queue to wake idle workers when the daemon is stopped
+_STOP = object()
 
 
 def bind(eventName, handlerName, handler):
@@ -299,7 +427,10 @@ def trigger(eventName, info=None, pre=None, async=False, daemon=False):
 _deprecated = {}
 _mapping = {}
 
-if config.getConfig()['server'].get('disable_event_daemon', False):
+_serverConfig = config.getConfig()['server']
+if _serverConfig.get('disable_event_daemon', False):
     daemon = ForegroundEventsDaemon()
 else:
-    daemon = AsyncEventsThread()
+    daemon = AsyncEventsDaemon(
+        workers=_serverConfig.get('event_daemon_workers', 1),
+        maxQueueSize=_serverConfig.get('event_daemon_queue_size', 10000))
@@ -33,7 +33,7 @@ class Collection(AccessControlledModel):
 
     def initialize(self):
         self.name = 'collection'
-        self.ensureIndices(['name'])
+        self.ensureIndices(['name', 'access.users.id', 'access.groups.id', 'public'])
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -194,14 +194,11 @@ class Collection(AccessControlledModel):
         :type level: AccessLevel
         """
         count = 1
-        folders = self.model('folder').find({
+        folders = self.model('folder').findWithPermissions({
             'parentId': doc['_id'],
             'parentCollection': 'collection'
-        }, fields=('access',))
+        }, fields=(), user=user, level=level)
 
-        if level is not None:
-            folders = self.filterResultsByPermission(
-                cursor=folders, user=user, level=level)
         count += sum(self.model('folder').subtreeCount(
             folder, includeItems=includeItems, user=user, level=level)
             for folder in folders)
@@ -249,13 +246,10 @@ class Collection(AccessControlledModel):
             self, doc, access, user=user, save=save, force=force)
 
         if recurse:
-            cursor = self.model('folder').find({
+            folders = self.model('folder').findWithPermissions({
                 'parentId': doc['_id'],
                 'parentCollection': 'collection'
-            })
-
-            folders = self.filterResultsByPermission(
-                cursor=cursor, user=user, level=AccessType.ADMIN)
+            }, user=user, level=AccessType.ADMIN)
 
             for folder in folders:
                 self.model('folder').setAccessList(
@@ -301,19 +295,10 @@ class Collection(AccessControlledModel):
         :param level: The required access level, or None to return the raw
             top-level folder count.
         """
-        fields = () if level is None else ('access', 'public')
-
-        folderModel = self.model('folder')
-        folders = folderModel.find({
+        return self.model('folder').findWithPermissions({
             'parentId': collection['_id'],
             'parentCollection': 'collection'
-        }, fields=fields)
-
-        if level is None:
-            return folders.count()
-        else:
-            return sum(1 for _ in folderModel.filterResultsByPermission(
-                cursor=folders, user=user, level=level))
+        }, fields=(), user=user, level=level).count()
 
     def updateSize(self, doc):
         """
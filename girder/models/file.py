@@ -25,7 +25,7 @@ from .model_base import Model, ValidationException
 from girder import events
 from girder.constants import AccessType, CoreEventHandler
 from girder.models.model_base import AccessControlledModel
-from girder.utility import assetstore_utilities, acl_mixin
+from girder.utility import assetstore_utilities, acl_mixin, size_accounting
 
 
 class File(acl_mixin.AccessControlMixin, Model):
@@ -35,7 +35,7 @@ class File(acl_mixin.AccessControlMixin, Model):
     def initialize(self):
         self.name = 'file'
         self.ensureIndices(
-            ['itemId', 'assetstoreId', 'exts'] +
+            ['itemId', 'assetstoreId', 'exts', ('uploadId', {'sparse': True})] +
             assetstore_utilities.fileIndexFields())
         self.resourceColl = 'item'
         self.resourceParent = 'itemId'
@@ -72,6 +72,26 @@ class File(acl_mixin.AccessControlMixin, Model):
 
         Model.remove(self, file)
 
+    def bulkRemove(self, files, **kwargs):
+        """
+        Delete many files at once. Each assetstore adapter is asked to delete
+        the data of all of its files in a single call, then the file records
+        are deleted with a single query. Sizes are not propagated; callers are
+        responsible for updating the sizes of any items, folders, and root
+        data nodes that still exist.
+
+        :param files: The file documents to remove.
+        :type files: list
+        """
+        byAssetstore = {}
+        for file in files:
+            if file.get('assetstoreId'):
+                byAssetstore.setdefault(file['assetstoreId'], []).append(file)
+        for assetstoreFiles in six.viewvalues(byAssetstore):
+            self.getAssetstoreAdapter(assetstoreFiles[0]).deleteFiles(assetstoreFiles)
+
+        return Model.bulkRemove(self, files, **kwargs)
+
     def download(self, file, offset=0, headers=True, endByte=None,
                  contentDisposition=None, extraParameters=None):
         """
@@ -249,19 +269,13 @@ class File(acl_mixin.AccessControlMixin, Model):
         """
         if updateItemSize:
             # Propagate size up to item
-            self.model('item').increment(query={
-                '_id': item['_id']
-            }, field='size', amount=sizeIncrement, multi=False)
+            size_accounting.add('item', item['_id'], sizeIncrement)
 
         # Propagate size to direct parent folder
-        self.model('folder').increment(query={
-            '_id': item['folderId']
-        }, field='size', amount=sizeIncrement, multi=False)
+        size_accounting.add('folder', item['folderId'], sizeIncrement)
 
         # Propagate size up to root data node
-        self.model(item['baseParentType']).increment(query={
-            '_id': item['baseParentId']
-        }, field='size', amount=sizeIncrement, multi=False)
+        size_accounting.add(item['baseParentType'], item['baseParentId'], sizeIncrement)
 
     def createFile(self, creator, item, name, size, assetstore, mimeType=None,
                    saveFile=True, reuseExisting=False):
@@ -362,6 +376,7 @@ class File(acl_mixin.AccessControlMixin, Model):
         file = srcFile.copy()
         # Immediately delete the original id so that we get a new one.
         del file['_id']
+        file.pop('uploadId', None)
         file['copied'] = datetime.datetime.utcnow()
         file['copierId'] = creator['_id']
         if item:
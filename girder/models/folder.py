@@ -19,15 +19,18 @@
 
 import copy
 import datetime
+import itertools
 import json
 import os
+import pymongo
 import six
 
 from bson.objectid import ObjectId
 from .model_base import AccessControlledModel, ValidationException, \
     GirderException
-from girder import events
+from girder import events, logger
 from girder.constants import AccessType
+from girder.utility import size_accounting
 from girder.utility.progress import noProgress, setResponseTimeLimit
 
 
@@ -40,10 +43,21 @@ class Folder(AccessControlledModel):
     Top-level folders are ones whose parent is a user or a collection.
     """
 
+    # The number of folder ids to include in each query when counting the
+    # items in a subtree.
+    subtreeCountBatchSize = 10000
+
     def initialize(self):
         self.name = 'folder'
         self.ensureIndices(('parentId', 'name', 'lowerName',
-                            ([('parentId', 1), ('name', 1)], {})))
+                            ([('parentId', 1), ('name', 1)], {}),
+                            'access.users.id', 'access.groups.id', 'public',
+                            'ancestors'))
+        # Set to True once every folder and item is known to have its list of
+        # ancestors stored, so that subtree queries can rely on it.
+        self._ancestorsComplete = False
+        # Whether the database supports $graphLookup; determined on first use.
+        self._graphLookupSupported = None
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -136,9 +150,64 @@ class Folder(AccessControlledModel):
             doc = self.save(doc, triggerEvents=False)
         if doc is not None and 'lowerName' not in doc:
             doc = self.save(doc, triggerEvents=False)
+        if doc is not None and fields is None and 'ancestors' not in doc:
+            doc['ancestors'] = self.getAncestorIds(doc)
 
         return doc
 
+    def getAncestorIds(self, folder):
+        """
+        Return the ids of the folders above the given folder, ordered from the
+        top-level folder down to the folder's parent. These are stored on each
+        folder as the ``ancestors`` field; if that is missing, as for folders
+        created by older versions of Girder, it is computed by walking up the
+        hierarchy and then stored.
+
+        :param folder: The folder.
+        :type folder: dict
+        :returns: A list of folder ids.
+        """
+        if 'ancestors' in folder:
+            return folder['ancestors']
+        if 'parentCollection' not in folder:
+            folder = self.findOne({'_id': folder['_id']}, fields=[
+                'parentId', 'parentCollection', 'ancestors'])
+            if 'ancestors' in folder:
+                return folder['ancestors']
+
+        ancestorIds = []
+        current = folder
+        while current['parentCollection'] == 'folder':
+            ancestorIds.insert(0, current['parentId'])
+            current = self.findOne({'_id': current['parentId']}, fields=[
+                'parentId', 'parentCollection', 'ancestors'])
+            if current is None:
+                break
+            if 'ancestors' in current:
+                ancestorIds = current['ancestors'] + ancestorIds
+                break
+
+        if '_id' in folder:
+            self.update({'_id': folder['_id']}, {
+                '$set': {'ancestors': ancestorIds}
+            }, multi=False)
+        return ancestorIds
+
+    def hasCompleteAncestors(self):
+        """
+        Returns whether every folder and item stores its ancestors, in which
+        case queries on whole subtrees can be done with a single query against
+        the ``ancestors`` field rather than by recursion. Databases created by
+        older versions of Girder can be brought up to date by running the
+        system consistency check.
+        """
+        if not self._ancestorsComplete:
+            self._ancestorsComplete = (
+                self.findOne({'ancestors': {'$exists': False}}, fields=()) is None and
+                self.model('item').findOne(
+                    {'ancestors': {'$exists': False}}, fields=()) is None)
+        return self._ancestorsComplete
+
     def getSizeRecursive(self, folder):
         """
         Calculate the total size of the folder by recursing into all of its
@@ -146,6 +215,23 @@ class Folder(AccessControlledModel):
         """
         size = folder['size']
 
+        if self.hasCompleteAncestors():
+            try:
+                result = list(self.collection.aggregate([
+                    {'$match': {'ancestors': folder['_id']}},
+                    {'$group': {'_id': None, 'size': {'$sum': '$size'}}}
+                ]))
+                return size + (result[0]['size'] if result else 0)
+            except pymongo.errors.OperationFailure:
+                logger.warning('Could not sum the sizes under folder %s by its ancestors; '
+                               'falling back to a traversal.' % folder['_id'], exc_info=True)
+
+        result = self._aggregateSubtree(folder, [
+            {'$group': {'_id': None, 'size': {'$sum': '$descendant.size'}}}
+        ])
+        if result is not None:
+            return size + (result[0]['size'] if result else 0)
+
         q = {
             'parentId': folder['_id'],
             'parentCollection': 'folder'
@@ -156,6 +242,79 @@ class Folder(AccessControlledModel):
 
         return size
 
+    def supportsGraphLookup(self):
+        """
+        Returns whether the database server supports the ``$graphLookup``
+        aggregation stage (MongoDB 3.4 or later), which lets whole subtrees of
+        folders be visited by a single aggregation.
+        """
+        if self._graphLookupSupported is None:
+            version = self.database.client.server_info().get('versionArray', [0])
+            self._graphLookupSupported = tuple(version[:2]) >= (3, 4)
+        return self._graphLookupSupported
+
+    def _subtreePipeline(self, folder, user=None, level=None):
+        """
+        Return aggregation stages that yield one document per descendant
+        folder of the given folder, with the descendant stored in the
+        ``descendant`` field. If a permission level is given, the traversal
+        does not descend into folders that the user cannot access at that
+        level, matching the recursive behavior of :py:meth:`subtreeCount`.
+
+        :param folder: The root of the subtree.
+        :type folder: dict
+        :param user: If filtering by permission, the user to filter against.
+        :param level: If filtering by permission, the required permission level.
+        :type level: AccessLevel
+        """
+        restrict = {'parentCollection': 'folder'}
+        if level is not None:
+            restrict = self._addPermissionFilters(restrict, user, level)
+        return [
+            {'$match': {'_id': folder['_id']}},
+            {'$graphLookup': {
+                'from': self.name,
+                'startWith': '$_id',
+                'connectFromField': '_id',
+                'connectToField': 'parentId',
+                'as': 'descendant',
+                'restrictSearchWithMatch': restrict
+            }},
+            # The server merges this into the $graphLookup, so the descendants
+            # are not gathered into one document, which would be limited to
+            # 16MB. The traversal itself still holds every descendant in memory.
+            {'$unwind': '$descendant'}
+        ]
+
+    def _aggregateSubtree(self, folder, stages, user=None, level=None):
+        """
+        Run an aggregation over the descendant folders of the given folder
+        using :py:meth:`_subtreePipeline` followed by the given stages.
+
+        ``$graphLookup`` must fit every folder it visits in the 100MB memory
+        limit of an aggregation stage, so it fails on very large subtrees.
+        This returns None in that case, as well as when the server does not
+        support ``$graphLookup``, so that callers can recurse instead.
+
+        :param folder: The root of the subtree.
+        :type folder: dict
+        :param stages: Aggregation stages to apply to the descendants.
+        :type stages: list
+        :param user: If filtering by permission, the user to filter against.
+        :param level: If filtering by permission, the required permission level.
+        :type level: AccessLevel
+        :returns: The list of aggregation results, or None.
+        """
+        if not self.supportsGraphLookup():
+            return None
+        try:
+            return list(self.collection.aggregate(
+                self._subtreePipeline(folder, user, level) + stages))
+        except pymongo.errors.OperationFailure:
+            logger.warning('Could not aggregate the subtree of folder %s; falling back '
+                           'to recursion.' % folder['_id'], exc_info=True)
+            return None
+
     def setMetadata(self, folder, metadata, allowNull=False):
         """
         Set metadata on a folder.  A `ValidationException` is thrown in the
@@ -226,6 +385,12 @@ class Folder(AccessControlledModel):
         the folder.
         :type updateQuery: dict
         """
+        if self.hasCompleteAncestors():
+            self.update(query={'ancestors': folderId}, update=updateQuery, multi=True)
+            self.model('item').update(
+                query={'ancestors': folderId}, update=updateQuery, multi=True)
+            return
+
         self.update(query={
             'parentId': folderId,
             'parentCollection': 'folder'
@@ -258,6 +423,9 @@ class Folder(AccessControlledModel):
         if descendant['parentCollection'] != 'folder':
             return False
 
+        if 'ancestors' in descendant:
+            return ancestor['_id'] in descendant['ancestors']
+
         descendant = self.load(descendant['parentId'], force=True)
 
         if descendant is None:
@@ -282,8 +450,18 @@ class Folder(AccessControlledModel):
             raise ValidationException(
                 'You may not move a folder underneath itself.')
 
+        oldAncestors = self.getAncestorIds(folder)
+        if parentType == 'folder':
+            newAncestors = self.getAncestorIds(parent) + [parent['_id']]
+        else:
+            newAncestors = []
+
         folder['parentId'] = parent['_id']
         folder['parentCollection'] = parentType
+        folder['ancestors'] = newAncestors
+
+        if oldAncestors != newAncestors:
+            self._replaceAncestors(folder['_id'], oldAncestors, newAncestors)
 
         if parentType == 'folder':
             rootType, rootId = parent['baseParentType'], parent['baseParentId']
@@ -293,10 +471,11 @@ class Folder(AccessControlledModel):
         if (folder['baseParentType'], folder['baseParentId']) !=\
            (rootType, rootId):
             def propagateSizeChange(folder, inc):
-                self.model(folder['baseParentType']).increment(query={
-                    '_id': folder['baseParentId']
-                }, field='size', amount=inc, multi=False)
+                size_accounting.add(folder['baseParentType'], folder['baseParentId'], inc)
 
+            # Write outstanding size changes so that the recorded sizes are current
+            size_accounting.flush()
+            folder['size'] = self.load(folder['_id'], force=True, fields=['size'])['size']
             totalSize = self.getSizeRecursive(folder)
             propagateSizeChange(folder, -totalSize)
             folder['baseParentType'] = rootType
@@ -311,50 +490,62 @@ class Folder(AccessControlledModel):
 
         return self.save(folder)
 
+    def _replaceAncestors(self, folderId, oldAncestors, newAncestors):
+        """
+        Replace the leading ancestors of every folder and item underneath a
+        folder that has been moved.
+
+        :param folderId: The _id of the moved folder.
+        :param oldAncestors: The ancestors of the folder before the move.
+        :type oldAncestors: list
+        :param newAncestors: The ancestors of the folder after the move.
+        :type newAncestors: list
+        """
+        for model in (self, self.model('item')):
+            if oldAncestors:
+                model.update({'ancestors': folderId}, {
+                    '$pullAll': {'ancestors': oldAncestors}
+                })
+            if newAncestors:
+                model.update({'ancestors': folderId}, {
+                    '$push': {'ancestors': {'$each': newAncestors, '$position': 0}}
+                })
+
     def clean(self, folder, progress=None, **kwargs):
         """
         Delete all contents underneath a folder recursively, but leave the
-        folder itself.
+        folder itself. The contents are deleted in batches, as described in
+        :py:meth:`remove`.
 
         :param folder: The folder document to delete.
         :type folder: dict
         :param progress: A progress context to record progress on.
         :type progress: girder.utility.progress.ProgressContext or None.
         """
-        setResponseTimeLimit()
-        # Delete all child items
-        items = self.model('item').find({
-            'folderId': folder['_id']
-        })
-        for item in items:
-            setResponseTimeLimit()
-            self.model('item').remove(item, progress=progress, **kwargs)
-            if progress:
-                progress.update(increment=1, message='Deleted item %s' %
-                                item['name'])
-        # subsequent operations take a long time, so free the cursor's resources
-        items.close()
+        directSize, subtreeSize = self._removeContents(folder, progress, **kwargs)
 
-        # Delete all child folders
-        folders = self.find({
-            'parentId': folder['_id'],
-            'parentCollection': 'folder'
-        })
-        for subfolder in folders:
-            self.remove(subfolder, progress=progress, **kwargs)
-        folders.close()
+        size_accounting.add('folder', folder['_id'], -directSize)
+        self._propagateRemovedSize(folder, directSize + subtreeSize)
 
     def remove(self, folder, progress=None, **kwargs):
         """
         Delete a folder recursively.
 
+        Rather than removing each descendant individually, the folders, items,
+        and files underneath it are deleted in batches with
+        :py:meth:`Model.bulkRemove`, which triggers the ``model.<name>.remove``
+        event for each document and a ``model.<name>.remove_many`` event for
+        each batch, and the total change in size is applied to the root data
+        node once. The folder itself is removed with :py:meth:`Model.remove`.
+
         :param folder: The folder document to delete.
         :type folder: dict
         :param progress: A progress context to record progress on.
         :type progress: girder.utility.progress.ProgressContext or None.
         """
         # Remove the contents underneath this folder recursively.
-        self.clean(folder, progress, **kwargs)
+        directSize, subtreeSize = self._removeContents(folder, progress, **kwargs)
+        self._propagateRemovedSize(folder, directSize + subtreeSize)
 
         # Delete pending uploads into this folder
         uploads = self.model('upload').find({
@@ -371,6 +562,93 @@ class Folder(AccessControlledModel):
             progress.update(increment=1, message='Deleted folder %s' %
                             folder['name'])
 
+    def _descendantFolderIds(self, folder):
+        """
+        Return the ids of all of the folders underneath a folder, in
+        breadth-first order, using one query per batch of folders at each
+        level of the hierarchy.
+        """
+        ids = []
+        level = [folder['_id']]
+        while level:
+            nextLevel = []
+            for start in range(0, len(level), self.bulkRemoveBatchSize):
+                nextLevel.extend(doc['_id'] for doc in self.find({
+                    'parentId': {'$in': level[start:start + self.bulkRemoveBatchSize]},
+                    'parentCollection': 'folder'
+                }, fields=()))
+            ids.extend(nextLevel)
+            level = nextLevel
+        return ids
+
+    def _removeItemsInFolders(self, folderIds, progress=None, **kwargs):
+        """
+        Delete all of the items directly within the given folders in batches.
+
+        :returns: the total size of the deleted items.
+        """
+        itemModel = self.model('item')
+        size = 0
+        query = {'folderId': {'$in': folderIds}}
+        while True:
+            setResponseTimeLimit()
+            items = list(itemModel.find(
+                query, limit=self.bulkRemoveBatchSize, sort=[('_id', pymongo.ASCENDING)]))
+            if not items:
+                break
+            # Items whose removal was prevented by an event handler are kept,
+            # so continue after the last item of the batch
+            query['_id'] = {'$gt': items[-1]['_id']}
+            itemModel.bulkRemove(items, progress=progress, **kwargs)
+            size += sum(item.get('size', 0) for item in items)
+            if progress:
+                progress.update(increment=len(items), message='Deleted %d items' % len(items))
+        return size
+
+    def _removeContents(self, folder, progress=None, **kwargs):
+        """
+        Delete everything underneath a folder in batches. The deepest folders
+        are deleted first, so that an interrupted deletion does not leave any
+        orphaned documents behind.
+
+        :returns: a tuple of the total size of the items deleted directly from
+            the folder and the total size of the items deleted from its
+            descendant folders.
+        """
+        setResponseTimeLimit()
+        # Write outstanding size changes so that the sizes of the deleted items
+        # are current
+        size_accounting.flush()
+        descendantIds = self._descendantFolderIds(folder)
+        subtreeSize = 0
+        batchSize = self.bulkRemoveBatchSize
+        for end in range(len(descendantIds), 0, -batchSize):
+            batch = descendantIds[max(0, end - batchSize):end]
+            subtreeSize += self._removeItemsInFolders(batch, progress, **kwargs)
+
+            uploads = self.model('upload').find({
+                'parentId': {'$in': batch},
+                'parentType': 'folder'
+            })
+            for upload in uploads:
+                self.model('upload').remove(upload, progress=progress, **kwargs)
+
+            folders = list(self.find({'_id': {'$in': batch}}))
+            self.bulkRemove(folders, progress=progress, **kwargs)
+            if progress:
+                progress.update(increment=len(folders),
+                                message='Deleted %d folders' % len(folders))
+
+        directSize = self._removeItemsInFolders([folder['_id']], progress, **kwargs)
+        return directSize, subtreeSize
+
+    def _propagateRemovedSize(self, folder, size):
+        """
+        Subtract the size of deleted contents from the folder's root data node.
+        """
+        if size and 'baseParentType' in folder:
+            size_accounting.add(folder['baseParentType'], folder['baseParentId'], -size)
+
     def childItems(self, folder, limit=0, offset=0, sort=None, filters=None,
                    **kwargs):
         """
@@ -394,9 +672,8 @@ class Folder(AccessControlledModel):
     def childFolders(self, parent, parentType, user=None, limit=0, offset=0,
                      sort=None, filters=None, **kwargs):
         """
-        This generator will yield child folders of a user, collection, or
-        folder, with access policy filtering.  Passes any kwargs to the find
-        function.
+        Return a cursor of child folders of a user, collection, or folder, with
+        access policy filtering.  Passes any kwargs to the find function.
 
         :param parent: The parent object.
         :type parentType: Type of the parent object.
@@ -423,13 +700,9 @@ class Folder(AccessControlledModel):
         }
         q.update(filters)
 
-        # Perform the find; we'll do access-based filtering of the result set
-        # afterward.
-        cursor = self.find(q, sort=sort, **kwargs)
-
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
-            offset=offset)
+        return self.findWithPermissions(
+            q, sort=sort, user=user, level=AccessType.READ, limit=limit,
+            offset=offset, **kwargs)
 
     def createFolder(self, parent, name, description='', parentType='folder',
                      public=None, creator=None, allowRename=False,
@@ -481,9 +754,11 @@ class Folder(AccessControlledModel):
                     parent, user=creator, force=True)
                 parent['baseParentId'] = pathFromRoot[0]['object']['_id']
                 parent['baseParentType'] = pathFromRoot[0]['type']
+            ancestors = self.getAncestorIds(parent) + [parent['_id']]
         else:
             parent['baseParentId'] = parent['_id']
             parent['baseParentType'] = parentType
+            ancestors = []
 
         now = datetime.datetime.utcnow()
 
@@ -499,6 +774,7 @@ class Folder(AccessControlledModel):
             'baseParentId': parent['baseParentId'],
             'baseParentType': parent['baseParentType'],
             'parentId': ObjectId(parent['_id']),
+            'ancestors': ancestors,
             'creatorId': creatorId,
             'created': now,
             'updated': now,
@@ -543,6 +819,11 @@ class Folder(AccessControlledModel):
         :type folder: dict
         :returns: an ordered list of dictionaries from root to the current folder
         """
+        if not curPath and 'ancestors' in folder:
+            path = self._parentsToRootFromAncestors(folder, user, force, level)
+            if path is not None:
+                return path
+
         curPath = curPath or []
         curParentId = folder['parentId']
         curParentType = folder['parentCollection']
@@ -569,6 +850,38 @@ class Folder(AccessControlledModel):
 
             return self.parentsToRoot(curParentObject, curPath, user=user, force=force)
 
+    def _parentsToRootFromAncestors(self, folder, user, force, level):
+        """
+        Implementation of parentsToRoot that loads all of the ancestor folders
+        with a single query. Returns None if any ancestor is missing.
+        """
+        ancestorIds = folder['ancestors']
+        docs = {doc['_id']: doc for doc in self.find({'_id': {'$in': ancestorIds}})}
+        if len(docs) != len(set(ancestorIds)):
+            return None
+        ancestors = [docs[id] for id in ancestorIds]
+
+        top = ancestors[0] if ancestors else folder
+        rootType = top['parentCollection']
+        # As when recursing, the requested level only applies to the immediate
+        # parent; other ancestors require read access.
+        root = self.model(rootType).load(
+            top['parentId'], user=user, level=AccessType.READ if ancestors else level,
+            force=force)
+        path = [{
+            'type': rootType,
+            'object': root if force else self.model(rootType).filter(root, user)
+        }]
+
+        for index, ancestor in enumerate(ancestors):
+            if not force:
+                self.requireAccess(ancestor, user, level if index == len(ancestors) - 1
+                                   else AccessType.READ)
+                ancestor = self.filter(ancestor, user)
+            path.append({'type': 'folder', 'object': ancestor})
+
+        return path
+
     def countItems(self, folder):
         """
         Returns the number of items within the given folder.
@@ -587,18 +900,10 @@ class Folder(AccessControlledModel):
         :param level: The required access level, or None to return the raw
             subfolder count.
         """
-        fields = () if level is None else ('access', 'public')
-
-        folders = self.find({
+        return self.findWithPermissions({
             'parentId': folder['_id'],
             'parentCollection': 'folder'
-        }, fields=fields)
-
-        if level is None:
-            return folders.count()
-        else:
-            return sum(1 for _ in self.filterResultsByPermission(
-                cursor=folders, user=user, level=level))
+        }, fields=(), user=user, level=level).count()
 
     def subtreeCount(self, folder, includeItems=True, user=None, level=None):
         """
@@ -616,17 +921,34 @@ class Folder(AccessControlledModel):
         """
         count = 1
 
+        if level is None and self.hasCompleteAncestors():
+            count += self.find({'ancestors': folder['_id']}, fields=()).count()
+            if includeItems:
+                count += self.model('item').find(
+                    {'ancestors': folder['_id']}, fields=()).count()
+            return count
+
+        descendants = self._aggregateSubtree(folder, [
+            {'$project': {'_id': '$descendant._id'}}
+        ], user, level)
+        if descendants is not None:
+            folderIds = [folder['_id']] + [doc['_id'] for doc in descendants]
+            count += len(descendants)
+            if includeItems:
+                itemModel = self.model('item')
+                for start in range(0, len(folderIds), self.subtreeCountBatchSize):
+                    count += itemModel.find({'folderId': {
+                        '$in': folderIds[start:start + self.subtreeCountBatchSize]
+                    }}, fields=()).count()
+            return count
+
         if includeItems:
             count += self.countItems(folder)
 
-        folders = self.find({
+        folders = self.findWithPermissions({
             'parentId': folder['_id'],
             'parentCollection': 'folder'
-        }, fields=('access',))
-
-        if level is not None:
-            folders = self.filterResultsByPermission(
-                cursor=folders, user=user, level=level)
+        }, fields=(), user=user, level=level)
 
         count += sum(self.subtreeCount(subfolder, includeItems=includeItems,
                                        user=user, level=level)
@@ -842,13 +1164,10 @@ class Folder(AccessControlledModel):
             self, doc, access, user=user, save=save, force=force)
 
         if recurse:
-            cursor = self.find({
+            subfolders = self.findWithPermissions({
                 'parentId': doc['_id'],
                 'parentCollection': 'folder'
-            })
-
-            subfolders = self.filterResultsByPermission(
-                cursor=cursor, user=user, level=AccessType.ADMIN)
+            }, user=user, level=AccessType.ADMIN)
 
             for folder in subfolders:
                 self.setAccessList(
@@ -875,6 +1194,9 @@ class Folder(AccessControlledModel):
         :param doc: The folder.
         :type doc: dict
         """
+        if self.hasCompleteAncestors():
+            return self._updateSizeFromAncestors(doc)
+
         size = 0
         fixes = 0
         # recursively fix child folders but don't include their size
@@ -895,3 +1217,24 @@ class Folder(AccessControlledModel):
             self.update({'_id': doc['_id']}, update={'$set': {'size': size}})
             fixes += 1
         return size, fixes
+
+    def _updateSizeFromAncestors(self, doc):
+        """
+        Implementation of updateSize that visits all of the items and folders
+        in the subtree with one query each rather than recursing.
+        """
+        fixes = 0
+        sizes = {}
+        for item in self.model('item').find({'ancestors': doc['_id']}):
+            s, f = self.model('item').updateSize(item)
+            sizes[item['folderId']] = sizes.get(item['folderId'], 0) + s
+            fixes += f
+
+        folders = itertools.chain(
+            self.find({'ancestors': doc['_id']}, fields=['size']), [doc])
+        for folder in folders:
+            size = sizes.get(folder['_id'], 0)
+            if size != folder.get('size'):
+                self.update({'_id': folder['_id']}, update={'$set': {'size': size}})
+                fixes += 1
+        return sizes.get(doc['_id'], 0), fixes
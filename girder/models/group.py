@@ -56,7 +56,7 @@ class Group(AccessControlledModel):
 
     def initialize(self):
         self.name = 'group'
-        self.ensureIndices(['lowerName'])
+        self.ensureIndices(['lowerName', 'access.users.id'])
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -363,6 +363,41 @@ class Group(AccessControlledModel):
             return self._hasUserAccess(doc.get('access', {}).get('users', []),
                                        user['_id'], level)
 
+    def permissionClauses(self, user=None, level=None, flags=None, prefix=''):
+        """
+        This overrides the default AccessControlledModel behavior to mirror the
+        group-specific logic of :py:meth:`hasAccess` as a query clause.
+        """
+        if user and user['admin']:
+            return {}
+
+        clauses = []
+        if level is not None:
+            if user is None:
+                if level != AccessType.READ:
+                    return {prefix + '_id': {'$exists': False}}
+                clauses.append({prefix + 'public': True})
+            elif level == AccessType.READ:
+                groupIds = list(user.get('groups', [])) + [
+                    i['groupId'] for i in user.get('groupInvites', [])]
+                clauses.append({'$or': [
+                    {prefix + 'public': True},
+                    {prefix + '_id': {'$in': groupIds}}
+                ]})
+            else:
+                clauses.append({prefix + 'access.users': {'$elemMatch': {
+                    'id': user['_id'],
+                    'level': {'$gte': level}
+                }}})
+
+        clauses.extend(self._flagClauses(user, flags, prefix))
+
+        if not clauses:
+            return {}
+        if len(clauses) == 1:
+            return clauses[0]
+        return {'$and': clauses}
+
     def getAccessLevel(self, doc, user):
         """
         Return the maximum access level for a given user on the group.
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2013 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+
+from .model_base import Model
+
+
+class ImportCheckpoint(Model):
+    """
+    This model records how far an import of existing data has progressed, so
+    that an interrupted import resumes where it stopped. An import is split
+    into shards, such as the prefixes of an S3 bucket, and each shard records
+    the last key that was imported and whether it is complete. The checkpoint
+    of an import is identified by the assetstore, the destination, and the
+    import path, and is removed once the import finishes.
+    """
+    def initialize(self):
+        self.name = 'import_checkpoint'
+        self.ensureIndices([
+            ([('assetstoreId', 1), ('parentId', 1), ('importPath', 1), ('shard', 1)], {})
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def _query(self, assetstore, parent, importPath):
+        return {
+            'assetstoreId': assetstore['_id'],
+            'parentId': parent['_id'],
+            'importPath': importPath
+        }
+
+    def getShards(self, assetstore, parent, importPath):
+        """
+        Return the recorded shards of an unfinished import.
+
+        :param assetstore: The assetstore being imported from.
+        :type assetstore: dict
+        :param parent: The destination of the import.
+        :type parent: dict
+        :param importPath: The path being imported.
+        :type importPath: str
+        :returns: A dict mapping each shard to its checkpoint document, which
+            has ``after`` and ``complete`` fields.
+        """
+        return {doc['shard']: doc for doc in self.find(
+            self._query(assetstore, parent, importPath))}
+
+    def record(self, assetstore, parent, importPath, shard, after=None, complete=False):
+        """
+        Record the progress of a shard of an import.
+
+        :param shard: The identifier of the shard.
+        :type shard: str
+        :param after: The last key of the shard that has been imported.
+        :type after: str or None
+        :param complete: Whether the shard has been completely imported.
+        :type complete: bool
+        """
+        query = self._query(assetstore, parent, importPath)
+        query['shard'] = shard
+        self.collection.update_one(query, {'$set': {
+            'after': after,
+            'complete': complete,
+            'updated': datetime.datetime.utcnow()
+        }}, upsert=True)
+
+    def clear(self, assetstore, parent, importPath):
+        """
+        Remove the checkpoint of an import once it has finished.
+        """
+        self.removeWithQuery(self._query(assetstore, parent, importPath))
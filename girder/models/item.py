@@ -28,7 +28,7 @@ from .model_base import Model, ValidationException, GirderException
 from girder import events
 from girder import logger
 from girder.constants import AccessType
-from girder.utility import acl_mixin
+from girder.utility import acl_mixin, size_accounting
 
 
 class Item(acl_mixin.AccessControlMixin, Model):
@@ -40,7 +40,7 @@ class Item(acl_mixin.AccessControlMixin, Model):
     def initialize(self):
         self.name = 'item'
         self.ensureIndices(('folderId', 'name', 'lowerName',
-                            ([('folderId', 1), ('name', 1)], {})))
+                            ([('folderId', 1), ('name', 1)], {}), 'ancestors'))
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -122,9 +122,38 @@ class Item(acl_mixin.AccessControlMixin, Model):
             doc = self.save(doc, triggerEvents=False)
         if doc is not None and 'lowerName' not in doc:
             doc = self.save(doc, triggerEvents=False)
+        if doc is not None and fields is None and 'ancestors' not in doc:
+            doc['ancestors'] = self.getAncestorIds(doc)
 
         return doc
 
+    def getAncestorIds(self, item):
+        """
+        Return the ids of the folders containing the given item, ordered from
+        the top-level folder down to the item's own folder. If the item does
+        not have these stored in its ``ancestors`` field, they are computed
+        and stored.
+
+        :param item: The item.
+        :type item: dict
+        :returns: A list of folder ids.
+        """
+        if 'ancestors' in item:
+            return item['ancestors']
+
+        folderModel = self.model('folder')
+        folder = folderModel.findOne({'_id': item['folderId']}, fields=[
+            'parentId', 'parentCollection', 'ancestors'])
+        ancestorIds = [item['folderId']]
+        if folder is not None:
+            ancestorIds = folderModel.getAncestorIds(folder) + ancestorIds
+
+        if '_id' in item:
+            self.update({'_id': item['_id']}, {
+                '$set': {'ancestors': ancestorIds}
+            }, multi=False)
+        return ancestorIds
+
     def move(self, item, folder):
         """
         Move the given item from its current folder into another folder.
@@ -134,24 +163,23 @@ class Item(acl_mixin.AccessControlMixin, Model):
         :param folder: The folder to move the item into.
         :type folder: dict.
         """
+        # Write outstanding size changes so that the recorded size is current
+        size_accounting.flush()
+        item['size'] = self.load(item['_id'], force=True, fields=['size'])['size']
         self.propagateSizeChange(item, -item['size'])
 
         item['folderId'] = folder['_id']
         item['baseParentType'] = folder['baseParentType']
         item['baseParentId'] = folder['baseParentId']
+        item['ancestors'] = self.model('folder').getAncestorIds(folder) + [folder['_id']]
 
         self.propagateSizeChange(item, item['size'])
 
         return self.save(item)
 
     def propagateSizeChange(self, item, inc):
-        self.model('folder').increment(query={
-            '_id': item['folderId']
-        }, field='size', amount=inc, multi=False)
-
-        self.model(item['baseParentType']).increment(query={
-            '_id': item['baseParentId']
-        }, field='size', amount=inc, multi=False)
+        size_accounting.add('folder', item['folderId'], inc)
+        size_accounting.add(item['baseParentType'], item['baseParentId'], inc)
 
     def recalculateSize(self, item):
         """
@@ -160,6 +188,7 @@ class Item(acl_mixin.AccessControlMixin, Model):
         :param item: The item to recalculate the size of.
         :returns: the recalculated size in bytes
         """
+        size_accounting.flush()
         size = 0
         for file in self.childFiles(item):
             # We could add a recalculateSize to the file model, in which case
@@ -220,6 +249,40 @@ class Item(acl_mixin.AccessControlMixin, Model):
         # Delete the item itself
         Model.remove(self, item)
 
+    def bulkRemove(self, items, **kwargs):
+        """
+        Delete many items at once, along with their files and pending uploads.
+        Sizes are not propagated; callers are responsible for updating the
+        sizes of any folders and root data nodes that still exist.
+
+        :param items: The item documents to remove.
+        :type items: list
+        """
+        if not items:
+            return
+        itemIds = [item['_id'] for item in items]
+        fileModel = self.model('file')
+        fileKwargs = kwargs.copy()
+        fileKwargs['updateItemSize'] = False
+
+        files = fileModel.find({'itemId': {'$in': itemIds}})
+        batch = []
+        for file in files:
+            batch.append(file)
+            if len(batch) >= fileModel.bulkRemoveBatchSize:
+                fileModel.bulkRemove(batch, **fileKwargs)
+                batch = []
+        fileModel.bulkRemove(batch, **fileKwargs)
+
+        uploads = self.model('upload').find({
+            'parentId': {'$in': itemIds},
+            'parentType': 'item'
+        })
+        for upload in uploads:
+            self.model('upload').remove(upload, **kwargs)
+
+        return Model.bulkRemove(self, items, **kwargs)
+
     def createItem(self, name, creator, folder, description='',
                    reuseExisting=False):
         """
@@ -263,6 +326,8 @@ class Item(acl_mixin.AccessControlMixin, Model):
             'name': self._validateString(name),
             'description': self._validateString(description),
             'folderId': ObjectId(folder['_id']),
+            'ancestors': self.model('folder').getAncestorIds(folder) + [
+                ObjectId(folder['_id'])],
             'creatorId': creator['_id'],
             'baseParentType': folder['baseParentType'],
             'baseParentId': folder['baseParentId'],
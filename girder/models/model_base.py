@@ -18,6 +18,7 @@
 ###############################################################################
 
 import copy
+import datetime
 import functools
 import itertools
 import pymongo
@@ -31,6 +32,7 @@ from girder import events, logprint
 from girder.constants import AccessType, CoreEventHandler, ACCESS_FLAGS, TEXT_SCORE_SORT_MAX
 from girder.external.mongodb_proxy import MongoProxy
 from girder.models import getDbConnection
+from girder.utility import request_cache, size_accounting
 from girder.utility.model_importer import ModelImporter
 
 # pymongo3 complains about extra kwargs to find(), so we must filter them.
@@ -38,6 +40,21 @@ _allowedFindArgs = ('cursor_type', 'allow_partial_results', 'oplog_replay',
                     'modifiers', 'manipulate')
 
 
+def _updatedFields(update):
+    """
+    Return the top-level fields modified by an update specifier, or None if it
+    replaces whole documents.
+    """
+    fields = set()
+    for operator, values in six.viewitems(update):
+        if not operator.startswith('$') or not isinstance(values, dict):
+            return None
+        fields.update(key.split('.', 1)[0] for key in values)
+        if operator == '$rename':
+            fields.update(key.split('.', 1)[0] for key in six.viewvalues(values))
+    return fields
+
+
 class Model(ModelImporter):
     """
     Model base class. Models are responsible for abstracting away the
@@ -45,6 +62,8 @@ class Model(ModelImporter):
     model. Methods that deal with database interaction belong in the
     model layer.
     """
+    # The maximum number of documents removed by each query of a bulk removal
+    bulkRemoveBatchSize = 1000
 
     def __init__(self):
         self.name = None
@@ -413,6 +432,8 @@ class Model(ModelImporter):
         except WriteError as e:
             raise ValidationException('Database save failed: %s' % e.details)
 
+        self._invalidateRequestCache(document['_id'], fields=() if isNew else None)
+
         if triggerEvents:
             if isNew:
                 events.trigger('model.%s.save.created' % self.name, document)
@@ -439,10 +460,18 @@ class Model(ModelImporter):
         :type multi: bool
         :returns: A pymongo UpdateResult object.
         """
-        if multi:
-            return self.collection.update_many(query, update)
-        else:
-            return self.collection.update_one(query, update)
+        # If the query selects a single document by _id, only it has changed.
+        # Cached copies are discarded after the write, so that a copy loaded
+        # by another thread or process in the meantime isn't kept.
+        id = query.get('_id')
+        try:
+            if multi:
+                return self.collection.update_many(query, update)
+            else:
+                return self.collection.update_one(query, update)
+        finally:
+            self._invalidateRequestCache(
+                None if isinstance(id, dict) else id, fields=_updatedFields(update))
 
     def increment(self, query, field, amount, **kwargs):
         """
@@ -462,6 +491,127 @@ class Model(ModelImporter):
             '$inc': {field: amount}
         }, **kwargs)
 
+    def incrementMany(self, field, amounts):
+        """
+        Atomically increment a field of several documents, each by its own
+        amount, with a single bulk write.
+
+        :param field: The name of the field in the documents to increment.
+        :type field: str
+        :param amounts: The amount to increment each document by, keyed by
+            the _id of the document.
+        :type amounts: dict
+        :raises pymongo.errors.BulkWriteError: If some of the increments
+            failed. The others have been applied, and the ``failedIds``
+            attribute of the exception lists the _ids that were not changed.
+        """
+        if not amounts:
+            return
+        ids = list(amounts)
+        try:
+            self.collection.bulk_write([
+                pymongo.UpdateOne({'_id': id}, {'$inc': {field: amounts[id]}})
+                for id in ids
+            ], ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            e.failedIds = [ids[error['index']] for error in e.details.get('writeErrors', [])]
+            raise
+        finally:
+            for id in ids:
+                self._invalidateRequestCache(id, fields=(field.split('.', 1)[0],))
+
+    def validateMetadataQuery(self, query, parentField):
+        """
+        Check a query that selects the documents for ``setMetadataMany`` on
+        behalf of a user who is not an admin. It must match one parent
+        exactly, and may otherwise only match exact values of metadata fields,
+        so that it can neither run server-side code nor scan the collection.
+
+        :param query: The query to check.
+        :type query: dict
+        :param parentField: The field holding the id of each document's parent.
+        :type parentField: str
+        :raises: ValidationException
+        """
+        plainTypes = six.string_types + six.integer_types + (
+            float, bool, ObjectId, datetime.datetime, type(None))
+
+        if not isinstance(query.get(parentField), ObjectId):
+            raise ValidationException(
+                'The query must match a single %s.' % parentField, parentField)
+        for key, value in six.viewitems(query):
+            if key != parentField and (not key.startswith('meta.') or '$' in key):
+                raise ValidationException(
+                    'The query may only match %s and metadata fields.' % parentField, key)
+            if not isinstance(value, plainTypes):
+                raise ValidationException(
+                    'The query may only match exact values of fields.', key)
+
+    def setMetadataMany(self, updates, allowNull=False):
+        """
+        Set metadata on many documents with a single unordered bulk write.
+        As with the ``setMetadata`` method of items and folders, the given keys
+        are added to the ``meta`` field of each document, and keys whose value
+        is None are deleted unless ``allowNull`` is set.
+
+        Access is not checked here, and the documents are not validated or
+        saved individually. Instead of the per-document save events, a single
+        ``model.<name>.set_metadata_many`` event is triggered after the write
+        with the list of updates.
+
+        :param updates: The _id of each document to update and the metadata to
+            set on it.
+        :type updates: list of (ObjectId, dict) tuples
+        :param allowNull: Whether to allow `null` values to be set in the
+            metadata. If set to `False` or omitted, a `null` value will cause
+            that metadata field to be deleted.
+        :type allowNull: bool
+        :returns: The number of documents that were found.
+        """
+        if not updates:
+            return 0
+
+        now = datetime.datetime.utcnow()
+        operations = []
+        for id, metadata in updates:
+            self.validateKeys(metadata)
+            update = {'$set': {'updated': now}}
+            for key, value in six.viewitems(metadata):
+                if value is None and not allowNull:
+                    update.setdefault('$unset', {})['meta.' + key] = ''
+                else:
+                    update['$set']['meta.' + key] = value
+            operations.append(pymongo.UpdateOne({'_id': id}, update))
+
+        result = self.collection.bulk_write(operations, ordered=False)
+        for id, _ in updates:
+            self._invalidateRequestCache(id)
+
+        events.trigger('.'.join(('model', self.name, 'set_metadata_many')), {
+            'updates': updates,
+            'allowNull': allowNull
+        })
+        return result.matched_count
+
+    def insertMany(self, documents):
+        """
+        Insert many new documents with unordered bulk inserts, setting the _id
+        of each document. The documents are not validated and the
+        per-document save events are not triggered, so callers must only pass
+        documents that are already valid. Instead, a single
+        ``model.<name>.insert_many`` event is triggered afterward with the
+        list of documents.
+
+        :param documents: The documents to insert.
+        :type documents: list of dict
+        :returns: The inserted documents.
+        """
+        if not documents:
+            return documents
+        self.collection.insert_many(documents, ordered=False)
+        events.trigger('.'.join(('model', self.name, 'insert_many')), documents)
+        return documents
+
     def remove(self, document, **kwargs):
         """
         Delete an object from the collection; must have its _id set.
@@ -479,7 +629,47 @@ class Model(ModelImporter):
             })
 
         if not event.defaultPrevented and not kwargsEvent.defaultPrevented:
-            return self.collection.delete_one({'_id': document['_id']})
+            try:
+                return self.collection.delete_one({'_id': document['_id']})
+            finally:
+                self._invalidateRequestCache(document['_id'])
+
+    def bulkRemove(self, documents, **kwargs):
+        """
+        Delete many objects from the collection with a single query. The
+        ``model.<name>.remove`` and ``model.<name>.remove_with_kwargs`` events
+        are triggered for each document as in :py:meth:`remove`, and documents
+        whose removal is prevented are kept. A single
+        ``model.<name>.remove_many`` event is then triggered with the list of
+        documents that will be removed and any kwargs.
+
+        :param documents: the documents to remove, each with its _id set.
+        :type documents: list
+        """
+        removed = []
+        for document in documents:
+            event = events.trigger('.'.join(('model', self.name, 'remove')),
+                                   document)
+            kwargsEvent = events.trigger(
+                '.'.join(('model', self.name, 'remove_with_kwargs')), {
+                    'document': document,
+                    'kwargs': kwargs
+                })
+            if not event.defaultPrevented and not kwargsEvent.defaultPrevented:
+                removed.append(document)
+
+        if not removed:
+            return
+        events.trigger('.'.join(('model', self.name, 'remove_many')), {
+            'documents': removed,
+            'kwargs': kwargs
+        })
+        try:
+            return self.collection.delete_many({
+                '_id': {'$in': [doc['_id'] for doc in removed]}
+            })
+        finally:
+            self._invalidateRequestCache()
 
     def removeWithQuery(self, query):
         """
@@ -492,7 +682,25 @@ class Model(ModelImporter):
         """
         assert query
 
-        return self.collection.delete_many(query)
+        try:
+            return self.collection.delete_many(query)
+        finally:
+            self._invalidateRequestCache()
+
+    def _invalidateRequestCache(self, id=None, fields=None):
+        """
+        Discard any copies of documents of this model that were cached for
+        access checks during the current request.
+
+        :param id: The _id of the modified document, or None if any number of
+            documents may have been modified.
+        :param fields: The top-level fields that were modified, or None if
+            they are not known or documents were removed. An empty collection
+            means that no existing document changed, as when one is inserted.
+            Subclasses with longer-lived caches may use this to skip
+            invalidating them.
+        """
+        request_cache.invalidate('acl.%s' % self.name, id)
 
     def load(self, id, objectId=True, fields=None, exc=False):
         """
@@ -554,6 +762,12 @@ class Model(ModelImporter):
 
         out['_modelType'] = self.name
 
+        # Include size changes that have not been written to the database yet
+        if 'size' in out and '_id' in doc:
+            pendingSize = size_accounting.pending(self.name, doc['_id'])
+            if pendingSize:
+                out['size'] += pendingSize
+
         return out
 
     def subtreeCount(self, doc):
@@ -808,9 +1022,12 @@ class AccessControlledModel(Model):
 
         event = events.trigger('model.%s.save' % self.name, doc)
         if not event.defaultPrevented:
-            doc = self.collection.find_one_and_update(
-                {'_id': ObjectId(doc['_id'])}, update,
-                return_document=pymongo.ReturnDocument.AFTER)
+            id = ObjectId(doc['_id'])
+            try:
+                doc = self.collection.find_one_and_update(
+                    {'_id': id}, update, return_document=pymongo.ReturnDocument.AFTER)
+            finally:
+                self._invalidateRequestCache(id)
             events.trigger('model.%s.save.after' % self.name, doc)
         return doc
 
@@ -1301,9 +1518,8 @@ class AccessControlledModel(Model):
         :param sort: The sort order
         :type sort: List of (key, order) tuples
         """
-        cursor = self.find({}, sort=sort)
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
+        return self.findWithPermissions(
+            {}, sort=sort, user=user, level=AccessType.READ, limit=limit,
             offset=offset)
 
     def copyAccessPolicies(self, src, dest, save=False):
@@ -1326,6 +1542,132 @@ class AccessControlledModel(Model):
             dest = self.save(dest)
         return dest
 
+    def permissionClauses(self, user=None, level=None, flags=None, prefix=''):
+        """
+        Compile the access checks performed by :py:meth:`hasAccess` and
+        :py:meth:`hasAccessFlags` into a MongoDB query clause, so that
+        permission filtering can be done by the database rather than in python.
+
+        :param user: The user to check policies against.
+        :type user: dict or None
+        :param level: The access level, or None to skip the level check.
+        :type level: AccessType or None
+        :param flags: A flag or set of flags to test.
+        :type flags: flag identifier, or a list/set/tuple of them
+        :param prefix: A prefix to add to the field names of the query, for
+            use when the documents to check are nested within another document,
+            as in the output of an aggregation ``$lookup`` stage.
+        :type prefix: str
+        :returns: A query dict. This is empty if no filtering is required.
+        """
+        if user and user['admin']:
+            return {}
+
+        clauses = []
+        if level is not None:
+            levelClauses = []
+            if level <= AccessType.READ:
+                levelClauses.append({prefix + 'public': True})
+            if user:
+                levelClauses.append({prefix + 'access.users': {'$elemMatch': {
+                    'id': user['_id'],
+                    'level': {'$gte': level}
+                }}})
+                if user.get('groups'):
+                    levelClauses.append({prefix + 'access.groups': {'$elemMatch': {
+                        'id': {'$in': user['groups']},
+                        'level': {'$gte': level}
+                    }}})
+            if not levelClauses:
+                # Anonymous users may never have more than read access.
+                return {prefix + '_id': {'$exists': False}}
+            clauses.append({'$or': levelClauses})
+
+        clauses.extend(self._flagClauses(user, flags, prefix))
+
+        if not clauses:
+            return {}
+        if len(clauses) == 1:
+            return clauses[0]
+        return {'$and': clauses}
+
+    def _flagClauses(self, user, flags, prefix=''):
+        """
+        Private helper for :py:meth:`permissionClauses` that returns a list of
+        query clauses, one per required access flag.
+        """
+        if not flags:
+            return []
+
+        if not isinstance(flags, (list, tuple, set)):
+            flags = {flags}
+
+        clauses = []
+        for flag in sorted(set(flags)):
+            flagClauses = [{prefix + 'publicFlags': flag}]
+            if user:
+                flagClauses.append({prefix + 'access.users': {'$elemMatch': {
+                    'id': user['_id'],
+                    'flags': flag
+                }}})
+                if user.get('groups'):
+                    flagClauses.append({prefix + 'access.groups': {'$elemMatch': {
+                        'id': {'$in': user['groups']},
+                        'flags': flag
+                    }}})
+            clauses.append({'$or': flagClauses})
+        return clauses
+
+    def _addPermissionFilters(self, query, user, level, flags=None):
+        """
+        Return a copy of the given query with the permission clauses for the
+        user and level added to it. The clauses are added under a top-level
+        ``$and`` so that they do not interfere with any ``$or`` or ``$text``
+        operators already present in the query.
+        """
+        query = dict(query or {})
+        clauses = self.permissionClauses(user, level, flags)
+        if clauses:
+            query['$and'] = list(query.get('$and', [])) + [clauses]
+        return query
+
+    def findWithPermissions(self, query=None, offset=0, limit=0, timeout=None, fields=None,
+                            sort=None, user=None, level=AccessType.READ, flags=None,
+                            **kwargs):
+        """
+        Search the collection by a set of parameters, only returning results
+        that the given user has the requested level of access and access flags
+        on. Unlike :py:meth:`filterResultsByPermission`, the permission check is
+        done as part of the database query, so offset, limit, and counting are
+        all performed by the database. Passes any extra kwargs through to
+        :py:meth:`find`.
+
+        :param query: The search query (see general MongoDB docs for "find()")
+        :type query: dict
+        :param offset: The offset into the results
+        :type offset: int
+        :param limit: Maximum number of documents to return
+        :type limit: int
+        :param timeout: Cursor timeout in ms. Default is no timeout.
+        :type timeout: int
+        :param fields: A mask for filtering result documents by key, or None to return the full
+            document, passed to MongoDB find() as the `projection` param.
+        :type fields: `str, list of strings or tuple of strings for fields to be included from the
+            document, or dict for an inclusion or exclusion projection`.
+        :param sort: The sort order.
+        :type sort: List of (key, order) tuples.
+        :param user: The user to check policies against.
+        :type user: dict or None
+        :param level: The access level, or None to skip the level check.
+        :type level: AccessType or None
+        :param flags: A flag or set of flags to test.
+        :type flags: flag identifier, or a list/set/tuple of them
+        :returns: A pymongo database cursor.
+        """
+        query = self._addPermissionFilters(query, user, level, flags)
+        return self.find(query, offset=offset, limit=limit, timeout=timeout,
+                         fields=fields, sort=sort, **kwargs)
+
     def filterResultsByPermission(self, cursor, user, level, limit=0, offset=0,
                                   removeKeys=(), flags=None):
         """
@@ -1333,6 +1675,10 @@ class AccessControlledModel(Model):
         results that the user has the given level of access and specified access flags on,
         respecting the limit and offset specified.
 
+        Since every document before the requested offset must be fetched and
+        checked, prefer :py:meth:`findWithPermissions` when the query can be
+        built directly.
+
         :param cursor: The database cursor object from "find()".
         :param user: The user to check policies against.
         :type user: dict or None
@@ -1388,12 +1734,11 @@ class AccessControlledModel(Model):
         :param level: The access level to require.
         :type level: girder.constants.AccessType
         """
-        filters = filters or {}
+        filters = self._addPermissionFilters(filters, user, level)
 
-        cursor = Model.textSearch(
-            self, query=query, filters=filters, sort=sort, fields=fields)
-        return self.filterResultsByPermission(
-            cursor, user=user, level=level, limit=limit, offset=offset)
+        return Model.textSearch(
+            self, query=query, filters=filters, limit=limit, offset=offset,
+            sort=sort, fields=fields)
 
     def prefixSearch(self, query, user=None, filters=None, limit=0, offset=0,
                      sort=None, fields=None, level=AccessType.READ, prefixSearchFields=None):
@@ -1424,13 +1769,11 @@ class AccessControlledModel(Model):
         :returns: A pymongo cursor. It is left to the caller to build the
             results from the cursor.
         """
-        filters = filters or {}
+        filters = self._addPermissionFilters(filters, user, level)
 
-        cursor = Model.prefixSearch(
-            self, query, filters=filters, sort=sort, fields=fields,
-            prefixSearchFields=prefixSearchFields)
-        return self.filterResultsByPermission(
-            cursor, user=user, level=level, limit=limit, offset=offset)
+        return Model.prefixSearch(
+            self, query, filters=filters, limit=limit, offset=offset, sort=sort,
+            fields=fields, prefixSearchFields=prefixSearchFields)
 
 
 class AccessException(Exception):
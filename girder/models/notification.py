@@ -22,6 +22,7 @@ import six
 import time
 
 from .model_base import Model
+from girder.utility import notification_stream
 
 
 class ProgressState(object):
@@ -53,9 +54,22 @@ class Notification(Model):
         self.ensureIndices(('userId', 'time', 'updated', 'tokenId'))
         self.ensureIndex(('expires', {'expireAfterSeconds': 0}))
 
+    def reconnect(self):
+        super(Notification, self).reconnect()
+        notification_stream.ensureBroadcastCollection(self.database)
+
     def validate(self, doc):
         return doc
 
+    def save(self, document, *args, **kwargs):
+        """
+        Override of Model.save that also sends the notification to the open
+        streams of every process.
+        """
+        document = super(Notification, self).save(document, *args, **kwargs)
+        notification_stream.publish(self.database, document)
+        return document
+
     def createNotification(self, type, data, user, expires=None, token=None):
         """
         Create a generic notification.
@@ -25,7 +25,7 @@ import six
 from ..constants import GIRDER_ROUTE_ID, GIRDER_STATIC_ROUTE_ID, SettingDefault, SettingKey
 from .model_base import Model, ValidationException
 from girder import logprint
-from girder.utility import config, plugin_utilities, setting_utilities
+from girder.utility import config, plugin_utilities, process_cache, setting_utilities
 from girder.utility.model_importer import ModelImporter
 from bson.objectid import ObjectId
 
@@ -33,9 +33,16 @@ from bson.objectid import ObjectId
 class Setting(Model):
     """
     This model represents server-wide configuration settings as key/value pairs.
+
+    Settings are read far more often than they are written, so each process
+    keeps them in a :py:class:`girder.utility.process_cache.ProcessCache`.
+    Writes made through this model evict the key from the cache of every
+    process.
     """
     def initialize(self):
         self.name = 'setting'
+        self.cache = process_cache.ProcessCache(
+            'setting', 'setting_ttl', 'setting_max_entries', ttl=60, maxEntries=1000)
         # We had been asking for an index on key, like so:
         #   self.ensureIndices(['key'])
         # We really want the index to be unique, which could be done:
@@ -81,6 +88,20 @@ class Setting(Model):
                     self.collection.delete_one({'_id': duplicateId})
             self.collection.create_index('key', unique=True)
 
+        process_cache.ensureInvalidationCollection(self.database)
+        self.clearCache()
+
+    def clearCache(self, key=None):
+        """
+        Evict a setting, or all settings, from this process's setting cache.
+        This does not affect other processes; use :py:meth:`set` or
+        :py:meth:`unset` to modify settings so that all processes are notified.
+
+        :param key: The key to evict, or None to clear the entire cache.
+        :type key: str or None
+        """
+        self.cache.clear(key)
+
     def validate(self, doc):
         """
         This method is in charge of validating that the setting key is a valid
@@ -106,7 +127,7 @@ class Setting(Model):
         :param default: If no such setting exists, returns this value instead.
         :returns: The value, or the default value if the key is not found.
         """
-        setting = self.findOne({'key': key})
+        setting = self.cache.get(key, lambda: self.findOne({'key': key}))
         if setting is None:
             if default is '__default__':
                 default = self.getDefault(key)
@@ -146,6 +167,26 @@ class Setting(Model):
         for setting in self.find({'key': key}):
             self.remove(setting)
 
+    def save(self, document, *args, **kwargs):
+        """
+        Override of Model.save that notifies all processes that the setting has
+        changed.
+        """
+        try:
+            return super(Setting, self).save(document, *args, **kwargs)
+        finally:
+            self.cache.invalidate(document['key'])
+
+    def remove(self, document, **kwargs):
+        """
+        Override of Model.remove that notifies all processes that the setting
+        has been removed.
+        """
+        try:
+            return super(Setting, self).remove(document, **kwargs)
+        finally:
+            self.cache.invalidate(document['key'])
+
     def getDefault(self, key):
         """
         Retrieve the system default for a value.
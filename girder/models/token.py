@@ -23,6 +23,7 @@ import six
 from girder.constants import AccessType, SettingKey, TokenScope
 from girder.models.model_base import AccessException
 from girder.utility import genToken
+from girder.utility.process_cache import ProcessCache
 from .model_base import AccessControlledModel
 
 
@@ -34,12 +35,39 @@ class Token(AccessControlledModel):
         self.name = 'token'
         self.ensureIndex(('expires', {'expireAfterSeconds': 0}))
         self.ensureIndex('apiKeyId')
+        self.cache = ProcessCache(
+            'token', 'auth_ttl', 'auth_max_entries', ttl=30, maxEntries=10000,
+            cacheNone=False)
 
     def validate(self, doc):
         # Remove any duplicate scopes
         doc['scope'] = list(set(doc['scope']))
         return doc
 
+    def loadCached(self, id):
+        """
+        Load a token without access checks, using the process-wide token cache
+        so that authenticating a request doesn't usually require a database
+        query. Unknown tokens are not cached. Since a cached token may outlive
+        its expiration time, callers must check its ``expires`` field.
+
+        :param id: The id of the token.
+        :type id: str
+        :returns: The token document, or None if it does not exist.
+        """
+        return self.cache.get(
+            str(id), lambda: self.load(id, force=True, objectId=False))
+
+    def _invalidateRequestCache(self, id=None, fields=None):
+        """
+        Also evict modified or deleted tokens from the token cache of every
+        process. Unknown tokens are not cached, so nothing is evicted when a
+        token is created.
+        """
+        super(Token, self)._invalidateRequestCache(id, fields)
+        if fields is None or fields:
+            self.cache.invalidate(None if id is None else str(id))
+
     def createToken(self, user=None, days=None, scope=None, apiKey=None):
         """
         Creates a new token. You can create an anonymous token
@@ -23,8 +23,8 @@ from bson.objectid import ObjectId
 
 from girder import events
 from girder.api import rest
-from girder.constants import SettingKey
-from girder.utility import assetstore_utilities
+from girder.constants import AccessType, SettingKey
+from girder.utility import assetstore_utilities, hash_state
 from .model_base import Model, GirderException, ValidationException
 from girder.utility import RequestBodyStream
 from girder.utility.progress import noProgress
@@ -197,6 +197,9 @@ class Upload(Model):
             file['created'] = datetime.datetime.utcnow()
             file['assetstoreId'] = assetstore['_id']
             file['size'] = upload['size']
+            # Digests of the previous contents no longer apply
+            for algorithm in hash_state.UPLOAD_ALGORITHMS:
+                file.pop(algorithm, None)
             # If the file was previously imported, it is no longer.
             if file.get('imported'):
                 file['imported'] = False
@@ -225,7 +228,21 @@ class Upload(Model):
                     file['attachedToId'] = upload['parentId']
 
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
-        file = adapter.finalizeUpload(upload, file)
+        if 'duplicateOf' in upload:
+            # Share the data of an existing file, keeping the assetstore
+            # specific fields that locate it, as a copied file does.
+            existing = self.model('file').load(upload['duplicateOf'], force=True)
+            content = {k: v for k, v in six.viewitems(existing) if k not in (
+                '_id', 'attachedToType', 'attachedToId', 'copied', 'copierId', 'updated')}
+            content.update(file)
+            file = adapter.copyFile(existing, content)
+        else:
+            file = adapter.finalizeUpload(upload, file)
+
+        if '_id' in upload:
+            # Let a client whose request to finalize the upload failed find
+            # the file it created
+            file['uploadId'] = upload['_id']
 
         event_document = {'file': file, 'upload': upload}
         events.trigger('model.file.finalizeUpload.before', event_document)
@@ -243,7 +260,7 @@ class Upload(Model):
         }
         if 'reference' in upload:
             eventParams['reference'] = upload['reference']
-        events.daemon.trigger('data.process', eventParams)
+        events.daemon.trigger('data.process', eventParams, key=file['_id'])
 
         return file
 
@@ -346,6 +363,16 @@ class Upload(Model):
         """
         assetstore = self.getTargetAssetstore(parentType, parent, assetstore)
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+        upload = self._newUpload(
+            user, name, parentType, parent, size, mimeType, reference, assetstore, attachParent)
+
+        upload = adapter.initUpload(upload)
+        if save:
+            upload = self.save(upload)
+        return upload
+
+    def _newUpload(self, user, name, parentType, parent, size, mimeType, reference,
+                   assetstore, attachParent):
         now = datetime.datetime.utcnow()
 
         if not mimeType:
@@ -375,12 +402,67 @@ class Upload(Model):
             upload['userId'] = user['_id']
         else:
             upload['userId'] = None
-
-        upload = adapter.initUpload(upload)
-        if save:
-            upload = self.save(upload)
         return upload
 
+    def findDuplicateFile(self, sha512, size, user, assetstore):
+        """
+        Find a file in an assetstore with the given contents that a user is
+        allowed to read. Files that the user cannot read are never returned,
+        so that a digest cannot be used to find out whether some content
+        exists on the server.
+
+        :param sha512: The hex SHA-512 digest of the contents.
+        :type sha512: str
+        :param size: The size of the contents in bytes.
+        :type size: int
+        :param user: The user who will own the duplicate.
+        :type user: dict
+        :param assetstore: The assetstore that must hold the contents.
+        :type assetstore: dict
+        :returns: A file document, or None.
+        """
+        cursor = self.model('file').find({
+            'sha512': sha512.lower(),
+            'size': size,
+            'assetstoreId': assetstore['_id'],
+            'itemId': {'$ne': None},
+            'imported': {'$ne': True}
+        })
+        for file in self.model('file').filterResultsByPermission(
+                cursor, user, AccessType.READ, limit=1):
+            return file
+
+    def uploadFromDuplicate(self, user, name, parentType, parent, size, sha512,
+                            mimeType=None, reference=None, assetstore=None,
+                            attachParent=False):
+        """
+        Create a file without transferring its contents, if the assetstore it
+        would be uploaded to already holds the same contents in a file that
+        the user can read. The new file shares the stored data with that file,
+        as a copied file does, and is finalized like any other upload. The
+        upload document passed to the finalization events has a
+        ``duplicateOf`` field with the id of the existing file.
+
+        The parameters are those of :py:meth:`createUpload`, plus:
+
+        :param sha512: The hex SHA-512 digest of the contents, computed by the
+            client.
+        :type sha512: str
+        :returns: The file that was created, or None if the contents must be
+            uploaded.
+        """
+        assetstore = self.getTargetAssetstore(parentType, parent, assetstore)
+        existing = self.findDuplicateFile(sha512, size, user, assetstore)
+        if existing is None:
+            return None
+
+        upload = self._newUpload(
+            user, name, parentType, parent, size, mimeType, reference, assetstore, attachParent)
+        upload['received'] = size
+        upload['sha512'] = existing['sha512']
+        upload['duplicateOf'] = existing['_id']
+        return self.finalizeUpload(upload, assetstore)
+
     def moveFileToAssetstore(self, file, user, assetstore, progress=noProgress):
         """
         Move a file from whatever assetstore it is located in to a different
@@ -469,8 +551,8 @@ class Upload(Model):
         """
         assetstore = self.model('assetstore').load(upload['assetstoreId'])
         # If the assetstore was deleted, the upload may still be in our
-        # database
-        if assetstore:
+        # database.  Uploads of duplicate contents have no data to discard.
+        if assetstore and 'duplicateOf' not in upload:
             adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
             try:
                 adapter.cancelUpload(upload)
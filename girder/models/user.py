@@ -25,6 +25,7 @@ from .model_base import AccessControlledModel, AccessException, ValidationExcept
 from girder import events
 from girder.constants import AccessType, CoreEventHandler, SettingKey, TokenScope
 from girder.utility import config, mail_utils
+from girder.utility.process_cache import ProcessCache
 
 
 class User(AccessControlledModel):
@@ -35,9 +36,12 @@ class User(AccessControlledModel):
     def initialize(self):
         self.name = 'user'
         self.ensureIndices(['login', 'email', 'groupInvites.groupId', 'size',
-                            'created'])
+                            'created', 'access.users.id', 'access.groups.id', 'public'])
         self.prefixSearchFields = (
             'login', ('firstName', 'i'), ('lastName', 'i'))
+        self.cache = ProcessCache(
+            'user', 'auth_ttl', 'auth_max_entries', ttl=30, maxEntries=10000,
+            cacheNone=False)
 
         self.ensureTextIndex({
             'login': 1,
@@ -170,6 +174,30 @@ class User(AccessControlledModel):
 
         return user
 
+    def loadCached(self, id):
+        """
+        Load a user without access checks, using the process-wide user cache
+        so that authenticating a request doesn't usually require a database
+        query.
+
+        :param id: The id of the user.
+        :type id: str or ObjectId
+        :returns: The user document, or None if it does not exist.
+        """
+        return self.cache.get(str(id), lambda: self.load(id, force=True))
+
+    def _invalidateRequestCache(self, id=None, fields=None):
+        """
+        Also evict modified or deleted users from the user cache of every
+        process, so that changes such as group membership, admin status, or
+        account status take effect immediately. Changes to only the sizes of
+        users are frequent and not broadcast, so the size of a cached user may
+        be out of date for up to ``auth_ttl`` seconds.
+        """
+        super(User, self)._invalidateRequestCache(id, fields)
+        if fields is None or not set(fields) <= {'size'}:
+            self.cache.invalidate(None if id is None else str(id))
+
     def remove(self, user, progress=None, **kwargs):
         """
         Delete a user, and all references to it in the database.
@@ -223,16 +251,13 @@ class User(AccessControlledModel):
         :param sort: The sort structure to pass to pymongo.
         :returns: Iterable of users.
         """
-        # Perform the find; we'll do access-based filtering of the result set
-        # afterward.
         if text is not None:
-            cursor = self.textSearch(text, sort=sort)
+            return self.textSearch(
+                text, user=user, sort=sort, limit=limit, offset=offset)
         else:
-            cursor = self.find({}, sort=sort)
-
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
-            offset=offset)
+            return self.findWithPermissions(
+                {}, sort=sort, user=user, level=AccessType.READ, limit=limit,
+                offset=offset)
 
     def setPassword(self, user, password, save=True):
         """
@@ -444,14 +469,10 @@ class User(AccessControlledModel):
         :type level: AccessLevel
         """
         count = 1
-        folders = self.model('folder').find({
+        folders = self.model('folder').findWithPermissions({
             'parentId': doc['_id'],
             'parentCollection': 'user'
-        }, fields=('access',))
-
-        if level is not None:
-            folders = self.filterResultsByPermission(
-                cursor=folders, user=user, level=level)
+        }, fields=(), user=user, level=level)
 
         count += sum(self.model('folder').subtreeCount(
             folder, includeItems=includeItems, user=user, level=level)
@@ -471,19 +492,10 @@ class User(AccessControlledModel):
         :param level: The required access level, or None to return the raw
             top-level folder count.
         """
-        fields = () if level is None else ('access', 'public')
-
-        folderModel = self.model('folder')
-        folders = folderModel.find({
+        return self.model('folder').findWithPermissions({
             'parentId': user['_id'],
             'parentCollection': 'user'
-        }, fields=fields)
-
-        if level is None:
-            return folders.count()
-        else:
-            return sum(1 for _ in folderModel.filterResultsByPermission(
-                cursor=folders, user=filterUser, level=level))
+        }, fields=(), user=filterUser, level=level).count()
 
     def updateSize(self, doc):
         """
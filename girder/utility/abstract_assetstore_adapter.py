@@ -14,7 +14,7 @@
 #  limitations under the License.
 ###############################################################################
 
-import itertools
+import collections
 import os
 import re
 import six
@@ -31,9 +31,14 @@ class FileHandle(object):
     This is the base class that is returned for the file-like API into
     Girder file objects. The ``open`` method of assetstore implementations
     is responsible for returning an instance of this class or one of its
-    subclasses. This base class implementation is returned by the
-    abstract assetstore adapter, and does not leverage any details of the
-    assetstore implementations.
+    subclasses.
+
+    Data is read in blocks of ``blockSize`` bytes through the ``readRange``
+    method of the assetstore adapter, which performs a native ranged read, and
+    the most recently used ``cacheBlocks`` blocks are kept. Seeking is free,
+    and random access only costs the blocks that are actually read. When reads
+    are sequential, the number of blocks fetched at once grows up to half of
+    the cache.
 
     These file handles are stateful, and therefore not safe for concurrent
     access. If used by multiple threads, mutexes should be used.
@@ -43,6 +48,9 @@ class FileHandle(object):
     :param adapter: The assetstore adapter corresponding to this file.
     :type adapter: girder.utility.abstract_assetstore_adapter.AbstractAssetstoreAdapter
     """
+    blockSize = 256 * 1024
+    cacheBlocks = 32
+
     def __init__(self, file, adapter):
         self._file = file
         self._adapter = adapter
@@ -50,6 +58,9 @@ class FileHandle(object):
         # If a read is requested that is longer than the specified size, raise
         # an exception.  This prevents unbounded memory use.
         self._maximumReadSize = 16 * 1024 * 1024
+        self._blocks = collections.OrderedDict()
+        self._nextBlock = None
+        self._readAhead = 1
 
         self.seek(0)
 
@@ -71,41 +82,54 @@ class FileHandle(object):
         :type size: int
         :rtype: bytes
         """
+        data = self.pread(size, self._pos)
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        """
+        Read bytes from the current position into a pre-allocated, writable
+        bytes-like object, such as a ``bytearray`` or ``memoryview``.
+
+        :param buffer: The object to read into. Up to its length is read.
+        :returns: The number of bytes read, which is 0 at the end of the file.
+        :rtype: int
+        """
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def pread(self, size, offset):
+        """
+        Read *size* bytes starting at *offset*, without using or changing the
+        current position.
+
+        :param size: The number of bytes to read. The actual number returned
+            could be less than this if the end of the file is reached. If None
+            or negative, read to the end of the file.
+        :type size: int
+        :param offset: The position in the file to read from.
+        :type offset: int
+        :rtype: bytes
+        """
         if size is None or size < 0:
-            size = self._file['size'] - self._pos
+            size = self._file['size'] - offset
         if size > self._maximumReadSize:
             raise GirderException('Read exceeds maximum allowed size.')
-        data = six.BytesIO()
-        length = 0
-        for chunk in itertools.chain(self._prev, self._stream):
-            chunkLen = len(chunk)
-
-            if chunkLen == 0:
-                break
-
-            if length + chunkLen <= size:
-                data.write(chunk)
-                self._prev = []
-                length += chunkLen
-
-                if length == size:
-                    break
-            else:
-                chunkLen = min(size - length, chunkLen)
-                data.write(chunk[:chunkLen])
-                self._prev = [chunk[chunkLen:]]
-                length += chunkLen
-                break
-
-        self._pos += length
-        return data.getvalue()
+        size = min(size, self._file['size'] - offset)
+        if size <= 0:
+            return b''
+
+        first = offset // self.blockSize
+        last = (offset + size - 1) // self.blockSize
+        data = b''.join(self._getBlocks(first, last))
+        start = offset - first * self.blockSize
+        return data[start:start + size]
 
     def tell(self):
         return self._pos
 
     def seek(self, offset, whence=os.SEEK_SET):
-        oldPos = self._pos
-
         if whence == os.SEEK_SET:
             self._pos = offset
         elif whence == os.SEEK_CUR:
@@ -113,12 +137,55 @@ class FileHandle(object):
         elif whence == os.SEEK_END:
             self._pos = max(self._file['size'] + offset, 0)
 
-        if self._pos != oldPos:
-            self._prev = []
-            self._stream = self._adapter.downloadFile(self._file, offset=self._pos, headers=False)()
-
     def close(self):
-        pass
+        self._blocks.clear()
+
+    def _getBlocks(self, first, last):
+        """
+        Return the data of a range of blocks, fetching each run of blocks that
+        is not cached with a single ranged read.
+        """
+        blocks = []
+        n = first
+        while n <= last:
+            if n in self._blocks:
+                # Move the block to the end of the LRU order
+                block = self._blocks.pop(n)
+                self._blocks[n] = block
+                blocks.append(block)
+                n += 1
+                continue
+            end = n
+            while end < last and end + 1 not in self._blocks:
+                end += 1
+            fetched = self._fetchBlocks(n, end)
+            blocks.extend(fetched[:end - n + 1])
+            n = end + 1
+        return blocks
+
+    def _fetchBlocks(self, first, last):
+        """
+        Read and cache a run of blocks, extending it with read-ahead when the
+        previous fetch ended just before it.
+        """
+        if first == self._nextBlock:
+            last = max(last, first + self._readAhead - 1)
+            self._readAhead = min(self._readAhead * 2, max(self.cacheBlocks // 2, 1))
+        else:
+            self._readAhead = 1
+        last = min(last, (self._file['size'] - 1) // self.blockSize)
+        self._nextBlock = last + 1
+
+        offset = first * self.blockSize
+        data = self._adapter.readRange(
+            self._file, offset, min((last + 1) * self.blockSize, self._file['size']) - offset)
+        blocks = [data[i:i + self.blockSize] for i in range(0, len(data), self.blockSize)]
+        for n, block in enumerate(blocks, first):
+            self._blocks.pop(n, None)
+            self._blocks[n] = block
+        while len(self._blocks) > self.cacheBlocks:
+            self._blocks.popitem(last=False)
+        return blocks
 
 
 class AbstractAssetstoreAdapter(ModelImporter):
@@ -222,6 +289,25 @@ class AbstractAssetstoreAdapter(ModelImporter):
         raise NotImplementedError('Must override deleteFile in %s.' %
                                   self.__class__.__name__)  # pragma: no cover
 
+    def deleteFiles(self, files):
+        """
+        This is called when many Files in this assetstore are deleted at once,
+        such as when a folder is deleted, to allow the adapter to remove their
+        data with as few operations as possible. As with :py:meth:`deleteFile`,
+        the File documents still exist when this is called, and they must not
+        be modified or deleted here.
+
+        The default implementation calls :py:meth:`deleteFile` for each file.
+        Adapters that share data between files with identical contents should
+        override this, since the other files in the batch will still appear to
+        reference the data.
+
+        :param files: The File documents about to be deleted.
+        :type files: list
+        """
+        for file in files:
+            self.deleteFile(file)
+
     def shouldImportFile(self, path, params):
         """
         This is a helper used during the import process to determine if a file located at
@@ -273,6 +359,28 @@ class AbstractAssetstoreAdapter(ModelImporter):
         raise NotImplementedError('Must override downloadFile in %s.' %
                                   self.__class__.__name__)  # pragma: no cover
 
+    def readRange(self, file, offset, length):
+        """
+        Return the bytes of a range of a file. File handles returned by
+        :py:meth:`open` use this for random access, so assetstores should
+        override it with a native ranged read. This default implementation
+        reads the range through :py:meth:`downloadFile`.
+
+        :param file: The file document being read.
+        :type file: dict
+        :param offset: The position of the first byte to read.
+        :type offset: int
+        :param length: The number of bytes to read. Fewer are returned if the
+            end of the file is reached.
+        :type length: int
+        :rtype: bytes
+        """
+        endByte = min(offset + length, file['size'])
+        if endByte <= offset:
+            return b''
+        stream = self.downloadFile(file, offset=offset, endByte=endByte, headers=False)
+        return b''.join(chunk for chunk in stream() if chunk)
+
     def findInvalidFiles(self, progress=progress.noProgress, filters=None,
                          checkSize=True, **kwargs):
         """
@@ -20,8 +20,12 @@
 import itertools
 import six
 
-from ..models.model_base import Model, AccessException
+from ..models.model_base import Model, AccessException, ValidationException
 from ..constants import AccessType
+from . import request_cache
+
+# The fields of an access controlled resource that are needed to check access.
+_ACCESS_FIELDS = ('access', 'public', 'publicFlags')
 
 
 class AccessControlMixin(object):
@@ -36,15 +40,87 @@ class AccessControlMixin(object):
 
     resourceParent corresponds to the field in which the parent resource
     belongs, so for an item it would be the folderId.
+
+    Parent resources are looked up in batches with a single ``$in`` query that
+    only fetches the fields required for access checks, and the results are
+    cached for the duration of the current request.
     """
     resourceColl = None
     resourceParent = None
 
+    # The number of results that filterResultsByPermission reads from the
+    # cursor before resolving the access of their parents in one query.
+    accessBatchSize = 100
+
+    def _accessControlledModel(self):
+        """
+        Return the model that actually stores the access control lists for
+        this resource, following the chain of resourceColl models.
+        """
+        model = self.model(self.resourceColl)
+        while isinstance(model, AccessControlMixin):
+            model = model.model(model.resourceColl)
+        return model
+
+    def resolveAccessResources(self, parentIds):
+        """
+        Given a set of resourceParent ids, look up the access controlled
+        documents that govern access to them. Only the fields required to check
+        access are loaded. Lookups are shared by all calls made during the same
+        request.
+
+        :param parentIds: The ids of the resourceParent documents.
+        :type parentIds: iterable of ObjectId
+        :returns: A dict mapping each of the ids to its access controlled
+            document, or to None if the document could not be found.
+        """
+        parentModel = self.model(self.resourceColl)
+        cacheName = 'acl.%s' % parentModel.name
+        cache = request_cache.getCache(cacheName)
+        if cache is None:
+            cache = {}
+
+        if isinstance(parentModel, AccessControlMixin):
+            fields = (parentModel.resourceParent, )
+        else:
+            fields = _ACCESS_FIELDS
+
+        parentIds = set(parentIds)
+        missing = [id for id in parentIds if id not in cache]
+        if missing:
+            for doc in parentModel.find({'_id': {'$in': missing}}, fields=fields):
+                cache[doc['_id']] = doc
+            for id in missing:
+                cache.setdefault(id, None)
+
+        docs = {id: cache[id] for id in parentIds}
+
+        if isinstance(parentModel, AccessControlMixin):
+            grandparentIds = [doc.get(parentModel.resourceParent)
+                              for doc in six.viewvalues(docs) if doc is not None]
+            resources = parentModel.resolveAccessResources(
+                [id for id in grandparentIds if id is not None])
+            docs = {
+                id: resources.get(doc.get(parentModel.resourceParent))
+                if doc is not None else None
+                for id, doc in six.viewitems(docs)
+            }
+
+        return docs
+
+    def _accessResource(self, doc):
+        """
+        Return the access controlled document governing the given document, or
+        None if it cannot be found.
+        """
+        parentId = doc[self.resourceParent]
+        return self.resolveAccessResources((parentId, )).get(parentId)
+
     def load(self, id, level=AccessType.ADMIN, user=None, objectId=True,
              force=False, fields=None, exc=False):
         """
-        Calls Model.load on the current item, and then attempts to load the
-        resourceParent which the user must have access to in order to load this
+        Calls Model.load on the current item, and then checks access on the
+        resourceParent, which the user must have access to in order to load this
         model.
 
         Takes the same parameters as
@@ -54,12 +130,15 @@ class AccessControlMixin(object):
 
         if not force and doc is not None:
             if doc.get(self.resourceParent):
-                loadType = self.resourceColl
-                loadId = doc[self.resourceParent]
+                resource = self._accessResource(doc)
+                if resource is not None:
+                    self._accessControlledModel().requireAccess(resource, user, level)
+                elif exc:
+                    raise ValidationException('No such %s: %s' % (
+                        self.resourceColl, doc[self.resourceParent]), field='id')
             else:
-                loadType = doc.get('attachedToType')
-                loadId = doc.get('attachedToId')
-            self.model(loadType).load(loadId, level=level, user=user, exc=exc)
+                self.model(doc.get('attachedToType')).load(
+                    doc.get('attachedToId'), level=level, user=user, exc=exc)
 
         return doc
 
@@ -71,10 +150,10 @@ class AccessControlMixin(object):
         Takes the same parameters as
         :py:func:`girder.models.model_base.AccessControlledModel.hasAccess`.
         """
-        resource = self.model(self.resourceColl) \
-                       .load(resource[self.resourceParent], force=True)
-        return self.model(self.resourceColl).hasAccess(
-            resource, user=user, level=level)
+        parent = self._accessResource(resource)
+        if parent is None:
+            return False
+        return self._accessControlledModel().hasAccess(parent, user=user, level=level)
 
     def hasAccessFlags(self, doc, user=None, flags=None):
         """
@@ -83,8 +162,10 @@ class AccessControlMixin(object):
         if not flags:
             return True
 
-        resource = self.model(self.resourceColl).load(doc[self.resourceParent], force=True)
-        return self.model(self.resourceColl).hasAccessFlags(resource, user, flags)
+        parent = self._accessResource(doc)
+        if parent is None:
+            return False
+        return self._accessControlledModel().hasAccessFlags(parent, user, flags)
 
     def requireAccess(self, doc, user=None, level=AccessType.READ):
         """
@@ -115,44 +196,53 @@ class AccessControlMixin(object):
         if not flags:
             return
 
-        resource = self.model(self.resourceColl).load(doc[self.resourceParent], force=True)
-        return self.model(self.resourceColl).requireAccessFlags(resource, user, flags)
+        parent = self._accessResource(doc)
+        if parent is None:
+            raise AccessException('Access denied for %s %s.' % (
+                self.name, doc.get('_id', 'unknown')))
+        return self._accessControlledModel().requireAccessFlags(parent, user, flags)
 
     def filterResultsByPermission(self, cursor, user, level, limit=0, offset=0,
                                   removeKeys=(), flags=None):
         """
         Yields filtered results from the cursor based on the access control
-        existing for the resourceParent.
+        existing for the resourceParent. Results are read from the cursor in
+        batches, and the parents of each batch are resolved with a single query.
 
         Takes the same parameters as
         :py:func:`girder.models.model_base.AccessControlledModel.filterResultsByPermission`.
         """
+        aclModel = self._accessControlledModel()
         # Cache mapping resourceIds -> access granted (bool)
         resourceAccessCache = {}
 
-        def hasAccess(_result):
-            resourceId = _result[self.resourceParent]
+        def hasAccess(resource):
+            if resource is None:
+                return False
+            val = aclModel.hasAccess(resource, user=user, level=level)
+            if flags:
+                val = val and aclModel.hasAccessFlags(resource, user=user, flags=flags)
+            return val
 
-            # return cached check if it exists
-            if resourceId in resourceAccessCache:
-                return resourceAccessCache[resourceId]
+        def accessibleResults():
+            while True:
+                batch = list(itertools.islice(cursor, self.accessBatchSize))
+                if not batch:
+                    return
 
-            # if the resourceId is not cached, check for permission "level"
-            # and set the cache
-            resource = self.model(self.resourceColl).load(resourceId, force=True)
-            val = self.model(self.resourceColl).hasAccess(
-                resource, user=user, level=level)
+                unknown = {result[self.resourceParent] for result in batch} - \
+                    set(resourceAccessCache)
+                if unknown:
+                    resources = self.resolveAccessResources(unknown)
+                    for resourceId in unknown:
+                        resourceAccessCache[resourceId] = hasAccess(resources[resourceId])
 
-            if flags:
-                val = val and self.model(self.resourceColl).hasAccessFlags(
-                    resource, user=user, flags=flags)
-
-            resourceAccessCache[resourceId] = val
-            return val
+                for result in batch:
+                    if resourceAccessCache[result[self.resourceParent]]:
+                        yield result
 
         endIndex = offset + limit if limit else None
-        filteredCursor = six.moves.filter(hasAccess, cursor)
-        for result in itertools.islice(filteredCursor, offset, endIndex):
+        for result in itertools.islice(accessibleResults(), offset, endIndex):
             for key in removeKeys:
                 if key in result:
                     del result[key]
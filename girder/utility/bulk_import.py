@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module contains the parts of importing existing data that are shared by
+assetstore adapters: creating the items and files of many imported objects
+with bulk writes, and walking the underlying storage with a pool of threads.
+"""
+
+import collections
+import datetime
+import pymongo
+import six
+import sys
+import threading
+
+from six.moves import queue
+
+from girder.utility import config, size_accounting
+from girder.utility.model_importer import ModelImporter
+from girder.utility.progress import noProgress
+
+
+def getWorkers():
+    """
+    Return the configured number of threads that imports walk the underlying
+    storage with.
+    """
+    return int(config.getConfig()['server'].get('import_workers', 4))
+
+
+def getBatchSize():
+    """
+    Return the configured number of files that imports create with each bulk
+    write.
+    """
+    return int(config.getConfig()['server'].get('import_batch_size', 1000))
+
+
+class BulkImporter(ModelImporter):
+    """
+    Creates the items and files of imported data in batches. Each imported
+    object becomes a file in an item of the same name, unless another item
+    name is given. Existing items and files with the same names are reused,
+    and are looked up with one query for each batch rather than one per
+    object.
+
+    Changes to the sizes of items, folders and their root are accumulated and
+    applied by :py:meth:`commitSizes`, so that many files in the same folder
+    result in a single update. Instances may be shared by several threads.
+
+    :param assetstore: The assetstore that holds the imported data.
+    :type assetstore: dict
+    :param user: The user creating the items and files.
+    :type user: dict
+    :param batchSize: The maximum number of files created with each bulk
+        write, or None to use the ``import_batch_size`` option of the
+        ``[server]`` configuration.
+    :type batchSize: int or None
+    """
+    def __init__(self, assetstore, user, batchSize=None):
+        self.assetstore = assetstore
+        self.user = user
+        self.batchSize = batchSize or getBatchSize()
+        self._sizes = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def importFiles(self, entries):
+        """
+        Create or reuse the items and files for a list of imported objects.
+
+        :param entries: The objects to import. Each is a dict with the
+            ``folder`` document to import it into, the ``name`` and ``size``
+            of the file, and optionally the ``itemName`` of the item to put it
+            in, its ``mimeType``, and a dict of ``fields`` to set on the file
+            document, such as the location of the data in the assetstore. The
+            size of an existing file is updated if it has changed.
+        :type entries: list of dict
+        :returns: The file document of each entry.
+        """
+        files = []
+        for start in range(0, len(entries), self.batchSize):
+            files.extend(self._importBatch(entries[start:start + self.batchSize]))
+        return files
+
+    def commitSizes(self):
+        """
+        Apply the accumulated size changes of the imported files.
+        """
+        with self._lock:
+            sizes, self._sizes = self._sizes, collections.defaultdict(int)
+        for (modelName, id), amount in six.viewitems(sizes):
+            size_accounting.add(modelName, id, amount)
+
+    def _importBatch(self, entries):
+        if not entries:
+            return []
+        keys = [(entry['folder']['_id'], entry.get('itemName', entry['name']))
+                for entry in entries]
+        items = self._findItems(entries, keys)
+
+        files = {}
+        existingItemIds = list({item['_id'] for item in six.viewvalues(items)})
+        if existingItemIds:
+            for file in self.model('file').find({
+                'itemId': {'$in': existingItemIds},
+                'name': {'$in': list({entry['name'] for entry in entries})}
+            }):
+                files[(file['itemId'], file['name'])] = file
+
+        newItems = []
+        for entry, key in zip(entries, keys):
+            if key not in items:
+                items[key] = self._itemDocument(entry['folder'], key[1])
+                newItems.append(items[key])
+        self.model('item').insertMany(newItems)
+
+        now = datetime.datetime.utcnow()
+        newFiles = []
+        updates = []
+        results = []
+        for entry, key in zip(entries, keys):
+            item = items[key]
+            file = files.get((item['_id'], entry['name']))
+            fields = entry.get('fields') or {}
+            if file is None:
+                file = {
+                    'created': now,
+                    'creatorId': self.user['_id'],
+                    'assetstoreId': self.assetstore['_id'],
+                    'name': entry['name'],
+                    'mimeType': entry.get('mimeType'),
+                    'size': entry['size'],
+                    'itemId': item['_id'],
+                    'exts': [ext.lower() for ext in entry['name'].split('.')[1:]]
+                }
+                file.update(fields)
+                files[(item['_id'], entry['name'])] = file
+                newFiles.append(file)
+                self._addSize(item, entry['size'])
+            else:
+                if file.get('size') != entry['size']:
+                    self._addSize(item, entry['size'] - file.get('size', 0))
+                    fields = dict(fields, size=entry['size'])
+                if fields:
+                    file.update(fields)
+                    updates.append(pymongo.UpdateOne({'_id': file['_id']}, {'$set': fields}))
+            results.append(file)
+
+        self.model('file').insertMany(newFiles)
+        if updates:
+            self.model('file').collection.bulk_write(updates, ordered=False)
+        return results
+
+    def _findItems(self, entries, keys):
+        """
+        Look up the existing items for a batch of entries. Items whose names
+        collide with a sibling folder are created individually, since the item
+        model renames them.
+        """
+        folderIds = list({folderId for folderId, _ in keys})
+        names = list({name for _, name in keys})
+        items = {}
+        for item in self.model('item').find({
+            'folderId': {'$in': folderIds},
+            'name': {'$in': names}
+        }):
+            items[(item['folderId'], item['name'])] = item
+
+        clashes = {(folder['parentId'], folder['name']) for folder in self.model('folder').find({
+            'parentId': {'$in': folderIds},
+            'parentCollection': 'folder',
+            'name': {'$in': names}
+        }, fields=['parentId', 'name'])}
+        for entry, key in zip(entries, keys):
+            if key in clashes and key not in items:
+                items[key] = self.model('item').createItem(
+                    name=key[1], creator=self.user, folder=entry['folder'],
+                    reuseExisting=True)
+        return items
+
+    def _itemDocument(self, folder, name):
+        """
+        Build the document of a new item, as :py:meth:`Item.createItem` and
+        :py:meth:`Item.validate` would.
+        """
+        folderModel = self.model('folder')
+        if 'baseParentType' not in folder:
+            pathFromRoot = self.model('item').parentsToRoot(
+                {'folderId': folder['_id']}, self.user, force=True)
+            folder['baseParentType'] = pathFromRoot[0]['type']
+            folder['baseParentId'] = pathFromRoot[0]['object']['_id']
+
+        now = datetime.datetime.utcnow()
+        name = name.strip()
+        return {
+            'name': name,
+            'lowerName': name.lower(),
+            'description': '',
+            'folderId': folder['_id'],
+            'ancestors': folderModel.getAncestorIds(folder) + [folder['_id']],
+            'creatorId': self.user['_id'],
+            'baseParentType': folder['baseParentType'],
+            'baseParentId': folder['baseParentId'],
+            'created': now,
+            'updated': now,
+            'size': 0
+        }
+
+    def _addSize(self, item, size):
+        if not size:
+            return
+        with self._lock:
+            self._sizes[('item', item['_id'])] += size
+            self._sizes[('folder', item['folderId'])] += size
+            self._sizes[(item['baseParentType'], item['baseParentId'])] += size
+
+
+def walkParallel(roots, walk, progress=noProgress, workers=None):
+    """
+    Walk the underlying storage of an import with a pool of threads. Each
+    task, such as a directory or a prefix, is passed to ``walk`` along with
+    two functions: ``add(task)`` queues further tasks, and
+    ``report(count, message)`` records progress. Progress is only written from
+    the calling thread. If a task raises an exception, the remaining tasks are
+    abandoned and the exception is raised here.
+
+    :param roots: The initial tasks.
+    :type roots: iterable
+    :param walk: The function that processes a task.
+    :type walk: callable
+    :param progress: The progress context of the import.
+    :type progress: :py:class:`girder.utility.progress.ProgressContext`
+    :param workers: The number of threads, or None to use the
+        ``import_workers`` option of the ``[server]`` configuration. If this is
+        0, the tasks are processed by the calling thread.
+    :type workers: int or None
+    """
+    if workers is None:
+        workers = getWorkers()
+
+    def report(count, message):
+        progress.update(increment=count, message=message)
+
+    if workers <= 0:
+        tasks = collections.deque(roots)
+        while tasks:
+            walk(tasks.popleft(), tasks.append, report)
+        return
+
+    pool = _WalkPool(walk, workers)
+    for root in roots:
+        pool.add(root)
+    pool.run(report)
+
+
+class _WalkPool(object):
+    """
+    The threads and queues used by :py:func:`walkParallel`.
+    """
+    def __init__(self, walk, workers):
+        self.walk = walk
+        self.workers = workers
+        self.tasks = queue.Queue()
+        self.reports = queue.Queue()
+        self.stopped = threading.Event()
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def add(self, task):
+        with self.lock:
+            self.pending += 1
+        self.tasks.put(task)
+
+    def report(self, count, message):
+        self.reports.put((count, message, None))
+
+    def run(self, report):
+        if not self.pending:
+            return
+        threads = [threading.Thread(target=self._work) for _ in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        excInfo = None
+        try:
+            while not self.stopped.is_set() or not self.reports.empty():
+                try:
+                    count, message, error = self.reports.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if error is not None:
+                    excInfo = excInfo or error
+                    self.stopped.set()
+                elif count or message:
+                    report(count, message)
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+        if excInfo is not None:
+            six.reraise(*excInfo)
+
+    def _work(self):
+        while not self.stopped.is_set():
+            try:
+                task = self.tasks.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                self.walk(task, self.add, self.report)
+            except Exception:
+                self.reports.put((0, None, sys.exc_info()))
+            with self.lock:
+                self.pending -= 1
+                if not self.pending:
+                    self.stopped.set()
@@ -17,8 +17,9 @@
 #  limitations under the License.
 ###############################################################################
 
+import cherrypy
+import datetime
 import filelock
-from hashlib import sha512
 import os
 import psutil
 import shutil
@@ -28,11 +29,13 @@ import stat
 import tempfile
 
 from girder import events, logger
-from girder.api.rest import setResponseHeader
+from girder.api.rest import setContentDisposition, setResponseHeader
 from girder.models.model_base import ValidationException, GirderException
-from girder.utility import mkdir, progress
-from . import hash_state
+from girder.utility import config, mkdir, progress
+from . import bulk_import, hash_state
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
+from .model_importer import ModelImporter
+from six.moves import urllib
 
 BUF_SIZE = 65536
 
@@ -144,7 +147,7 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         fd, path = tempfile.mkstemp(dir=self.tempDir)
         os.close(fd)  # Must close this file descriptor or it will leak
         upload['tempFile'] = path
-        upload['sha512state'] = hash_state.serializeHex(sha512())
+        hash_state.serializeUpload(upload, hash_state.MultiHash())
         return upload
 
     def uploadChunk(self, upload, chunk):
@@ -160,13 +163,13 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, six.binary_type):
             chunk = BytesIO(chunk)
 
-        # Restore the internal state of the streaming SHA-512 checksum
-        checksum = hash_state.restoreHex(upload['sha512state'], 'sha512')
+        # Restore the internal state of the streaming checksums
+        checksum = hash_state.restoreUpload(upload)
 
         if self.requestOffset(upload) > upload['received']:
             # This probably means the server died midway through writing last
             # chunk to disk, and the database record was not updated. This
-            # means we need to update the sha512 state with the difference.
+            # means we need to update the checksum state with the difference.
             with open(upload['tempFile'], 'rb') as tempFile:
                 tempFile.seek(upload['received'])
                 while True:
@@ -193,8 +196,8 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 tempFile.truncate(upload['received'])
             raise
 
-        # Persist the internal state of the checksum
-        upload['sha512state'] = hash_state.serializeHex(checksum)
+        # Persist the internal state of the checksums
+        hash_state.serializeUpload(upload, checksum)
         upload['received'] += size
         return upload
 
@@ -209,8 +212,8 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         Moves the file into its permanent content-addressed location within the
         assetstore. Directory hierarchy yields 256^2 buckets.
         """
-        hash = hash_state.restoreHex(upload['sha512state'],
-                                     'sha512').hexdigest()
+        digests = hash_state.restoreUpload(upload).digests()
+        hash = digests['sha512']
         dir = os.path.join(hash[0:2], hash[2:4])
         absdir = os.path.join(self.assetstore['root'], dir)
 
@@ -243,7 +246,7 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 # some filesystems may not support POSIX permissions
                 pass
 
-        file['sha512'] = hash
+        file.update(digests)
         file['path'] = path
 
         return file
@@ -263,6 +266,15 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         """
         Returns a generator function that will be used to stream the file from
         disk to the response.
+
+        If the ``file_delivery`` option in the ``[server]`` section of the
+        configuration is ``x-sendfile`` or ``x-accel-redirect``, the contents
+        are instead left to a front-end web server: the response carries only
+        the headers that tell Apache (with mod_xsendfile) or nginx which file
+        to send, and that server also handles any Range header. This is only
+        done when the requested range is either the whole file or comes from a
+        Range header, since the front-end server does not know about the
+        offset and endByte parameters.
         """
         if endByte is None or endByte > file['size']:
             endByte = file['size']
@@ -276,6 +288,12 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 'file-does-not-exist')
 
         if headers:
+            delivery = config.getConfig()['server'].get('file_delivery', 'stream')
+            if delivery in ('x-sendfile', 'x-accel-redirect') and (
+                    'Range' in cherrypy.request.headers or
+                    (not offset and endByte == file['size'])):
+                return self._delegateDownload(file, path, delivery, contentDisposition)
+
             setResponseHeader('Accept-Ranges', 'bytes')
             self.setContentHeaders(file, offset, endByte, contentDisposition)
 
@@ -299,6 +317,51 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return stream
 
+    def readRange(self, file, offset, length):
+        """
+        Read a range of a file with ``os.pread`` where it is available.
+        """
+        length = min(length, file['size'] - offset)
+        if length <= 0:
+            return b''
+        with open(self.fullPath(file), 'rb') as f:
+            if not hasattr(os, 'pread'):
+                f.seek(offset)
+                return f.read(length)
+            data = []
+            while length > 0:
+                chunk = os.pread(f.fileno(), length, offset)
+                if not chunk:
+                    break
+                data.append(chunk)
+                offset += len(chunk)
+                length -= len(chunk)
+            return b''.join(data)
+
+    def _delegateDownload(self, file, path, delivery, contentDisposition):
+        """
+        Set the headers that hand the download of a file off to the front-end
+        web server, and return an empty response body.
+        """
+        setResponseHeader(
+            'Content-Type', file.get('mimeType') or 'application/octet-stream')
+        setContentDisposition(file['name'], contentDisposition or 'attachment')
+
+        # Both servers decode the path, so characters such as spaces, '%', and
+        # non-ASCII ones, which cannot be sent in a header, are percent-encoded.
+        path = urllib.parse.quote(os.path.abspath(path).encode('utf8'))
+        if delivery == 'x-accel-redirect':
+            prefix = config.getConfig()['server'].get(
+                'file_delivery_prefix', '/girder_files').rstrip('/')
+            setResponseHeader('X-Accel-Redirect', prefix + path)
+        else:
+            setResponseHeader('X-Sendfile', path)
+
+        def stream():
+            yield b''
+
+        return stream
+
     def deleteFile(self, file):
         """
         Deletes the file from disk if it is the only File in this assetstore
@@ -322,6 +385,41 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                     except Exception:
                         logger.exception('Failed to delete file %s' % path)
 
+    def deleteFiles(self, files):
+        """
+        Deletes the data of all of the given files from disk, except for data
+        that is shared with a file outside of this batch or with an upload.
+        Imported files are not actually deleted.
+        """
+        files = [file for file in files if not file.get('imported') and 'path' in file]
+        if not files:
+            return
+
+        ids = [file['_id'] for file in files]
+        paths = {(file.get('sha512'), file['path']) for file in files}
+
+        for hash, relpath in paths:
+            path = os.path.join(self.assetstore['root'], relpath)
+            if not os.path.isfile(path):
+                continue
+            # As in deleteFile, hold the lock while checking that no other
+            # file or upload refers to this data. Files without a hash, such
+            # as those created by older versions, are matched by their path.
+            query = {'assetstoreId': self.assetstore['_id']}
+            if hash:
+                query['sha512'] = hash
+            else:
+                query['path'] = relpath
+            with filelock.FileLock(path + '.deleteLock'):
+                if self.model('file').findOne(dict(query, _id={'$nin': ids}), fields=()):
+                    continue
+                if hash and self.model('upload').findOne(query, fields=()):
+                    continue
+                try:
+                    os.unlink(path)
+                except Exception:
+                    logger.exception('Failed to delete file %s' % path)
+
     def cancelUpload(self, upload):
         """
         Delete the temporary files associated with a given upload.
@@ -357,78 +455,28 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         file['imported'] = True
         return self.model('file').save(file)
 
-    def _importDataAsItem(self, name, user, folder, path, files, reuseExisting=True, params=None):
-        params = params or {}
-        item = self.model('item').createItem(
-            name=name, creator=user, folder=folder, reuseExisting=reuseExisting)
-        events.trigger('filesystem_assetstore_imported',
-                       {'id': item['_id'], 'type': 'item',
-                        'importPath': path})
-        for fname in files:
-            fpath = os.path.join(path, fname)
-            if self.shouldImportFile(fpath, params):
-                self.importFile(item, fpath, user, name=fname)
-
-    def _hasOnlyFiles(self, path, files):
-        return all(os.path.isfile(os.path.join(path, name)) for name in files)
-
-    def _importFileToFolder(self, name, user, parent, parentType, path):
-        if parentType != 'folder':
-            raise ValidationException(
-                'Files cannot be imported directly underneath a %s.' % parentType)
-
-        item = self.model('item').createItem(
-            name=name, creator=user, folder=parent, reuseExisting=True)
-        events.trigger('filesystem_assetstore_imported', {
-            'id': item['_id'],
-            'type': 'item',
-            'importPath': path
-        })
-        self.importFile(item, path, user, name=name)
-
-    def importData(self, parent, parentType, params, progress, user, leafFoldersAsItems):
+    def importData(self, parent, parentType, params, progress, user, leafFoldersAsItems=False):
+        """
+        Import a directory, or a single file, from the filesystem. Folders are
+        created for the directories under the import path, and an item with a
+        single file for each file, or a single item for each directory that
+        only contains files if ``leafFoldersAsItems`` is set.
+
+        Directories are listed with ``os.scandir`` by a pool of threads, and
+        the items and files of each directory are created with bulk writes
+        after a bulk lookup of the existing ones. If the ``incremental``
+        parameter is set, the files of directories whose contents have the same
+        modification times and sizes as when they were last imported are not
+        looked up again, and imported files that no longer exist are marked
+        with a ``tombstoned`` date.
+        """
         importPath = params['importPath']
 
         if not os.path.exists(importPath):
             raise ValidationException('Not found: %s.' % importPath)
-        if not os.path.isdir(importPath):
-            name = os.path.basename(importPath)
-            progress.update(message=name)
-            self._importFileToFolder(name, user, parent, parentType, importPath)
-            return
 
-        listDir = os.listdir(importPath)
-        if leafFoldersAsItems and self._hasOnlyFiles(importPath, listDir):
-            self._importDataAsItem(
-                os.path.basename(importPath.rstrip(os.sep)), user, parent, importPath,
-                listDir, params=params)
-            return
-
-        for name in listDir:
-            progress.update(message=name)
-            path = os.path.join(importPath, name)
-
-            if os.path.isdir(path):
-                localListDir = os.listdir(path)
-                if leafFoldersAsItems and self._hasOnlyFiles(path, localListDir):
-                    self._importDataAsItem(name, user, parent, path, localListDir, params=params)
-                else:
-                    folder = self.model('folder').createFolder(
-                        parent=parent, name=name, parentType=parentType,
-                        creator=user, reuseExisting=True)
-                    events.trigger(
-                        'filesystem_assetstore_imported', {
-                            'id': folder['_id'],
-                            'type': 'folder',
-                            'importPath': path
-                        })
-                    nextPath = os.path.join(importPath, name)
-                    self.importData(
-                        folder, 'folder', params=dict(params, importPath=nextPath),
-                        progress=progress, user=user, leafFoldersAsItems=leafFoldersAsItems)
-            else:
-                if self.shouldImportFile(path, params):
-                    self._importFileToFolder(name, user, parent, parentType, path)
+        _FilesystemImport(
+            self, parent, parentType, params, user, leafFoldersAsItems).run(importPath, progress)
 
     def findInvalidFiles(self, progress=progress.noProgress, filters=None,
                          checkSize=True, **kwargs):
@@ -473,3 +521,231 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                     'file': file,
                     'path': path
                 }
+
+
+def _scanDirectory(path):
+    """
+    List a directory, returning a dict of the stat results of its files by
+    name, the names of its subdirectories, and whether it only contains files.
+    """
+    files = {}
+    dirs = []
+    others = 0
+    if hasattr(os, 'scandir'):
+        entries = ((entry.name, entry) for entry in os.scandir(path))
+    else:  # pragma: no cover
+        entries = ((name, None) for name in os.listdir(path))
+
+    for name, entry in entries:
+        try:
+            info = entry.stat() if entry is not None else os.stat(os.path.join(path, name))
+        except OSError:
+            # Broken links and entries removed since the listing are skipped
+            others += 1
+            continue
+        if stat.S_ISDIR(info.st_mode):
+            dirs.append(name)
+        elif stat.S_ISREG(info.st_mode):
+            files[name] = info
+        else:
+            others += 1
+    return files, sorted(dirs), not dirs and not others
+
+
+class _FilesystemImport(ModelImporter):
+    """
+    The state of an import from the filesystem. Each directory is a task of a
+    :py:func:`girder.utility.bulk_import.walkParallel` walk, which creates the
+    folder or item for the directory underneath its parent and imports its
+    files in bulk.
+    """
+    def __init__(self, adapter, parent, parentType, params, user, leafFoldersAsItems):
+        self.adapter = adapter
+        self.parent = parent
+        self.parentType = parentType
+        self.params = params
+        self.user = user
+        self.leafFoldersAsItems = leafFoldersAsItems
+        self.incremental = params.get('incremental', False)
+        self.importer = bulk_import.BulkImporter(adapter.assetstore, user)
+
+    def run(self, importPath, progress):
+        try:
+            if os.path.isdir(importPath):
+                bulk_import.walkParallel([(importPath, self.parent, self.parentType, True)],
+                                         self._walk, progress)
+            else:
+                progress.update(message=os.path.basename(importPath))
+                self._importFile(importPath)
+        finally:
+            self.importer.commitSizes()
+
+    def _importFile(self, path):
+        if self.parentType != 'folder':
+            raise ValidationException(
+                'Files cannot be imported directly underneath a %s.' % self.parentType)
+        self._importFiles(os.path.dirname(path), self.parent, {
+            os.path.basename(path): os.stat(path)
+        })
+
+    def _walk(self, task, add, report):
+        path, parent, parentType, root = task
+        files, dirs, onlyFiles = _scanDirectory(path)
+        files = {fileName: info for fileName, info in six.viewitems(files)
+                 if self.adapter.shouldImportFile(os.path.join(path, fileName), self.params)}
+        name = os.path.basename(path.rstrip(os.sep))
+
+        if self.leafFoldersAsItems and onlyFiles:
+            if parentType != 'folder':
+                raise ValidationException(
+                    'Files cannot be imported directly underneath a %s.' % parentType)
+            item = self.model('item').createItem(
+                name=name, creator=self.user, folder=parent, reuseExisting=True)
+            self._imported(item, 'item', path)
+            count = self._importDirectory(path, item, 'item', files, folder=parent)
+            report(count, name)
+            return
+
+        if root:
+            container, containerType = parent, parentType
+        else:
+            container = self.model('folder').createFolder(
+                parent=parent, name=name, parentType=parentType, creator=self.user,
+                reuseExisting=True)
+            containerType = 'folder'
+            self._imported(container, 'folder', path)
+
+        if files and containerType != 'folder':
+            raise ValidationException(
+                'Files cannot be imported directly underneath a %s.' % containerType)
+
+        count = self._importDirectory(path, container, containerType, files, dirs=dirs)
+        for dirName in dirs:
+            add((os.path.join(path, dirName), container, containerType, False))
+        report(count, name)
+
+    def _importDirectory(self, path, container, containerType, files, dirs=(), folder=None):
+        """
+        Import the files of a directory into a folder, or into a leaf item in
+        ``folder``, unless an incremental import finds that they have not
+        changed. Returns the number of imported files.
+        """
+        itemName = container['name'] if containerType == 'item' else None
+        folder = folder or container
+        if not self.incremental or containerType not in ('folder', 'item'):
+            return len(self._importFiles(path, folder, files, itemName))
+
+        signature = self._signature(path, files)
+        if container.get('importSignature') == signature:
+            return 0
+        imported = self._importFiles(path, folder, files, itemName)
+        self._tombstone(path, container, containerType, files, dirs)
+        self.model(containerType).update(
+            {'_id': container['_id']}, {'$set': {'importSignature': signature}})
+        return len(imported)
+
+    def _importFiles(self, path, folder, files, itemName=None):
+        """
+        Create or reuse the files of a directory in a folder, either in an item
+        for each file, or in a single item named ``itemName``.
+        """
+        entries = []
+        for name, info in sorted(six.viewitems(files)):
+            entry = {
+                'folder': folder,
+                'name': name,
+                'size': info.st_size,
+                'fields': {
+                    'path': os.path.abspath(os.path.expanduser(os.path.join(path, name))),
+                    'mtime': info.st_mtime,
+                    'imported': True
+                }
+            }
+            if itemName is not None:
+                entry['itemName'] = itemName
+            entries.append(entry)
+
+        imported = self.importer.importFiles(entries)
+
+        revived = [file['_id'] for file in imported if file.pop('tombstoned', None)]
+        if revived:
+            self.model('file').update(
+                {'_id': {'$in': revived}}, {'$unset': {'tombstoned': True}})
+        if itemName is None:
+            for file in imported:
+                self._imported({'_id': file['itemId']}, 'item', file['path'])
+        return imported
+
+    def _signature(self, path, files):
+        """
+        Describe the contents of a directory, so that an incremental import
+        can tell whether any of its files have changed since the last import.
+        """
+        return {
+            'path': os.path.abspath(path),
+            'count': len(files),
+            'size': sum(info.st_size for info in six.viewvalues(files)),
+            'mtime': max([info.st_mtime for info in six.viewvalues(files)] +
+                         [os.stat(path).st_mtime]),
+            'fileIncludeRegex': self.params.get('fileIncludeRegex'),
+            'fileExcludeRegex': self.params.get('fileExcludeRegex')
+        }
+
+    def _tombstone(self, path, container, containerType, files, dirs):
+        """
+        Mark the imported files of a directory that no longer exist, including
+        those under subdirectories that were removed.
+        """
+        now = datetime.datetime.utcnow()
+        if containerType == 'item':
+            itemIds = [container['_id']]
+        else:
+            itemIds = [item['_id'] for item in self.model('item').find(
+                {'folderId': container['_id']}, fields=['_id'])]
+        query = {
+            'assetstoreId': self.adapter.assetstore['_id'],
+            'imported': True,
+            'tombstoned': {'$exists': False}
+        }
+        paths = {os.path.abspath(os.path.join(path, name)) for name in files}
+        missing = [file['_id'] for file in self.model('file').find(
+            dict(query, itemId={'$in': itemIds}), fields=['path'])
+            if os.path.dirname(file['path']) == os.path.abspath(path) and
+            file['path'] not in paths and not os.path.exists(file['path'])]
+        if missing:
+            self.model('file').update({'_id': {'$in': missing}}, {'$set': {'tombstoned': now}})
+
+        if containerType != 'folder':
+            return
+        for folder in self.model('folder').find({
+            'parentId': container['_id'],
+            'parentCollection': 'folder',
+            'importSignature.path': {'$exists': True}
+        }, fields=['importSignature']):
+            removed = folder['importSignature']['path']
+            if os.path.basename(removed) not in dirs and not os.path.exists(removed):
+                itemIds = [item['_id'] for item in self.model('item').find(
+                    {'ancestors': folder['_id']}, fields=['_id'])]
+                self._tombstoneItems(query, itemIds, removed, now)
+
+    def _tombstoneItems(self, query, itemIds, removed, now):
+        """
+        Mark the imported files of the items that were imported from a removed
+        directory, in batches of items.
+        """
+        prefix = os.path.join(removed, '')
+        batchSize = self.importer.batchSize
+        for start in range(0, len(itemIds), batchSize):
+            missing = [file['_id'] for file in self.model('file').find(dict(
+                query, itemId={'$in': itemIds[start:start + batchSize]}), fields=['path'])
+                if file['path'].startswith(prefix)]
+            if missing:
+                self.model('file').update(
+                    {'_id': {'$in': missing}}, {'$set': {'tombstoned': now}})
+
+    def _imported(self, doc, type, path):
+        events.trigger('filesystem_assetstore_imported', {
+            'id': doc['_id'],
+            'type': type,
+            'importPath': path
+        })
@@ -18,7 +18,6 @@
 ###############################################################################
 
 import bson
-from hashlib import sha512
 import pymongo
 import six
 from six import BytesIO
@@ -30,7 +29,7 @@ from girder.api.rest import setResponseHeader
 from girder.external.mongodb_proxy import MongoProxy
 from girder.models import getDbConnection
 from girder.models.model_base import ValidationException
-from . import hash_state
+from . import config, hash_state, prefetch
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 
 
@@ -38,6 +37,9 @@ from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 # unless they are sending the final chunk.
 CHUNK_SIZE = 2097152
 
+# The number of chunks written with each insert_many if not configured
+DEFAULT_INSERT_BATCH_SIZE = 8
+
 # Cache recent connections so we can skip some start up actions
 RECENT_CONNECTION_CACHE_TIME = 600  # seconds
 RECENT_CONNECTION_CACHE_MAX_SIZE = 100
@@ -173,9 +175,40 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         Creates a UUID that will be used to uniquely link each chunk to
         """
         upload['chunkUuid'] = uuid.uuid4().hex
-        upload['sha512state'] = hash_state.serializeHex(sha512())
+        hash_state.serializeUpload(upload, hash_state.MultiHash())
+        # The number of chunks stored so far, which is the n of the next chunk
+        upload['chunkCount'] = 0
         return upload
 
+    def _insertBatchSize(self):
+        size = config.getConfig()['database'].get(
+            'gridfs_insert_batch_size', DEFAULT_INSERT_BATCH_SIZE)
+        return max(int(size), 1)
+
+    def _insertChunks(self, chunks):
+        """
+        Insert a batch of chunk documents with a single unordered write. If an
+        earlier attempt to write the same chunks succeeded, for instance when a
+        request is retried or the write is retried after reconnecting to the
+        database, the existing chunks are replaced.
+
+        :param chunks: The chunk documents to insert.
+        :type chunks: list
+        """
+        try:
+            self.chunkColl.insert_many(chunks, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in errors):
+                raise
+            logger.info('Received %d DuplicateKeyErrors while uploading, probably '
+                        'because the chunks were sent before (chunk uuid %s)',
+                        len(errors), chunks[0]['uuid'])
+            for error in errors:
+                chunk = {k: v for k, v in six.viewitems(chunks[error['index']])
+                         if k != '_id'}
+                self.chunkColl.replace_one({'uuid': chunk['uuid'], 'n': chunk['n']}, chunk)
+
     def uploadChunk(self, upload, chunk):
         """
         Stores the uploaded chunk in fixed-sized pieces in the chunks
@@ -190,57 +223,55 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, six.binary_type):
             chunk = BytesIO(chunk)
 
-        # Restore the internal state of the streaming SHA-512 checksum
-        checksum = hash_state.restoreHex(upload['sha512state'], 'sha512')
+        # Restore the internal state of the streaming checksums
+        checksum = hash_state.restoreUpload(upload)
 
-        # TODO: when saving uploads is optional, we can conditionally try to
-        # fetch the last chunk.  Add these line before `lastChunk = ...`:
-        #   lastChunk = None
-        #   if '_id' in upload or upload['received'] != 0:
-        lastChunk = self.chunkColl.find_one({
-            'uuid': upload['chunkUuid']
-        }, projection=['n'], sort=[('n', pymongo.DESCENDING)])
-        if lastChunk:
-            # This bit of code will only do anything if there is a discrepancy
-            # between the received count of the upload record and the length of
-            # the file stored as chunks in the database. This code updates the
-            # sha512 state with the difference before reading the bytes sent
-            # from the user.
-            if self.requestOffset(upload) > upload['received']:
-                # This isn't right -- the last received amount may not be a
-                # complete chunk.
-                cursor = self.chunkColl.find({
-                    'uuid': upload['chunkUuid'],
-                    'n': {'$gte': upload['received'] // CHUNK_SIZE}
-                }, projection=['data']).sort('n', pymongo.ASCENDING)
-                for result in cursor:
-                    checksum.update(result['data'])
-        n = lastChunk['n'] + 1 if lastChunk else 0
+        if 'chunkCount' in upload:
+            n = upload['chunkCount']
+        else:
+            # Uploads started before the chunk count was recorded
+            lastChunk = self.chunkColl.find_one({
+                'uuid': upload['chunkUuid']
+            }, projection=['n'], sort=[('n', pymongo.DESCENDING)])
+            if lastChunk:
+                # This bit of code will only do anything if there is a
+                # discrepancy between the received count of the upload record
+                # and the length of the file stored as chunks in the database.
+                # This code updates the checksum state with the difference before
+                # reading the bytes sent from the user.
+                if self.requestOffset(upload) > upload['received']:
+                    # This isn't right -- the last received amount may not be
+                    # a complete chunk.
+                    cursor = self.chunkColl.find({
+                        'uuid': upload['chunkUuid'],
+                        'n': {'$gte': upload['received'] // CHUNK_SIZE}
+                    }, projection=['data']).sort('n', pymongo.ASCENDING)
+                    for result in cursor:
+                        checksum.update(result['data'])
+            n = lastChunk['n'] + 1 if lastChunk else 0
 
         size = 0
         startingN = n
+        batchSize = self._insertBatchSize()
+        batch = []
 
         while upload['received']+size < upload['size']:
             data = chunk.read(CHUNK_SIZE)
             if not data:
                 break
-            # If a timeout occurs while we are trying to load data, we might
-            # have succeeded, in which case we will get a DuplicateKeyError
-            # when it automatically retries.  Therefore, log this error but
-            # don't stop.
-            try:
-                self.chunkColl.insert_one({
-                    'n': n,
-                    'uuid': upload['chunkUuid'],
-                    'data': bson.binary.Binary(data)
-                })
-            except pymongo.errors.DuplicateKeyError:
-                logger.info('Received a DuplicateKeyError while uploading, '
-                            'probably because we reconnected to the database '
-                            '(chunk uuid %s part %d)', upload['chunkUuid'], n)
+            batch.append({
+                'n': n,
+                'uuid': upload['chunkUuid'],
+                'data': bson.binary.Binary(data)
+            })
+            if len(batch) >= batchSize:
+                self._insertChunks(batch)
+                batch = []
             n += 1
             size += len(data)
             checksum.update(data)
+        if batch:
+            self._insertChunks(batch)
         chunk.close()
 
         try:
@@ -254,9 +285,10 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
             })
             raise
 
-        # Persist the internal state of the checksum
-        upload['sha512state'] = hash_state.serializeHex(checksum)
+        # Persist the internal state of the checksums
+        hash_state.serializeUpload(upload, checksum)
         upload['received'] += size
+        upload['chunkCount'] = n
         return upload
 
     def requestOffset(self, upload):
@@ -265,7 +297,14 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         database for this file. We return the max of that and the received
         count because in testing mode we are uploading chunks that are smaller
         than the CHUNK_SIZE, which in practice will not work.
+
+        When the upload records how many chunks are stored, the received count
+        is used instead, since chunks written by a request that failed before
+        the upload was saved are overwritten when they are sent again.
         """
+        if 'chunkCount' in upload:
+            return upload['received']
+
         lastChunk = self.chunkColl.find_one({
             'uuid': upload['chunkUuid']
         }, projection=['n'], sort=[('n', pymongo.DESCENDING)])
@@ -281,10 +320,7 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         Grab the final state of the checksum and set it on the file object,
         and write the generated UUID into the file itself.
         """
-        hash = hash_state.restoreHex(upload['sha512state'],
-                                     'sha512').hexdigest()
-
-        file['sha512'] = hash
+        file.update(hash_state.restoreUpload(upload).digests())
         file['chunkUuid'] = upload['chunkUuid']
         file['chunkSize'] = CHUNK_SIZE
 
@@ -325,7 +361,8 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
             position = offset
             shouldBreak = False
 
-            for chunk in cursor:
+            # Fetch the following chunks while this one is sent
+            for chunk in prefetch.prefetch(cursor):
                 chunkLen = len(chunk['data'])
 
                 if position + chunkLen - co > endByte:
@@ -344,6 +381,23 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return stream
 
+    def readRange(self, file, offset, length):
+        """
+        Read a range of a file by fetching only the chunks that contain it.
+        """
+        endByte = min(offset + length, file['size'])
+        if endByte <= offset:
+            return b''
+        chunkSize = file['chunkSize']
+        first = offset // chunkSize
+        cursor = self.chunkColl.find({
+            'uuid': file['chunkUuid'],
+            'n': {'$gte': first, '$lte': (endByte - 1) // chunkSize}
+        }, projection=['data']).sort('n', pymongo.ASCENDING)
+        data = b''.join(chunk['data'] for chunk in cursor)
+        start = offset - first * chunkSize
+        return data[start:start + endByte - offset]
+
     def deleteFile(self, file):
         """
         Delete all of the chunks in the collection that correspond to the
@@ -367,6 +421,29 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
             except pymongo.errors.AutoReconnect:
                 pass
 
+    def deleteFiles(self, files):
+        """
+        Delete the chunks of all of the given files that are not shared with
+        any other file, with a single query.
+        """
+        uuids = {file['chunkUuid'] for file in files if file.get('chunkUuid')}
+        if not uuids:
+            return
+        shared = self.model('file').collection.distinct('chunkUuid', {
+            'chunkUuid': {'$in': list(uuids)},
+            'assetstoreId': self.assetstore['_id'],
+            '_id': {'$nin': [file['_id'] for file in files]}
+        })
+        uuids.difference_update(shared)
+        if uuids:
+            # As in deleteFile, abandoned chunks can be found by a system check
+            try:
+                self.chunkColl.with_options(
+                    write_concern=pymongo.WriteConcern(w=0)).delete_many(
+                        {'uuid': {'$in': list(uuids)}})
+            except pymongo.errors.AutoReconnect:
+                pass
+
     def cancelUpload(self, upload):
         """
         Delete all of the chunks associated with a given upload.
@@ -190,3 +190,135 @@ def serializeHex(hashObject):
 
 def restoreHex(oldHexStateData, hashName):
     return restore(binascii.a2b_hex(oldHexStateData), hashName)
+
+
+class _Crc32(object):
+    """
+    A CRC-32 with the interface of a hashlib hash object.
+    """
+    name = 'crc32'
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def update(self, data):
+        self.value = binascii.crc32(data, self.value) & 0xFFFFFFFF
+
+
+class _Algorithm(object):
+    def __init__(self, create, serialize, restore, result):
+        self.create = create
+        self.serialize = serialize
+        self.restore = restore
+        self.result = result
+
+
+_ALGORITHMS = {
+    name: _Algorithm(
+        create=hashInfo.type,
+        serialize=serializeHex,
+        restore=lambda state, name=name: restoreHex(state, name),
+        result=lambda hashObject: hashObject.hexdigest())
+    for name, hashInfo in _HASH_INFOS.items()
+}
+_ALGORITHMS['crc32'] = _Algorithm(
+    create=_Crc32,
+    serialize=lambda crc: crc.value,
+    restore=_Crc32,
+    result=lambda crc: crc.value)
+
+# The digests computed while data is uploaded, which are saved in the fields of
+# the same names in the file document. The CRC-32 is an integer, the others are
+# hex strings.
+UPLOAD_ALGORITHMS = ['crc32', 'md5', 'sha256', 'sha512']
+
+
+def registerAlgorithm(name, create, serialize, restore, result):
+    """
+    Make a digest algorithm available to :py:class:`MultiHash`. To compute it
+    during uploads, also append its name to ``UPLOAD_ALGORITHMS``.
+
+    :param name: The name of the algorithm.
+    :type name: str
+    :param create: A function of no arguments returning a new object with an
+        ``update`` method that adds data to the digest.
+    :param serialize: A function returning the state of such an object as a
+        value that can be stored in MongoDB.
+    :param restore: A function returning an object from a serialized state.
+    :param result: A function returning the digest of such an object.
+    """
+    _ALGORITHMS[name] = _Algorithm(create, serialize, restore, result)
+
+
+class MultiHash(object):
+    """
+    Computes several digests of a stream in a single pass over its data. Its
+    state can be serialized between chunks, like that of a single hash object
+    with :py:func:`serializeHex` and :py:func:`restoreHex`.
+
+    :param algorithms: The names of the algorithms to compute, which default to
+        ``UPLOAD_ALGORITHMS``.
+    :type algorithms: list or None
+    """
+    def __init__(self, algorithms=None):
+        if algorithms is None:
+            algorithms = UPLOAD_ALGORITHMS
+        self.hashes = {name: _ALGORITHMS[name].create() for name in algorithms}
+
+    def update(self, data):
+        for hashObject in self.hashes.values():
+            hashObject.update(data)
+
+    def serialize(self):
+        """
+        Return the state of every digest, keyed by algorithm name.
+        """
+        return {name: _ALGORITHMS[name].serialize(hashObject)
+                for name, hashObject in self.hashes.items()}
+
+    @classmethod
+    def restore(cls, state):
+        """
+        Create a MultiHash in the state returned by :py:meth:`serialize`.
+
+        :param state: The serialized state.
+        :type state: dict
+        """
+        multiHash = cls(algorithms=())
+        multiHash.hashes = {name: _ALGORITHMS[name].restore(value)
+                            for name, value in state.items()}
+        return multiHash
+
+    def digests(self):
+        """
+        Return the value of every digest, keyed by algorithm name.
+        """
+        return {name: _ALGORITHMS[name].result(hashObject)
+                for name, hashObject in self.hashes.items()}
+
+
+def restoreUpload(upload):
+    """
+    Restore the digests of the data received by an upload so far.
+
+    :param upload: The upload document.
+    :type upload: dict
+    :rtype: MultiHash
+    """
+    if 'hashState' in upload:
+        return MultiHash.restore(upload['hashState'])
+    # Uploads started before several digests were computed only have a SHA-512
+    return MultiHash.restore({'sha512': upload['sha512state']})
+
+
+def serializeUpload(upload, multiHash):
+    """
+    Save the state of the digests of an upload in the upload document.
+
+    :param upload: The upload document.
+    :type upload: dict
+    :param multiHash: The digests of the data received so far.
+    :type multiHash: MultiHash
+    """
+    upload.pop('sha512state', None)
+    upload['hashState'] = multiHash.serialize()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module delivers notifications to the streams that are waiting for them.
+Every time a notification is saved, a copy of it is appended to a capped
+collection. Each Girder process follows that collection with a single tailable
+cursor and hands each notification to the subscriptions of its user or token,
+so that open streams wait on a queue rather than each polling the database.
+"""
+
+import os
+import pymongo
+import threading
+import time
+
+from bson.objectid import ObjectId
+from six.moves import queue
+
+from girder import logger
+
+# Name of the capped collection used to broadcast notifications
+BROADCAST_COLLECTION = 'notification_broadcast'
+
+# Put on a subscription's queue when notifications may have been missed, so
+# that the subscriber reads them from the notification collection instead.
+RESYNC = object()
+
+_subscriptions = {}
+_subscriptionsLock = threading.Lock()
+_tailerLock = threading.Lock()
+_tailerPid = None
+
+
+class Subscription(object):
+    """
+    The queue of notifications for one open stream.
+
+    :param key: The user or token that the notifications are sent to.
+    :type key: tuple
+    """
+    def __init__(self, key):
+        self.key = key
+        self._queue = queue.Queue()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def get(self, timeout):
+        """
+        Wait for the next notification.
+
+        :param timeout: The maximum number of seconds to wait.
+        :type timeout: float
+        :returns: A notification document, :py:data:`RESYNC` if notifications
+            may have been missed, or None if none arrived in time.
+        """
+        try:
+            return self._queue.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            return None
+
+
+def _key(userId=None, tokenId=None):
+    if userId is not None:
+        return ('user', str(userId))
+    return ('token', str(tokenId))
+
+
+def subscribe(user, token=None):
+    """
+    Start receiving the notifications of a user, or of a token if user is None.
+    Call :py:func:`unsubscribe` when done with the returned subscription.
+
+    :param user: The user whose notifications are wanted.
+    :type user: dict or None
+    :param token: The token whose notifications are wanted if user is None.
+    :type token: dict
+    :rtype: Subscription
+    """
+    _ensureTailer()
+    if user:
+        subscription = Subscription(_key(userId=user['_id']))
+    else:
+        subscription = Subscription(_key(tokenId=token['_id']))
+    with _subscriptionsLock:
+        _subscriptions.setdefault(subscription.key, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    """
+    Stop delivering notifications to a subscription.
+
+    :param subscription: The subscription returned by :py:func:`subscribe`.
+    :type subscription: Subscription
+    """
+    with _subscriptionsLock:
+        subscriptions = _subscriptions.get(subscription.key)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del _subscriptions[subscription.key]
+
+
+def publish(database, notification):
+    """
+    Send a notification that has been saved to the streams of every process.
+
+    :param database: The database holding the broadcast collection.
+    :param notification: The notification document.
+    :type notification: dict
+    """
+    try:
+        database[BROADCAST_COLLECTION].insert_one({'notification': notification})
+    except pymongo.errors.PyMongoError:
+        # Subscribers will still see it the next time they resynchronize
+        logger.exception('Failed to broadcast notification.')
+
+
+def _dispatch(notification):
+    key = _key(notification.get('userId'), notification.get('tokenId'))
+    with _subscriptionsLock:
+        subscriptions = list(_subscriptions.get(key, ()))
+    for subscription in subscriptions:
+        # Each stream annotates the documents it sends, so give it its own
+        subscription.put(dict(notification))
+
+
+def _resyncAll():
+    with _subscriptionsLock:
+        subscriptions = [s for group in _subscriptions.values() for s in group]
+    for subscription in subscriptions:
+        subscription.put(RESYNC)
+
+
+def _database():
+    from girder.models import getDbConnection
+
+    return getDbConnection().get_default_database()
+
+
+def ensureBroadcastCollection(database):
+    """
+    Make sure the capped collection used to broadcast notifications exists. If
+    it was implicitly created as a regular collection by an insert, convert it
+    so that it can be tailed.
+    """
+    try:
+        database.create_collection(
+            BROADCAST_COLLECTION, capped=True, size=4 * 1024 * 1024)
+        # Tailable cursors die immediately on an empty collection, so make
+        # sure there is always something in it.
+        database[BROADCAST_COLLECTION].insert_one({'notification': None})
+    except pymongo.errors.CollectionInvalid:
+        # The collection already exists
+        collection = database[BROADCAST_COLLECTION]
+        if not collection.options().get('capped'):
+            database.command(
+                'convertToCapped', BROADCAST_COLLECTION, size=4 * 1024 * 1024)
+        if collection.find_one() is None:
+            collection.insert_one({'notification': None})
+
+
+def _ensureTailer():
+    """
+    Start the thread that follows the broadcast collection, if it isn't running
+    in this process already.
+    """
+    global _tailerPid
+
+    pid = os.getpid()
+    if _tailerPid == pid:
+        return
+    with _tailerLock:
+        if _tailerPid == pid:
+            return
+        _tailerPid = pid
+        thread = threading.Thread(target=_tailNotifications)
+        thread.daemon = True
+        thread.start()
+
+
+def _newestBroadcast(collection):
+    return next(collection.find(sort=[('$natural', -1)], limit=1), None)
+
+
+def _tailNotifications():
+    """
+    Follow the broadcast collection with a tailable cursor, handing each new
+    notification to its subscribers. Since notifications may have been missed
+    while the cursor was closed, every subscriber is told to resynchronize from
+    the notification collection whenever it is opened.
+
+    The cursor starts from the second in which the newest broadcast was made,
+    skipping the broadcasts from that second that were already there. It does
+    not wait to see the newest broadcast itself, which may be overwritten in
+    the capped collection before the cursor reaches it, and it doesn't rely on
+    the ids from other processes within the same second being in order.
+    """
+    while True:
+        try:
+            database = _database()
+            ensureBroadcastCollection(database)
+
+            collection = database[BROADCAST_COLLECTION]
+            newest = _newestBroadcast(collection)
+            query = {}
+            seen = set()
+            if newest is not None:
+                query['_id'] = {'$gte': ObjectId.from_datetime(newest['_id'].generation_time)}
+                seen = {doc['_id'] for doc in collection.find(query, projection=['_id'])}
+            cursor = collection.find(query, cursor_type=pymongo.CursorType.TAILABLE_AWAIT)
+            _resyncAll()
+
+            while cursor.alive:
+                for doc in cursor:
+                    if doc['_id'] in seen:
+                        seen.discard(doc['_id'])
+                    elif doc.get('notification') is not None:
+                        _dispatch(doc['notification'])
+        except Exception:
+            logger.exception('Error while following notifications.')
+        time.sleep(1)
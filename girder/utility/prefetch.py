@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module reads the chunks of a download ahead of the client. While one
+chunk is being sent, a background thread fetches the next few from the
+assetstore into a bounded buffer, so that the latency of the backend and of the
+client overlap instead of adding up.
+"""
+
+import six
+import sys
+import threading
+
+from six.moves import queue
+
+from girder.utility import config
+
+# Marks the end of the items, or an exception raised while reading them
+_END = object()
+
+
+def getWindow():
+    """
+    Return the configured number of chunks that downloads read ahead.
+    """
+    return int(config.getConfig()['server'].get('download_prefetch_window', 4))
+
+
+def prefetch(iterable, window=None):
+    """
+    Iterate over an iterable, such as the chunks of a file being downloaded,
+    while a background thread reads up to ``window`` items ahead. This overlaps
+    fetching data from the backend with sending it to the client. Exceptions
+    raised while reading are raised when the item that failed is reached.
+    Closing the returned generator stops the background thread.
+
+    :param iterable: The items to read ahead. The iterable is only used by the
+        background thread, and is closed by it if it has a close method.
+    :param window: The maximum number of items read ahead, or None to use the
+        ``download_prefetch_window`` option of the ``[server]`` configuration.
+        If this is 0, no thread is used.
+    :type window: int or None
+    """
+    if window is None:
+        window = getWindow()
+    if window <= 0:
+        for item in iterable:
+            yield item
+        return
+
+    buffer = queue.Queue(maxsize=window)
+    stopped = threading.Event()
+    thread = threading.Thread(target=_produce, args=(iterable, buffer, stopped))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, excInfo = buffer.get()
+            if item is _END:
+                if excInfo is not None:
+                    six.reraise(*excInfo)
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+def _put(buffer, stopped, value):
+    # Wait for room in the buffer, giving up if the consumer stops
+    while not stopped.is_set():
+        try:
+            buffer.put(value, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(iterable, buffer, stopped):
+    try:
+        for item in iterable:
+            if not _put(buffer, stopped, (item, None)):
+                return
+        _put(buffer, stopped, (_END, None))
+    except Exception:
+        _put(buffer, stopped, (_END, sys.exc_info()))
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
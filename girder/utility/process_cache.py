@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module provides in-memory caches that live as long as the process, for
+documents that are read far more often than they are written. Each cache is an
+LRU whose entries also expire after a configurable time. Invalidating a key
+evicts it locally and appends it to a capped collection that every Girder
+process tails in order to evict the key from its own cache, so that changes
+are seen by all processes within about a second. If that notification is
+missed, the expiration time bounds how long a stale value is used.
+"""
+
+from collections import OrderedDict
+import copy
+import datetime
+import os
+import pymongo
+import threading
+import time
+
+from girder import logger
+from girder.utility import config
+
+# Name of the capped collection used to broadcast invalidations
+INVALIDATION_COLLECTION = 'cache_invalidation'
+
+_caches = {}
+_tailerLock = threading.Lock()
+_tailerPid = None
+
+
+class ProcessCache(object):
+    """
+    A thread-safe, process-wide LRU cache whose entries expire. Its size and
+    lifetime are read from the ``[cache]`` section of the configuration on each
+    access, so they can be changed at runtime; a time or size of 0 disables
+    the cache.
+
+    :param name: The unique name of this cache, which routes invalidations
+        from other processes and labels its statistics.
+    :type name: str
+    :param ttlOption: The configuration option holding the number of seconds
+        an entry may be used.
+    :type ttlOption: str
+    :param maxEntriesOption: The configuration option holding the maximum
+        number of entries.
+    :type maxEntriesOption: str
+    :param ttl: The entry lifetime if the option is not configured.
+    :type ttl: float
+    :param maxEntries: The maximum size if the option is not configured.
+    :type maxEntries: int
+    :param cacheNone: Whether a load that returns None should be cached.
+    :type cacheNone: bool
+    """
+    def __init__(self, name, ttlOption, maxEntriesOption, ttl=60, maxEntries=1000,
+                 cacheNone=True):
+        self.name = name
+        self.ttlOption = ttlOption
+        self.maxEntriesOption = maxEntriesOption
+        self.defaultTtl = ttl
+        self.defaultMaxEntries = maxEntries
+        self.cacheNone = cacheNone
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        _caches[name] = self
+
+    def limits(self):
+        """
+        Return the configured entry lifetime and maximum number of entries.
+        """
+        cacheConfig = config.getConfig().get('cache', {})
+        return (float(cacheConfig.get(self.ttlOption, self.defaultTtl)),
+                int(cacheConfig.get(self.maxEntriesOption, self.defaultMaxEntries)))
+
+    def get(self, key, load):
+        """
+        Return a deep copy of the value cached for a key, calling ``load`` to
+        read it if it isn't cached or has expired.
+
+        :param key: The key to look up.
+        :type key: str
+        :param load: A function of no arguments that reads the current value.
+        :type load: callable
+        """
+        ttl, maxEntries = self.limits()
+        if ttl <= 0 or maxEntries <= 0:
+            return load()
+
+        _ensureTailer()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[1] > now:
+                # Reinsert to mark this entry as the most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                return copy.deepcopy(entry[0])
+            self.misses += 1
+            generation = self._generation
+
+        value = load()
+
+        with self._lock:
+            # Don't cache the value if it may have changed while it was read
+            if generation == self._generation and (value is not None or self.cacheNone):
+                self._entries[key] = (value, now + ttl)
+                while len(self._entries) > maxEntries:
+                    self._entries.popitem(last=False)
+        return copy.deepcopy(value)
+
+    def clear(self, key=None):
+        """
+        Evict a key, or all keys, from this process's copy of the cache. Use
+        :py:meth:`invalidate` to evict it from all processes.
+
+        :param key: The key to evict, or None to clear the entire cache.
+        :type key: str or None
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def invalidate(self, key=None):
+        """
+        Evict a key, or all keys, from this cache in every process.
+
+        :param key: The key to evict, or None to clear the entire cache.
+        :type key: str or None
+        """
+        self.clear(key)
+        self.invalidations += 1
+        try:
+            _database()[INVALIDATION_COLLECTION].insert_one({
+                'cache': self.name,
+                'key': key,
+                'pid': os.getpid(),
+                'time': datetime.datetime.utcnow()
+            })
+        except pymongo.errors.PyMongoError:
+            logger.exception('Failed to broadcast invalidation of %s cache.' % self.name)
+
+    def stats(self):
+        """
+        Return statistics about the use of this cache in this process.
+        """
+        ttl, maxEntries = self.limits()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'maxEntries': maxEntries,
+                'ttl': ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': float(self.hits) / lookups if lookups else None,
+                'invalidations': self.invalidations
+            }
+
+
+def getStats():
+    """
+    Return the statistics of every process cache, keyed by cache name.
+    """
+    return {name: cache.stats() for name, cache in list(_caches.items())}
+
+
+def clearAll():
+    """
+    Clear every process cache in this process only. This is useful when the
+    database has been replaced, for instance between tests.
+    """
+    for cache in list(_caches.values()):
+        cache.clear()
+
+
+def _database():
+    from girder.models import getDbConnection
+
+    return getDbConnection().get_default_database()
+
+
+def ensureInvalidationCollection(database):
+    """
+    Make sure the capped collection used to broadcast invalidations exists. If
+    it was implicitly created as a regular collection by an insert, convert it
+    so that it can be tailed.
+    """
+    try:
+        database.create_collection(
+            INVALIDATION_COLLECTION, capped=True, size=1024 * 1024, max=1000)
+        # Tailable cursors die immediately on an empty collection, so make
+        # sure there is always something in it.
+        database[INVALIDATION_COLLECTION].insert_one({'cache': None})
+    except pymongo.errors.CollectionInvalid:
+        # The collection already exists
+        collection = database[INVALIDATION_COLLECTION]
+        if not collection.options().get('capped'):
+            database.command('convertToCapped', INVALIDATION_COLLECTION, size=1024 * 1024)
+        if collection.find_one() is None:
+            collection.insert_one({'cache': None})
+
+
+def _ensureTailer():
+    """
+    Start the thread that listens for invalidations from other processes, if
+    it isn't running in this process already.
+    """
+    global _tailerPid
+
+    pid = os.getpid()
+    if _tailerPid == pid:
+        return
+    with _tailerLock:
+        if _tailerPid == pid:
+            return
+        _tailerPid = pid
+        thread = threading.Thread(target=_tailInvalidations)
+        thread.daemon = True
+        thread.start()
+
+
+def _tailInvalidations():
+    """
+    Follow the invalidation collection with a tailable cursor, evicting each
+    key that is invalidated. Whenever the cursor has to be reopened, changes may
+    have been missed, so all caches are cleared. Evicting keys that are not
+    cached is harmless, so the reopened cursor simply starts from the beginning
+    of the collection.
+    """
+    while True:
+        try:
+            database = _database()
+            ensureInvalidationCollection(database)
+            clearAll()
+
+            cursor = database[INVALIDATION_COLLECTION].find(
+                cursor_type=pymongo.CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                for doc in cursor:
+                    cache = _caches.get(doc.get('cache'))
+                    if cache is not None:
+                        cache.clear(doc.get('key'))
+        except Exception:
+            logger.exception('Error while following cache invalidations.')
+        time.sleep(1)
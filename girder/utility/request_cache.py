@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module provides caches whose lifetime is bound to a single cherrypy
+request. Outside of a request (for instance, in a background thread or a
+script), no caching is performed, so callers must always be prepared to fall
+back to the database.
+"""
+
+import cherrypy
+
+
+def _requestCaches():
+    request = cherrypy.serving.request
+    # The default request object that cherrypy exposes outside of a request is
+    # shared between threads, and never has an application bound to it.
+    if getattr(request, 'app', None) is None:
+        return None
+
+    caches = request.__dict__.get('girderRequestCache')
+    if caches is None:
+        caches = request.girderRequestCache = {}
+    return caches
+
+
+def getCache(name):
+    """
+    Return the named dict that lives for the duration of the current request.
+
+    :param name: The namespace of the cache.
+    :type name: str
+    :returns: A dict, or None if not currently inside a request.
+    """
+    caches = _requestCaches()
+    if caches is None:
+        return None
+    return caches.setdefault(name, {})
+
+
+def invalidate(name, key=None):
+    """
+    Remove an entry, or all entries, from a named request cache.
+
+    :param name: The namespace of the cache.
+    :type name: str
+    :param key: The key to remove, or None to clear the entire namespace.
+    """
+    caches = _requestCaches()
+    if not caches or name not in caches:
+        return
+
+    if key is None:
+        del caches[name]
+    else:
+        caches[name].pop(key, None)
@@ -29,7 +29,9 @@ import uuid
 from girder import logger, events
 from girder.api.rest import setContentDisposition
 from girder.models.model_base import GirderException, ValidationException
+from . import bulk_import, prefetch
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
+from .model_importer import ModelImporter
 
 BUF_LEN = 65536  # Buffer size for download stream
 DEFAULT_REGION = 'us-east-1'
@@ -368,58 +370,64 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
         if headers:
             raise cherrypy.HTTPRedirect(url)
         else:
-            def stream():
-                pipe = requests.get(url, stream=True)
+            return self._proxyStream(file, url, offset, endByte)
+
+    def _proxyStream(self, file, url, offset, endByte):
+        """
+        Returns a generator function that pipes a range of the bytes of a file
+        from S3, reading ahead while the previous bytes are sent.
+        """
+        if endByte is None or endByte > file['size']:
+            endByte = file['size']
+        headers = {}
+        if offset > 0 or endByte < file['size']:
+            headers['Range'] = 'bytes=%d-%d' % (offset, endByte - 1)
+
+        def chunks():
+            pipe = requests.get(url, stream=True, headers=headers)
+            try:
                 for chunk in pipe.iter_content(chunk_size=BUF_LEN):
                     if chunk:
                         yield chunk
-            return stream
+            finally:
+                pipe.close()
+
+        def stream():
+            if endByte <= offset:
+                return
+            for chunk in prefetch.prefetch(chunks()):
+                yield chunk
+        return stream
+
+    def readRange(self, file, offset, length):
+        """
+        Read a range of a file with a ranged GET request.
+        """
+        endByte = min(offset + length, file['size'])
+        if endByte <= offset:
+            return b''
+        resp = self.client.get_object(
+            Bucket=self.assetstore['bucket'], Key=file['s3Key'],
+            Range='bytes=%d-%d' % (offset, endByte - 1))
+        return resp['Body'].read()
 
     def importData(self, parent, parentType, params, progress, user, **kwargs):
+        """
+        Import the objects under a prefix of the bucket. Folders are created
+        for the prefixes, and an item with a single file for each object.
+
+        Every page of keys is listed with ``list_objects_v2`` and imported with
+        bulk writes. The prefixes directly under the import path are walked by
+        a pool of threads, and the last key imported from each of them is
+        recorded, so that an import that was interrupted resumes from there
+        when it is started again with the same destination and path.
+        """
         importPath = params.get('importPath', '').strip().lstrip('/')
 
         if importPath and not importPath.endswith('/'):
             importPath += '/'
 
-        bucket = self.assetstore['bucket']
-        resp = self.client.list_objects(Bucket=bucket, Prefix=importPath, Delimiter='/')
-
-        # Start with objects
-        for obj in resp.get('Contents', []):
-            if progress:
-                progress.update(message=obj['Key'])
-
-            name = obj['Key'].rsplit('/', 1)[-1]
-            if not name:
-                continue
-
-            if parentType != 'folder':
-                raise ValidationException(
-                    'Keys cannot be imported directly underneath a %s.' % parentType)
-
-            if self.shouldImportFile(obj['Key'], params):
-                item = self.model('item').createItem(
-                    name=name, creator=user, folder=parent, reuseExisting=True)
-                file = self.model('file').createFile(
-                    name=name, creator=user, item=item, reuseExisting=True,
-                    assetstore=self.assetstore, mimeType=None, size=obj['Size'])
-                file['s3Key'] = obj['Key']
-                file['imported'] = True
-                self.model('file').save(file)
-
-        # Now recurse into subdirectories
-        for obj in resp.get('CommonPrefixes', []):
-            if progress:
-                progress.update(message=obj['Prefix'])
-
-            name = obj['Prefix'].rstrip('/').rsplit('/', 1)[-1]
-
-            folder = self.model('folder').createFolder(
-                parent=parent, name=name, parentType=parentType, creator=user,
-                reuseExisting=True)
-            self.importData(parent=folder, parentType='folder', params={
-                'importPath': obj['Prefix']
-            }, progress=progress, user=user, **kwargs)
+        _S3Import(self, parent, parentType, importPath, params, user).run(progress)
 
     def deleteFile(self, file):
         """
@@ -443,6 +451,29 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
                     'key': file['s3Key']
                 })
 
+    def deleteFiles(self, files):
+        """
+        Queue the objects of all of the given files that are not shared with
+        any other file to be deleted asynchronously, using as few requests to
+        S3 as possible.
+        """
+        files = [file for file in files if file['size'] > 0 and 'relpath' in file]
+        if not files:
+            return
+
+        shared = set(self.model('file').collection.distinct('relpath', {
+            'relpath': {'$in': list({file['relpath'] for file in files})},
+            'assetstoreId': self.assetstore['_id'],
+            '_id': {'$nin': [file['_id'] for file in files]}
+        }))
+        keys = sorted({file['s3Key'] for file in files if file['relpath'] not in shared})
+        if keys:
+            events.daemon.trigger('_s3_assetstore_delete_files', {
+                'client': self.client,
+                'bucket': self.assetstore['bucket'],
+                'keys': keys
+            })
+
     def fileUpdated(self, file):
         """
         On file update, if the name or the MIME type changed, we must update
@@ -601,4 +632,127 @@ def _deleteFileImpl(event):
     event.info['client'].delete_object(Bucket=event.info['bucket'], Key=event.info['key'])
 
 
+def _deleteFilesImpl(event):
+    keys = event.info['keys']
+    # S3 allows up to 1000 keys per request
+    for start in range(0, len(keys), 1000):
+        event.info['client'].delete_objects(Bucket=event.info['bucket'], Delete={
+            'Objects': [{'Key': key} for key in keys[start:start + 1000]],
+            'Quiet': True
+        })
+
+
 events.bind('_s3_assetstore_delete_file', '_s3_assetstore_delete_file', _deleteFileImpl)
+events.bind('_s3_assetstore_delete_files', '_s3_assetstore_delete_files', _deleteFilesImpl)
+
+
+class _S3Import(ModelImporter):
+    """
+    The state of an import from an S3 bucket. The keys directly under the
+    import path are listed with a delimiter, which also yields the prefixes
+    under it. Each of those prefixes is a shard that is listed without a
+    delimiter, so that its keys arrive in order and a single key records how
+    far it has been imported.
+    """
+    # The number of keys requested with each list_objects_v2 call
+    pageSize = 1000
+
+    def __init__(self, adapter, parent, parentType, importPath, params, user):
+        self.adapter = adapter
+        self.parent = parent
+        self.parentType = parentType
+        self.importPath = importPath
+        self.params = params
+        self.user = user
+        self.importer = bulk_import.BulkImporter(adapter.assetstore, user)
+        self.shards = self.model('import_checkpoint').getShards(
+            adapter.assetstore, parent, importPath)
+        self.folders = {'': parent}
+
+    def run(self, progress):
+        # Resume the shards of an interrupted import, if there are any
+        roots = [shard for shard, record in six.viewitems(self.shards)
+                 if not record['complete']]
+        if self.importPath not in self.shards:
+            roots.insert(0, self.importPath)
+
+        try:
+            bulk_import.walkParallel(roots, self._walk, progress)
+        finally:
+            self.importer.commitSizes()
+        self.model('import_checkpoint').clear(
+            self.adapter.assetstore, self.parent, self.importPath)
+
+    def _record(self, shard, after=None, complete=False):
+        self.model('import_checkpoint').record(
+            self.adapter.assetstore, self.parent, self.importPath, shard,
+            after=after, complete=complete)
+
+    def _walk(self, shard, add, report):
+        params = {
+            'Bucket': self.adapter.assetstore['bucket'],
+            'Prefix': shard
+        }
+        if shard == self.importPath:
+            params['Delimiter'] = '/'
+        after = (self.shards.get(shard) or {}).get('after')
+        if after:
+            params['StartAfter'] = after
+
+        paginator = self.adapter.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(PaginationConfig={'PageSize': self.pageSize}, **params):
+            for obj in page.get('CommonPrefixes', []):
+                if obj['Prefix'] not in self.shards:
+                    self.shards[obj['Prefix']] = None
+                    self._record(obj['Prefix'])
+                    add(obj['Prefix'])
+
+            objects = page.get('Contents', [])
+            entries = [entry for entry in (self._entry(obj) for obj in objects) if entry]
+            self.importer.importFiles(entries)
+            if objects:
+                after = objects[-1]['Key']
+                self._record(shard, after=after)
+                report(len(entries), after)
+
+        self._record(shard, after=after, complete=True)
+
+    def _entry(self, obj):
+        """
+        Return the import entry for an object, or None if it should not be
+        imported. Folders are created for the prefixes of the key.
+        """
+        dirname, _, name = obj['Key'][len(self.importPath):].rpartition('/')
+        folder = self._folder(dirname)
+        if not name:
+            return None
+
+        if not dirname and self.parentType != 'folder':
+            raise ValidationException(
+                'Keys cannot be imported directly underneath a %s.' % self.parentType)
+
+        if not self.adapter.shouldImportFile(obj['Key'], self.params):
+            return None
+
+        return {
+            'folder': folder,
+            'name': name,
+            'size': obj['Size'],
+            'fields': {
+                's3Key': obj['Key'],
+                'imported': True
+            }
+        }
+
+    def _folder(self, path):
+        """
+        Return the folder for a path relative to the import path, creating it
+        and its parents if needed.
+        """
+        if path not in self.folders:
+            parentPath, _, name = path.rpartition('/')
+            self.folders[path] = self.model('folder').createFolder(
+                parent=self._folder(parentPath), name=name,
+                parentType='folder' if parentPath else self.parentType,
+                creator=self.user, reuseExisting=True)
+        return self.folders[path]
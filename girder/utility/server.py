@@ -27,7 +27,7 @@ import six
 
 import girder.events
 from girder import constants, logprint, __version__, logStdoutStderr
-from girder.utility import plugin_utilities, model_importer, config
+from girder.utility import plugin_utilities, model_importer, config, size_accounting
 from . import webroot
 
 with open(os.path.join(os.path.dirname(__file__), 'error.mako')) as f:
@@ -161,6 +161,7 @@ def configureServer(test=False, plugins=None, curConfig=None):
 
     cherrypy.engine.subscribe('start', girder.events.daemon.start)
     cherrypy.engine.subscribe('stop', girder.events.daemon.stop)
+    cherrypy.engine.subscribe('stop', size_accounting.flush)
 
     if plugins is None:
         settings = model_importer.ModelImporter().model('setting')
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module accumulates changes to the recorded sizes of items, folders,
+collections, and users so that many changes to the same document become a
+single write. Changes made during a request, or inside a :py:func:`deferred`
+block, are merged in memory and written with one bulk write per model at the
+end of the request or block, periodically while it runs, and when the server
+stops. Other changes are written immediately. Sizes returned by
+:py:meth:`girder.models.model_base.Model.filterDocument` include the changes
+that this process has not written yet.
+"""
+
+import cherrypy
+import contextlib
+import os
+import pymongo
+import six
+import threading
+import time
+
+from girder import logger
+from girder.utility import config
+from girder.utility.model_importer import ModelImporter
+
+_pending = {}
+_pendingLock = threading.Lock()
+_local = threading.local()
+_flusherLock = threading.Lock()
+_flusherPid = None
+
+
+def _inRequest():
+    # The default request object that cherrypy exposes outside of a request
+    # never has an application bound to it.
+    return getattr(cherrypy.serving.request, 'app', None) is not None
+
+
+def add(modelName, id, amount):
+    """
+    Change the recorded size of a document.
+
+    :param modelName: The name of the model, e.g. 'folder'.
+    :type modelName: str
+    :param id: The _id of the document.
+    :type id: ObjectId
+    :param amount: The amount to add to its size.
+    :type amount: int
+    """
+    if not amount:
+        return
+    if not getattr(_local, 'depth', 0) and not _inRequest():
+        ModelImporter.model(modelName).incrementMany('size', {id: amount})
+        return
+
+    _ensureFlusher()
+    with _pendingLock:
+        key = (modelName, id)
+        _pending[key] = _pending.get(key, 0) + amount
+
+    request = cherrypy.serving.request
+    if _inRequest() and not request.__dict__.get('girderSizeFlush'):
+        request.girderSizeFlush = True
+        request.hooks.attach('on_end_resource', flush)
+
+
+def pending(modelName, id):
+    """
+    Return the change to the size of a document that has not been written yet.
+
+    :param modelName: The name of the model.
+    :type modelName: str
+    :param id: The _id of the document.
+    :type id: ObjectId
+    """
+    with _pendingLock:
+        return _pending.get((modelName, id), 0)
+
+
+def flush():
+    """
+    Write all accumulated size changes to the database.
+    """
+    global _pending
+
+    with _pendingLock:
+        if not _pending:
+            return
+        changes, _pending = _pending, {}
+
+    byModel = {}
+    for (modelName, id), amount in six.viewitems(changes):
+        if amount:
+            byModel.setdefault(modelName, {})[id] = amount
+
+    # The changes that have not been written are kept, so that they are
+    # retried by the next flush, even if writing those of one model fails
+    unwritten = dict(byModel)
+    try:
+        for modelName, amounts in six.viewitems(byModel):
+            try:
+                ModelImporter.model(modelName).incrementMany('size', amounts)
+            except pymongo.errors.BulkWriteError as e:
+                # The other increments of the unordered write were applied
+                unwritten[modelName] = {id: amounts[id] for id in e.failedIds}
+                raise
+            del unwritten[modelName]
+    finally:
+        if unwritten:
+            _requeue(unwritten)
+
+
+def _requeue(byModel):
+    with _pendingLock:
+        for modelName, amounts in six.viewitems(byModel):
+            for id, amount in six.viewitems(amounts):
+                key = (modelName, id)
+                _pending[key] = _pending.get(key, 0) + amount
+
+
+@contextlib.contextmanager
+def deferred():
+    """
+    A context manager that accumulates the size changes made by the current
+    thread, as if it were handling a request, and writes them when it exits.
+    Use this around scripts or background tasks that add many files.
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        if not _local.depth:
+            flush()
+
+
+def _ensureFlusher():
+    """
+    Start the thread that periodically writes accumulated changes, if it isn't
+    running in this process already.
+    """
+    global _flusherPid
+
+    pid = os.getpid()
+    if _flusherPid == pid:
+        return
+    with _flusherLock:
+        if _flusherPid == pid:
+            return
+        _flusherPid = pid
+        thread = threading.Thread(target=_flushPeriodically)
+        thread.daemon = True
+        thread.start()
+
+
+def _flushPeriodically():
+    while True:
+        interval = config.getConfig()['server'].get('size_flush_interval', 1)
+        time.sleep(max(float(interval), 0.1))
+        try:
+            flush()
+        except Exception:
+            logger.exception('Error while writing size changes.')
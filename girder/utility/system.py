@@ -26,7 +26,7 @@ import threading
 import time
 
 import girder
-from girder import logger
+from girder import events, logger
 from girder.models import getDbConnection
 
 
@@ -152,6 +152,7 @@ def getStatus(mode='basic', user=None):
             True for threadId in cherrypy.tools.status.seenThreads
             if 'end' not in cherrypy.tools.status.seenThreads[threadId]])
         status['cherrypyThreadPoolSize'] = cherrypy.server.thread_pool
+        status['eventDaemon'] = events.daemon.stats()
 
     if mode == 'slow' and isAdmin:
         _computeSlowStatus(process, status, db)
@@ -30,15 +30,32 @@ Example of creating and consuming a streaming zip:
         yield data
 
     yield zip.footer()
+
+Many files can be added at once with ``addFiles``, which reads and compresses
+the next several files on a pool of threads while the current one is written:
+
+    for data in zip.addFiles(folderModel.fileList(folder, user=user)):
+        yield data
 """
 
 import binascii
+import bisect
+import cherrypy
+import collections
+import functools
+import hashlib
 import os
 import six
 import struct
 import sys
+import threading
 import time
 
+from six.moves import queue
+
+from girder.api.rest import setResponseHeader
+from girder.utility import config
+
 try:
     import zlib
 except ImportError:  # pragma: no cover
@@ -52,6 +69,17 @@ Z_FILECOUNT_LIMIT = 1 << 16
 STORE = 0
 DEFLATE = 8
 
+# Files with these extensions are already compressed, so deflating them would
+# use a lot of time to save little or no space. They are always stored.
+COMPRESSED_EXTENSIONS = frozenset((
+    '.7z', '.avi', '.bz2', '.docx', '.flac', '.gif', '.gz', '.jar', '.jp2',
+    '.jpeg', '.jpg', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.npz',
+    '.ogg', '.pdf', '.png', '.pptx', '.rar', '.svs', '.tgz', '.webm', '.webp',
+    '.xlsx', '.xz', '.zip', '.zst'))
+
+# Marks the end of the data of an entry, or an exception raised while reading it
+_END = object()
+
 
 class ZipInfo(object):
 
@@ -66,7 +94,8 @@ class ZipInfo(object):
         'headerOffset',
         'crc',
         'compressSize',
-        'fileSize'
+        'fileSize',
+        'zip64'
     )
 
     def __init__(self, filename, timestamp):
@@ -90,9 +119,12 @@ class ZipInfo(object):
         self.createVersion = 20
         self.extractVersion = 20
         self.externalAttr = 0
+        # Whether the sizes of the entry are known to need 8 bytes before its
+        # data is written
+        self.zip64 = False
 
     def dataDescriptor(self):
-        if self.compressSize > Z64_LIMIT or self.fileSize > Z64_LIMIT:
+        if self.zip64 or self.compressSize > Z64_LIMIT or self.fileSize > Z64_LIMIT:
             fmt = b'<4sLQQ'
         else:
             fmt = b'<4sLLL'
@@ -107,10 +139,22 @@ class ZipInfo(object):
         dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
         dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
 
+        # The sizes are written in the data descriptor. If they are known to be
+        # large, a Zip64 extra field tells readers that it has 8 byte sizes.
+        if self.zip64:
+            extra = struct.pack(b'<HHQQ', 1, 16, 0, 0)
+            extractVersion = max(45, self.extractVersion)
+            size = 0xffffffff
+        else:
+            extra = b''
+            extractVersion = self.extractVersion
+            size = 0
+
         header = struct.pack(
-            b'<4s2B4HLLL2H', b'PK\003\004', self.extractVersion, 0, 0x8,
-            self.compressType, dostime, dosdate, 0, 0, 0, len(self.filename), 0)
-        return header + self.filename
+            b'<4s2B4HLLL2H', b'PK\003\004', extractVersion, 0, 0x8,
+            self.compressType, dostime, dosdate, 0, size, size, len(self.filename),
+            len(extra))
+        return header + self.filename + extra
 
 
 class ZipGenerator(object):
@@ -118,14 +162,19 @@ class ZipGenerator(object):
     This class can be used to create a streaming zip file that consumes from
     one generator and writes to another.
     """
-    def __init__(self, rootPath='', compression=STORE):
+    def __init__(self, rootPath='', compression=None):
         """
         :param rootPath: The root path for all files within this archive.
         :type rootPath: str
         :param compression: Whether files in this archive should be compressed.
-
-        :type
+            If None, this is DEFLATE if the ``zip_compression`` option of the
+            ``[server]`` configuration is "deflate", and STORE otherwise.
+            Files with an extension in COMPRESSED_EXTENSIONS are always stored.
+        :type compression: STORE, DEFLATE, or None
         """
+        if compression is None:
+            option = config.getConfig()['server'].get('zip_compression', 'store')
+            compression = DEFLATE if option == 'deflate' else STORE
         if compression == DEFLATE and not zlib:
             raise RuntimeError('Missing zlib module')  # pragma: no cover
 
@@ -143,24 +192,34 @@ class ZipGenerator(object):
         self.offset += len(data)
         return data
 
-    def addFile(self, generator, path):
+    def _createHeader(self, path, size=None):
         """
-        Generates data to add a file at the given path in the archive.
-        :param generator: Generator function that will yield the file contents.
-        :type generator: function
-        :param path: The path within the archive for this entry.
-        :type path: str
+        Create the header of a new entry, choosing its compression. If the size
+        of the file is known, entries that need 8 byte sizes are marked as
+        Zip64 in their local header.
         """
         fullpath = os.path.join(self.rootPath, path)
         header = ZipInfo(fullpath, time.localtime()[0:6])
         header.externalAttr = (0o100644 & 0xFFFF) << 16
         header.compressType = self.compression
-        header.headerOffset = self.offset
-
-        header.crc = crc = 0
-        header.compressSize = compressSize = 0
-        header.fileSize = fileSize = 0
-        yield self._advanceOffset(header.fileHeader())
+        if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+            header.compressType = STORE
+        header.crc = 0
+        header.compressSize = 0
+        header.fileSize = 0
+        if size is not None:
+            # Deflating data that does not compress makes it slightly larger
+            if header.compressType == DEFLATE:
+                size *= 1.05
+            header.zip64 = size > Z64_LIMIT
+        return header
+
+    def _encode(self, header, generator):
+        """
+        Yield the compressed data of an entry, recording its CRC and sizes in
+        its header once it is complete.
+        """
+        crc = compressSize = fileSize = 0
         if header.compressType == DEFLATE:
             compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
                                           zlib.DEFLATED, -15)
@@ -178,20 +237,87 @@ class ZipGenerator(object):
             if compressor:
                 buf = compressor.compress(buf)
                 compressSize += len(buf)
-            yield self._advanceOffset(buf)
+            if buf:
+                yield buf
 
         if compressor:
             buf = compressor.flush()
             compressSize += len(buf)
-            yield self._advanceOffset(buf)
+            yield buf
             header.compressSize = compressSize
         else:
             header.compressSize = fileSize
         header.crc = crc
         header.fileSize = fileSize
+
+    def _writeEntry(self, header, data):
+        """
+        Generates an entry of the archive at the current offset, given the
+        generator of its compressed data.
+        """
+        header.headerOffset = self.offset
+        yield self._advanceOffset(header.fileHeader())
+        for buf in data:
+            yield self._advanceOffset(buf)
         yield self._advanceOffset(header.dataDescriptor())
         self.files.append(header)
 
+    def addFile(self, generator, path, size=None):
+        """
+        Generates data to add a file at the given path in the archive.
+        :param generator: Generator function that will yield the file contents.
+        :type generator: function
+        :param path: The path within the archive for this entry.
+        :type path: str
+        :param size: The length of the file, if it is known. Files larger than
+            2GB must be given their size for the archive to be valid.
+        :type size: int or None
+        """
+        header = self._createHeader(path, size)
+        return self._writeEntry(header, self._encode(header, generator))
+
+    def addFiles(self, files, workers=None, window=None):
+        """
+        Generates data to add many files to the archive. The next ``window``
+        files are read and compressed on a pool of ``workers`` threads while
+        earlier ones are written, and entries are written in the order that
+        they are listed. Each file has at most a few chunks buffered at once.
+
+        :param files: The files to add, as (path, file document or generator
+            function) pairs like those returned by the ``fileList`` method of
+            models. Pass file documents, by calling ``fileList`` with
+            ``data=False``, so that the sizes of large files are known.
+        :type files: iterable
+        :param workers: The number of threads reading files, or None to use
+            the ``zip_workers`` option of the ``[server]`` configuration. If
+            this is 0, files are read one at a time on the calling thread.
+        :type workers: int or None
+        :param window: The number of files being read at once, or None to use
+            the ``zip_window`` option of the ``[server]`` configuration.
+        :type window: int or None
+        """
+        serverConfig = config.getConfig()['server']
+        if workers is None:
+            workers = int(serverConfig.get('zip_workers', 4))
+        if window is None:
+            window = int(serverConfig.get('zip_window', 8))
+
+        if workers <= 0:
+            for path, file in files:
+                for data in self.addFile(*_fileData(file), path=path):
+                    yield data
+            return
+
+        def entries():
+            for path, file in files:
+                generator, size = _fileData(file)
+                header = self._createHeader(path, size)
+                yield header, functools.partial(self._encode, header, generator)
+
+        for header, data in _readAhead(entries(), workers, window):
+            for buf in self._writeEntry(header, data):
+                yield buf
+
     def footer(self):
         """
         Once all zip files have been added with addFile, you must call this
@@ -222,7 +348,7 @@ class ZipGenerator(object):
 
             if extra:
                 extraData = struct.pack(
-                    b'<hh' + b'q'*len(extra), 1, 8*len(extra), *extra)
+                    b'<HH' + b'Q'*len(extra), 1, 8*len(extra), *extra)
                 extractVersion = max(45, header.extractVersion)
                 createVersion = max(45, header.createVersion)
             else:
@@ -247,11 +373,11 @@ class ZipGenerator(object):
 
         if pos1 > Z64_LIMIT or size > Z64_LIMIT or count >= Z_FILECOUNT_LIMIT:
             zip64endrec = struct.pack(
-                b'<4sqhhLLqqqq', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count,
+                b'<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count,
                 size, pos1)
             data.append(self._advanceOffset(zip64endrec))
 
-            zip64locrec = struct.pack(b'<4sLqL', b'PK\x06\x07', 0, pos2, 1)
+            zip64locrec = struct.pack(b'<4sLQL', b'PK\x06\x07', 0, pos2, 1)
             data.append(self._advanceOffset(zip64locrec))
 
             count = min(count, 0xFFFF)
@@ -263,3 +389,440 @@ class ZipGenerator(object):
         data.append(self._advanceOffset(endrec))
 
         return b''.join(data)
+
+
+def seekableDownloads():
+    """
+    Return whether zip downloads should be served by a
+    :py:class:`SeekableZipGenerator`, which is the case when files are stored
+    without compression and the ``zip_seekable`` option of the ``[server]``
+    configuration is enabled.
+    """
+    serverConfig = config.getConfig()['server']
+    return (bool(serverConfig.get('zip_seekable', True)) and
+            serverConfig.get('zip_compression', 'store') != 'deflate')
+
+
+class _SeekableEntry(object):
+    """
+    An entry of a :py:class:`SeekableZipGenerator`: its local header, stored
+    data, and data descriptor.
+    """
+    def __init__(self, header, reader, crc, onCrc, version):
+        self.header = header
+        self.reader = reader
+        self.crc = crc
+        self.onCrc = onCrc
+        self.version = version
+        self.localHeader = None
+        self.length = None
+
+    def setCrc(self, crc):
+        self.crc = self.header.crc = crc
+        if self.onCrc:
+            self.onCrc(crc)
+
+    def computeCrc(self, endByte):
+        """
+        Compute the CRC of the first bytes of the file.
+        """
+        crc = 0
+        if endByte > 0:
+            for buf in self.reader(0, endByte):
+                crc = binascii.crc32(_toBytes(buf), crc) & 0xFFFFFFFF
+        return crc
+
+    def read(self, start, end):
+        """
+        Generate the bytes of this entry from start to end, relative to the
+        start of its local header. When the data descriptor is included, the
+        CRC of the file is computed as its data is read if it isn't known.
+        """
+        headerLength = len(self.localHeader)
+        dataEnd = headerLength + self.header.fileSize
+        if start < headerLength:
+            yield self.localHeader[start:min(end, headerLength)]
+
+        if start < dataEnd and end > headerLength:
+            offset = max(start - headerLength, 0)
+            endByte = min(end - headerLength, self.header.fileSize)
+            # Reading the prefix of the file to resume its CRC is only worth it
+            # when the descriptor is needed.
+            trackCrc = self.crc is None and endByte == self.header.fileSize and (
+                offset == 0 or end > dataEnd)
+            crc = self.computeCrc(offset) if trackCrc and offset else 0
+            for buf in self.reader(offset, endByte):
+                buf = _toBytes(buf)
+                if trackCrc:
+                    crc = binascii.crc32(buf, crc) & 0xFFFFFFFF
+                yield buf
+            if trackCrc:
+                self.setCrc(crc)
+
+        if end > dataEnd:
+            if self.crc is None:
+                self.setCrc(self.computeCrc(self.header.fileSize))
+            yield self.header.dataDescriptor()[max(start - dataEnd, 0):end - dataEnd]
+
+
+class SeekableZipGenerator(object):
+    """
+    This class creates a zip file of files whose sizes are known in advance,
+    stored without compression. Since the length of every part of the archive
+    is known, its layout is computed before any data is read, so that its size
+    can be reported and any range of its bytes can be generated by reading only
+    the files behind them. The central directory at the end of the archive
+    holds the CRC of every file, so ranges are only offered once every CRC is
+    known. CRCs that are not known are computed as the files are read, and can
+    be recorded for later requests.
+    """
+    def __init__(self, rootPath=''):
+        """
+        :param rootPath: The root path for all files within this archive.
+        :type rootPath: str
+        """
+        self.rootPath = rootPath
+        self.entries = []
+        self.size = None
+        self._entryOffsets = None
+        self._centralOffset = None
+
+    def addFile(self, reader, path, size, crc=None, timestamp=None, onCrc=None,
+                version=None):
+        """
+        Add a file at the given path in the archive.
+
+        :param reader: A function taking an offset and an end byte within the
+            file, and returning an iterable of the bytes in that range.
+        :type reader: function
+        :param path: The path within the archive for this entry.
+        :type path: str
+        :param size: The length of the file in bytes.
+        :type size: int
+        :param crc: The CRC-32 of the file, if it is known.
+        :type crc: int or None
+        :param timestamp: The modification time of the file, as a
+            (year, month, day, hour, minute, second) tuple. If None, the file
+            is dated 1980-01-01 so that the archive is the same each time.
+        :type timestamp: tuple or None
+        :param onCrc: A function called with the CRC-32 of the file if it is
+            computed, which may be used to record it.
+        :type onCrc: function or None
+        :param version: A string that changes when the contents of the file
+            do. It is used to compute the ETag of the archive.
+        :type version: str or None
+        """
+        header = ZipInfo(os.path.join(self.rootPath, path),
+                         tuple(max(timestamp or (1980, 1, 1, 0, 0, 0), (1980, 1, 1, 0, 0, 0))))
+        header.externalAttr = (0o100644 & 0xFFFF) << 16
+        header.compressType = STORE
+        header.crc = crc or 0
+        header.compressSize = header.fileSize = size
+        header.zip64 = size > Z64_LIMIT
+        self.entries.append(_SeekableEntry(header, reader, crc, onCrc, version))
+        self.size = None
+
+    def addFileList(self, files):
+        """
+        Add the files listed by the ``fileList`` method of a model called with
+        ``data=False``. CRCs computed while reading files are saved in the
+        ``crc32`` field of their documents.
+
+        :param files: (path, file document or stream function) pairs.
+        :type files: iterable
+        """
+        from .model_importer import ModelImporter
+
+        fileModel = ModelImporter.model('file')
+        for path, file in files:
+            if callable(file):
+                # Generated files, such as metadata, are small
+                data = b''.join(_toBytes(buf) for buf in file())
+                self.addFile(functools.partial(_readBytes, data), path, len(data),
+                             crc=binascii.crc32(data) & 0xFFFFFFFF, version=data)
+                continue
+
+            size = len(file['linkUrl']) if file.get('linkUrl') else file['size']
+            created = file.get('created')
+            self.addFile(
+                functools.partial(_readFile, fileModel, file), path, size,
+                crc=file.get('crc32'),
+                timestamp=created.timetuple()[0:6] if created else None,
+                onCrc=functools.partial(_saveCrc, fileModel, file),
+                version='%s %s %s' % (file['_id'], created, size))
+
+    def _layout(self):
+        """
+        Compute the offset of each entry and of the central directory, and the
+        size of the archive.
+        """
+        if self.size is not None:
+            return
+        offset = 0
+        self._entryOffsets = []
+        for entry in self.entries:
+            entry.header.headerOffset = offset
+            entry.localHeader = entry.header.fileHeader()
+            entry.length = (len(entry.localHeader) + entry.header.fileSize +
+                            len(entry.header.dataDescriptor()))
+            self._entryOffsets.append(offset)
+            offset += entry.length
+        self._centralOffset = offset
+        # The length of the central directory doesn't depend on the CRCs
+        self.size = offset + len(self._footer())
+
+    def _footer(self):
+        zip = ZipGenerator(self.rootPath, compression=STORE)
+        zip.files = [entry.header for entry in self.entries]
+        zip.offset = self._centralOffset
+        return zip.footer()
+
+    def etag(self):
+        """
+        Return a value that identifies the contents of this archive.
+        """
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            for value in (entry.header.filename, entry.header.fileSize, entry.version):
+                digest.update(_toBytes(repr(value)))
+        return digest.hexdigest()
+
+    def getSize(self):
+        """
+        Return the length of the archive in bytes.
+        """
+        self._layout()
+        return self.size
+
+    def seekable(self):
+        """
+        Return whether the CRC of every file is known, so that any range of the
+        archive can be generated by reading only the files behind it.
+        """
+        return all(entry.crc is not None for entry in self.entries)
+
+    def read(self, offset=0, endByte=None, workers=None, window=None):
+        """
+        Generate the bytes of a range of the archive. The files behind the
+        range are read ahead as with :py:meth:`ZipGenerator.addFiles`. If the
+        range includes the central directory and the archive is not
+        :py:meth:`seekable`, files whose CRCs were not computed while reading
+        the range are read again in full.
+
+        :param offset: The first byte to generate.
+        :type offset: int
+        :param endByte: The end of the range (non-inclusive), or None for the
+            end of the archive.
+        :type endByte: int or None
+        :param workers: The number of threads reading files, or None to use
+            the ``zip_workers`` option of the ``[server]`` configuration.
+        :type workers: int or None
+        :param window: The number of files being read at once, or None to use
+            the ``zip_window`` option of the ``[server]`` configuration.
+        :type window: int or None
+        """
+        self._layout()
+        if endByte is None or endByte > self.size:
+            endByte = self.size
+        serverConfig = config.getConfig()['server']
+        if workers is None:
+            workers = int(serverConfig.get('zip_workers', 4))
+        if window is None:
+            window = int(serverConfig.get('zip_window', 8))
+
+        jobs = []
+        first = max(bisect.bisect_right(self._entryOffsets, offset) - 1, 0)
+        for index in range(first, len(self.entries)):
+            start = self._entryOffsets[index]
+            if start >= endByte:
+                break
+            entry = self.entries[index]
+            jobs.append((entry, functools.partial(
+                entry.read, max(offset - start, 0), min(endByte - start, entry.length))))
+
+        if workers > 0:
+            for _, data in _readAhead(jobs, workers, window):
+                for buf in data:
+                    yield buf
+        else:
+            for _, read in jobs:
+                for buf in read():
+                    yield buf
+
+        if endByte > self._centralOffset:
+            for entry in self.entries:
+                if entry.crc is None:
+                    entry.setCrc(entry.computeCrc(entry.header.fileSize))
+            footer = self._footer()
+            yield footer[max(offset - self._centralOffset, 0):endByte - self._centralOffset]
+
+    def download(self):
+        """
+        Set the headers of a response containing this archive, returning only
+        the range of it requested by a Range header, unless an If-Range header
+        shows that the archive has changed. A request for several ranges gets
+        the whole archive, and one for ranges that are all past its end gets
+        a 416 response. Until the archive is :py:meth:`seekable`, ranges are
+        not offered and the whole archive is sent, recording the CRCs as the
+        files are read. The Content-Type and Content-Disposition headers should
+        be set by the caller.
+
+        :returns: A generator function that streams the response.
+        """
+        size = self.getSize()
+        etag = '"%s"' % self.etag()
+        seekable = self.seekable()
+        setResponseHeader('Accept-Ranges', 'bytes' if seekable else 'none')
+        setResponseHeader('ETag', etag)
+
+        offset, endByte = 0, size
+        headers = cherrypy.request.headers
+        ranges = cherrypy.lib.httputil.get_ranges(headers.get('Range'), size)
+        if seekable and ranges is not None and headers.get('If-Range', etag) == etag:
+            if not ranges:
+                cherrypy.response.status = 416
+                setResponseHeader('Content-Range', 'bytes */%d' % size)
+                offset = endByte
+            elif len(ranges) == 1:
+                # Several ranges would need a multipart/byteranges response,
+                # so the whole archive is sent for them instead.
+                offset, endByte = ranges[0][0], min(ranges[0][1], size)
+                setResponseHeader(
+                    'Content-Range', 'bytes %d-%d/%d' % (offset, endByte - 1, size))
+        setResponseHeader('Content-Length', endByte - offset)
+
+        def stream():
+            if offset < endByte:
+                for data in self.read(offset, endByte):
+                    yield data
+        return stream
+
+
+def _toBytes(data):
+    if isinstance(data, six.text_type):
+        data = data.encode('utf8')
+    return data
+
+
+def _readBytes(data, offset, endByte):
+    return [data[offset:endByte]]
+
+
+def _fileData(file):
+    """
+    Return the generator function and size of a file listed by ``fileList``,
+    which is either a file document or, as for generated files, a generator
+    function of unknown size.
+    """
+    if callable(file):
+        return file, None
+    from .model_importer import ModelImporter
+
+    size = len(file['linkUrl']) if file.get('linkUrl') else file['size']
+    return ModelImporter.model('file').download(file, headers=False), size
+
+
+def _readFile(fileModel, file, offset, endByte):
+    return fileModel.download(file, offset=offset, headers=False, endByte=endByte)()
+
+
+def _saveCrc(fileModel, file, crc):
+    fileModel.update({'_id': file['_id']}, {'$set': {'crc32': crc}}, multi=False)
+
+
+class _Entry(object):
+    """
+    Data that is read by a worker thread of :py:func:`_readAhead`. It is handed
+    to the thread that consumes it through a small bounded queue, which is
+    iterated to get it.
+    """
+    def __init__(self, read, stopped, bufferSize=4):
+        self._read = read
+        self.stopped = stopped
+        self.queue = queue.Queue(maxsize=bufferSize)
+
+    def _put(self, value):
+        # Wait for room in the queue, giving up if the consumer is done
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(self):
+        if self.stopped.is_set():
+            return
+        try:
+            for buf in self._read():
+                if not self._put((buf, None)):
+                    return
+            self._put((_END, None))
+        except Exception:
+            self._put((_END, sys.exc_info()))
+
+    def __iter__(self):
+        while True:
+            buf, excInfo = self.queue.get()
+            if buf is _END:
+                if excInfo is not None:
+                    six.reraise(*excInfo)
+                return
+            yield buf
+
+
+def _readAhead(jobs, workers, window):
+    """
+    Read several sources of data at once on a pool of threads, consuming them
+    in order. This yields a (key, data) pair for each job, where data iterates
+    over the data of the job while it is being read.
+
+    :param jobs: (key, read) pairs, where read is a function of no arguments
+        that returns an iterable of data.
+    :type jobs: iterable
+    :param workers: The number of threads.
+    :type workers: int
+    :param window: The maximum number of jobs being read at once.
+    :type window: int
+    """
+    queued = queue.Queue()
+    stopped = threading.Event()
+    threads = []
+    for _ in range(workers):
+        thread = threading.Thread(target=_readEntries, args=(queued,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    jobs = iter(jobs)
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) < max(window, 1):
+                try:
+                    key, read = next(jobs)
+                except StopIteration:
+                    break
+                entry = _Entry(read, stopped)
+                queued.put(entry)
+                pending.append((key, entry))
+            if not pending:
+                break
+            yield pending.popleft()
+    finally:
+        stopped.set()
+        for _ in threads:
+            queued.put(None)
+
+
+def _readEntries(jobs):
+    """
+    The body of a worker thread of :py:func:`_readAhead`, which reads entries
+    until it is given None.
+    """
+    while True:
+        entry = jobs.get()
+        if entry is None:
+            return
+        entry.read()
@@ -151,7 +151,7 @@ class HashsumDownloadTest(base.TestCase):
         resp = self._download('crc32', '1a2b3c4d', user=self.user)
         self.assertStatus(resp, 400)
 
-        for hashAlgorithm in ['sha512']:
+        for hashAlgorithm in ['md5', 'sha256', 'sha512']:
             publicDataHash = self._hashSum(self.userData, hashAlgorithm)
             privateDataHash = self._hashSum(self.privateOnlyData, hashAlgorithm)
 
@@ -269,7 +269,7 @@ class HashsumDownloadTest(base.TestCase):
             self.model('setting').set(hashsum_download.PluginSettings.AUTO_COMPUTE, 'bad')
 
         old = hashsum_download.SUPPORTED_ALGORITHMS
-        hashsum_download.SUPPORTED_ALGORITHMS = {'sha512', 'sha256'}
+        hashsum_download.SUPPORTED_ALGORITHMS = {'sha512', 'sha1'}
         self.model('setting').set(hashsum_download.PluginSettings.AUTO_COMPUTE, True)
 
         file = self.model('upload').uploadFromFile(
@@ -279,14 +279,14 @@ class HashsumDownloadTest(base.TestCase):
         start = time.time()
         while time.time() < start + 15:
             file = self.model('file').load(file['_id'], force=True)
-            if 'sha256' in file:
+            if 'sha1' in file:
                 break
             time.sleep(0.2)
 
-        expected = hashlib.sha256()
+        expected = hashlib.sha1()
         expected.update(self.userData)
-        self.assertIn('sha256', file)
-        self.assertEqual(file['sha256'], expected.hexdigest())
+        self.assertIn('sha1', file)
+        self.assertEqual(file['sha1'], expected.hexdigest())
 
         expected = hashlib.sha512()
         expected.update(self.userData)
@@ -299,11 +299,13 @@ class HashsumDownloadTest(base.TestCase):
         from girder.plugins import hashsum_download
         self.model('setting').set(hashsum_download.PluginSettings.AUTO_COMPUTE, False)
         old = hashsum_download.SUPPORTED_ALGORITHMS
-        hashsum_download.SUPPORTED_ALGORITHMS = {'sha512', 'sha256'}
+        hashsum_download.SUPPORTED_ALGORITHMS = {'sha512', 'sha1'}
 
-        self.assertNotIn('sha256', self.privateFile)
+        # Digests computed during the upload are not computed again
+        self.assertEqual(self.privateFile['sha256'], self._hashSum(self.userData, 'sha256'))
+        self.assertNotIn('sha1', self.privateFile)
 
-        expected = hashlib.sha256()
+        expected = hashlib.sha1()
         expected.update(self.userData)
 
         # Running the compute endpoint should only compute the missing ones
@@ -311,7 +313,7 @@ class HashsumDownloadTest(base.TestCase):
             '/file/%s/hashsum' % self.privateFile['_id'], method='POST', user=self.user)
         self.assertStatusOk(resp)
         self.assertEqual(resp.json, {
-            'sha256': expected.hexdigest()
+            'sha1': expected.hexdigest()
         })
 
         # Running again should be a no-op
@@ -321,6 +323,6 @@ class HashsumDownloadTest(base.TestCase):
         self.assertEqual(resp.json, None)
 
         file = self.model('file').load(self.privateFile['_id'], force=True)
-        self.assertEqual(file['sha256'], expected.hexdigest())
+        self.assertEqual(file['sha1'], expected.hexdigest())
 
         hashsum_download.SUPPORTED_ALGORITHMS = old
@@ -17,8 +17,6 @@
 #  limitations under the License.
 ###############################################################################
 
-import hashlib
-import six
 import warnings
 
 from girder import events
@@ -28,11 +26,11 @@ from girder.api.rest import RestException, setRawResponse, setResponseHeader, se
 from girder.api.v1.file import File
 from girder.constants import AccessType, TokenScope
 from girder.models.model_base import ValidationException
-from girder.utility import setting_utilities
+from girder.utility import hash_state, setting_utilities
 from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext, noProgress
 
-SUPPORTED_ALGORITHMS = {'sha512'}
+SUPPORTED_ALGORITHMS = {'md5', 'sha256', 'sha512'}
 _CHUNK_LEN = 65536
 
 
@@ -165,27 +163,29 @@ def _computeHash(file, progress=noProgress):
     file data and stream-computes all required hashes on it, saving
     the results in the file document.
 
-    In the case of assetstore impls that already compute the sha512,
-    and when sha512 is the only supported algorithm, we will not download
-    the file to the server.
+    Assetstores that receive the data of uploads compute these checksums as
+    it arrives, in which case we will not download the file to the server.
+    When the file does have to be read, its CRC-32 is computed too if it is
+    missing.
     """
     toCompute = SUPPORTED_ALGORITHMS - set(file)
-    toCompute = {alg: getattr(hashlib, alg)() for alg in toCompute}
 
     if not toCompute:
         return
+    if 'crc32' not in file:
+        toCompute.add('crc32')
 
+    checksum = hash_state.MultiHash(toCompute)
     fileModel = ModelImporter.model('file')
     with fileModel.open(file) as fh:
         while True:
             chunk = fh.read(_CHUNK_LEN)
             if not chunk:
                 break
-            for digest in six.viewvalues(toCompute):
-                digest.update(chunk)
+            checksum.update(chunk)
             progress.update(increment=len(chunk))
 
-    digests = {alg: digest.hexdigest() for alg, digest in six.viewitems(toCompute)}
+    digests = checksum.digests()
     fileModel.update({'_id': file['_id']}, update={
         '$set': digests
     }, multi=False)
@@ -201,7 +201,10 @@ def _validateAutoCompute(doc):
 
 def load(info):
     HashedFile(info['apiRoot'].file)
-    ModelImporter.model('file').exposeFields(
-        level=AccessType.READ, fields=SUPPORTED_ALGORITHMS)
+    fileModel = ModelImporter.model('file')
+    fileModel.exposeFields(level=AccessType.READ, fields=SUPPORTED_ALGORITHMS)
+    # Files are looked up by the digests computed during upload
+    for algorithm in SUPPORTED_ALGORITHMS:
+        fileModel.ensureIndex(algorithm)
 
     events.bind('data.process', info['name'], _computeHashHook)
@@ -152,6 +152,41 @@ class HdfsAssetstoreAdapter(AbstractAssetstoreAdapter):
                     break
         return stream
 
+    def readRange(self, file, offset, length):
+        """
+        Read a range of a file with a WebHDFS OPEN request, which redirects to
+        a data node that sends only the requested bytes.
+        """
+        length = min(length, file['size'] - offset)
+        if length <= 0:
+            return b''
+
+        if file['hdfs'].get('imported'):
+            path = file['hdfs']['path']
+        else:
+            path = self._absPath(file)
+
+        url = ('http://%s:%d/webhdfs/v1%s?op=OPEN&offset=%d&length=%d'
+               '&namenoderpcaddress=%s:%d&user.name=%s')
+        url %= (
+            self.assetstore['hdfs']['host'],
+            self.assetstore['hdfs']['webHdfsPort'],
+            path,
+            offset,
+            length,
+            self.assetstore['hdfs']['host'],
+            self.assetstore['hdfs']['port'],
+            self._getHdfsUser(self.assetstore)
+        )
+
+        resp = requests.get(url)
+        try:
+            resp.raise_for_status()
+        except Exception:
+            logger.exception('HDFS response: ' + resp.text)
+            raise Exception('Error reading from HDFS, see log for details.')
+        return resp.content
+
     def deleteFile(self, file):
         """
         Only deletes the file if it is managed (i.e. not an imported file).
@@ -162,6 +197,18 @@ class HdfsAssetstoreAdapter(AbstractAssetstoreAdapter):
                 raise Exception('Failed to delete HDFS file %s: %s' % (
                     res['path'], res.get('error')))
 
+    def deleteFiles(self, files):
+        """
+        Deletes all of the managed files with a single request.
+        """
+        paths = [self._absPath(file) for file in files if not file['hdfs'].get('imported')]
+        if not paths:
+            return
+        for res in self.client.delete(paths):
+            if not res['result']:
+                raise Exception('Failed to delete HDFS file %s: %s' % (
+                    res['path'], res.get('error')))
+
     def initUpload(self, upload):
         uid = uuid.uuid4().hex
         relPath = posixpath.join(uid[0:2], uid[2:4], uid)
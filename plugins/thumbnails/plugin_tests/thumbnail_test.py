@@ -18,6 +18,7 @@
 ###############################################################################
 
 import json
+import mock
 import os
 import six
 import time
@@ -164,9 +165,23 @@ class ThumbnailsTestCase(base.TestCase):
         image = Image.open(six.BytesIO(data))
         self.assertEqual(image.size, (64, 32))
 
-        # Deleting the public folder should delete the thumbnail as well
+        # Attach a thumbnail to the item inside the folder as well
+        itemId = self.model('file').load(fileId, force=True)['itemId']
+        resp = self.request(
+            path='/thumbnail', method='POST', user=self.admin, params={
+                'width': 32,
+                'attachToId': str(itemId),
+                'attachToType': 'item',
+                'fileId': fileId
+            })
+        self.assertStatusOk(resp)
+        itemThumbnailId = self.model('item').load(itemId, force=True)['_thumbnails'][0]
+
+        # Deleting the public folder should delete the thumbnails as well,
+        # including those of items that are deleted in bulk
         self.model('folder').remove(self.publicFolder)
         self.assertEqual(self.model('file').load(thumbnailId), None)
+        self.assertEqual(self.model('file').load(itemThumbnailId), None)
 
     def testDicomThumbnailCreation(self):
         path = os.path.join(ROOT_DIR, 'plugins', 'thumbnails', 'plugin_tests', 'data',
@@ -368,3 +383,186 @@ class ThumbnailsTestCase(base.TestCase):
         file = self.model('file').load(item['_thumbnails'][0], force=True)
         with self.model('file').open(file) as fh:
             self.assertEqual(fh.read(2), b'\xff\xd8')  # jpeg magic number
+
+    def testBatchCreationOnUpload(self):
+        resp = self.request(
+            path='/file', method='POST', user=self.admin, params={
+                'parentType': 'folder',
+                'parentId': self.publicFolder['_id'],
+                'name': 'test.png',
+                'size': len(self.image),
+                'reference': json.dumps({
+                    'thumbnail': [{
+                        'width': 100
+                    }, {
+                        'width': 64,
+                        'height': 32
+                    }]
+                })
+            })
+        self.assertStatusOk(resp)
+
+        resp = self.request(
+            path='/file/chunk', method='POST', user=self.admin, body=self.image, params={
+                'offset': 0,
+                'uploadId': resp.json['_id']
+            }, type='image/png')
+        self.assertStatusOk(resp)
+        itemId = resp.json['itemId']
+
+        start = time.time()
+        while time.time() - start < 15:
+            # Wait for thumbnail creation
+            item = self.model('item').load(itemId, force=True)
+            if len(item.get('_thumbnails', ())) == 2:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(item['_thumbnails']), 2)
+
+        sizes = []
+        for thumbnailId in item['_thumbnails']:
+            file = self.model('file').load(thumbnailId, force=True)
+            with self.model('file').open(file) as fh:
+                sizes.append(Image.open(six.BytesIO(fh.read())).size)
+        self.assertEqual(sorted(sizes), [(64, 32), (100, 100)])
+        self.assertEqual(self.model('job', 'jobs').find({
+            'type': 'thumbnails.create', 'kwargs.sizes': {'$exists': True}
+        }).count(), 1)
+
+    def testDecodeThumbnails(self):
+        from girder.models.model_base import GirderException
+        from girder.plugins.thumbnails import worker
+
+        out = six.BytesIO()
+        Image.new('RGB', (2000, 1000), (255, 0, 0)).save(out, 'JPEG')
+
+        # The JPEG is decoded at 1/8 scale, which fits within the limit
+        out.seek(0)
+        thumbnails = worker.decodeThumbnails(out, [
+            {'width': 100, 'height': 0, 'crop': True},
+            {'width': 64, 'height': 64, 'crop': True}
+        ], maxPixels=500 * 500)
+        self.assertEqual([(image.size, width, height) for image, width, height in thumbnails], [
+            ((100, 50), 100, 50), ((64, 64), 64, 64)])
+
+        out.seek(0)
+        with six.assertRaisesRegex(self, GirderException, 'too large'):
+            worker.decodeThumbnails(out, [{'width': 1000, 'height': 0, 'crop': True}],
+                                    maxPixels=500 * 500)
+
+        class Pyramid(object):
+            levels = [(4000, 2000), (2000, 1000), (1000, 500), (500, 250), (200, 200)]
+            n_frames = len(levels)
+            frame = 0
+
+            def seek(self, frame):
+                self.frame = frame
+
+            @property
+            def size(self):
+                return self.levels[self.frame]
+
+        # The smallest level with the same aspect ratio that is large enough
+        pyramid = Pyramid()
+        worker._seekLevel(pyramid, (600, 300))
+        self.assertEqual(pyramid.frame, 2)
+        worker._seekLevel(pyramid, (100, 50))
+        self.assertEqual(pyramid.frame, 3)
+        worker._seekLevel(pyramid, (5000, 2500))
+        self.assertEqual(pyramid.frame, 0)
+
+    def _uploadImage(self, name):
+        resp = self.request(
+            path='/file', method='POST', user=self.admin, params={
+                'parentType': 'folder',
+                'parentId': self.publicFolder['_id'],
+                'name': name,
+                'size': len(self.image)
+            })
+        self.assertStatusOk(resp)
+        resp = self.request(
+            path='/file/chunk', method='POST', user=self.admin, body=self.image, params={
+                'offset': 0,
+                'uploadId': resp.json['_id']
+            }, type='image/png')
+        self.assertStatusOk(resp)
+        return resp.json
+
+    def _createThumbnail(self, file, width):
+        from girder.plugins.jobs.constants import JobStatus
+
+        resp = self.request(path='/thumbnail', method='POST', user=self.admin, params={
+            'fileId': file['_id'],
+            'width': width,
+            'attachToId': file['itemId'],
+            'attachToType': 'item'
+        })
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['status'], JobStatus.SUCCESS)
+        item = self.model('item').load(file['itemId'], force=True)
+        return self.model('file').load(item['_thumbnails'][-1], force=True)
+
+    def _imageSize(self, file):
+        with self.model('file').open(file) as fh:
+            return Image.open(six.BytesIO(fh.read())).size
+
+    def testThumbnailCache(self):
+        from girder.plugins.thumbnails.constants import PluginSettings
+
+        first = self._uploadImage('first.png')
+        second = self._uploadImage('second.png')
+        self.assertEqual(self.model('file').load(first['_id'], force=True)['sha512'],
+                         self.model('file').load(second['_id'], force=True)['sha512'])
+
+        thumbnail = self._createThumbnail(first, 64)
+        resp = self.request('/thumbnail/cache', user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['count'], 1)
+        self.assertEqual(resp.json['size'], thumbnail['size'])
+        self.assertEqual(resp.json['entries'][0]['params'], {
+            'width': 64, 'height': 0, 'crop': True})
+
+        resp = self.request('/thumbnail/cache', user=self.user)
+        self.assertStatus(resp, 403)
+
+        # A file with the same contents reuses the cached thumbnail
+        with mock.patch('girder.plugins.thumbnails.worker.renderThumbnails',
+                        side_effect=Exception('not cached')):
+            copy = self._createThumbnail(second, 64)
+        self.assertNotEqual(copy['_id'], thumbnail['_id'])
+        self.assertEqual(str(copy['derivedFrom']['id']), second['_id'])
+        self.assertEqual(str(copy['attachedToId']), second['itemId'])
+        self.assertEqual(self._imageSize(copy), (64, 64))
+        resp = self.request('/thumbnail/cache', user=self.admin)
+        self.assertEqual(resp.json['hits'], 1)
+
+        # Removing a thumbnail leaves the cache and other copies intact
+        self.model('file').remove(thumbnail)
+        self.assertEqual(self._imageSize(copy), (64, 64))
+        with mock.patch('girder.plugins.thumbnails.worker.renderThumbnails',
+                        side_effect=Exception('not cached')):
+            self._createThumbnail(first, 64)
+
+        # The least recently used entries are evicted beyond the maximum size
+        self.model('setting').set(PluginSettings.CACHE_MAX_SIZE, copy['size'] + 1)
+        small = self._createThumbnail(first, 32)
+        resp = self.request('/thumbnail/cache', user=self.admin)
+        self.assertEqual(resp.json['count'], 1)
+        self.assertEqual(resp.json['entries'][0]['params']['width'], 32)
+        self.assertEqual(self._imageSize(copy), (64, 64))
+
+        # Below the maximum size, the running total is used rather than
+        # computing the total size of the cache on each store
+        self.model('setting').set(PluginSettings.CACHE_MAX_SIZE, 1024 ** 3)
+        cacheModel = self.model('derived_artifact', 'thumbnails')
+        with mock.patch.object(cacheModel, 'totalSize', wraps=cacheModel.totalSize) as totalSize:
+            self._createThumbnail(first, 16)
+        self.assertFalse(totalSize.called)
+        self.assertEqual(cacheModel._estimateSize(), cacheModel.totalSize())
+
+        resp = self.request('/thumbnail/cache', method='DELETE', user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'removed': 2})
+        resp = self.request('/thumbnail/cache', user=self.admin)
+        self.assertEqual(resp.json['count'], 0)
+        self.assertEqual(self._imageSize(small), (32, 32))
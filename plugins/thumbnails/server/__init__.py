@@ -20,8 +20,41 @@
 import json
 from girder import events
 from girder.constants import AccessType
+from girder.models.model_base import ValidationException
+from girder.utility import setting_utilities
 from girder.utility.model_importer import ModelImporter
 from . import rest, utils
+from .constants import DEFAULT_CACHE_MAX_SIZE, DEFAULT_MAX_PIXELS, PluginSettings
+
+
+@setting_utilities.default(PluginSettings.MAX_PIXELS)
+def _defaultMaxPixels():
+    return DEFAULT_MAX_PIXELS
+
+
+@setting_utilities.validator(PluginSettings.MAX_PIXELS)
+def _validateMaxPixels(doc):
+    try:
+        doc['value'] = int(doc['value'])
+    except (ValueError, TypeError):
+        raise ValidationException('Maximum pixels must be an integer.', 'value')
+    if doc['value'] <= 0:
+        raise ValidationException('Maximum pixels must be positive.', 'value')
+
+
+@setting_utilities.default(PluginSettings.CACHE_MAX_SIZE)
+def _defaultCacheMaxSize():
+    return DEFAULT_CACHE_MAX_SIZE
+
+
+@setting_utilities.validator(PluginSettings.CACHE_MAX_SIZE)
+def _validateCacheMaxSize(doc):
+    try:
+        doc['value'] = int(doc['value'])
+    except (ValueError, TypeError):
+        raise ValidationException('Cache size must be an integer.', 'value')
+    if doc['value'] < 0:
+        raise ValidationException('Cache size must not be negative.', 'value')
 
 
 def removeThumbnails(event):
@@ -54,6 +87,25 @@ def removeThumbnailLink(event):
             model.save(resource, validate=False)
 
 
+def _thumbnailSize(spec):
+    """
+    Validate a thumbnail size requested on upload, returning None if it is not
+    valid.
+    """
+    if not isinstance(spec, dict):
+        return None
+
+    width = max(0, spec.get('width', 0))
+    height = max(0, spec.get('height', 0))
+
+    if not width and not height:
+        return None
+    if not isinstance(width, int) or not isinstance(height, int):
+        return None
+
+    return {'width': width, 'height': height, 'crop': bool(spec.get('crop', True))}
+
+
 def _onUpload(event):
     """
     Thumbnail creation can be requested on file upload by passing a reference field
@@ -68,6 +120,8 @@ def _onUpload(event):
         }
 
     At least one of ``width`` or ``height`` must be passed. The ``crop`` parameter is optional.
+    The ``thumbnail`` value may also be a list of such objects, in which case all of the
+    thumbnails are created by a single job that decodes the image once.
     """
     file = event.info['file']
     if 'itemId' not in file:
@@ -78,22 +132,25 @@ def _onUpload(event):
     except (ValueError, TypeError):
         return
 
-    if not isinstance(ref, dict) or not isinstance(ref.get('thumbnail'), dict):
+    if not isinstance(ref, dict):
         return
 
-    width = max(0, ref['thumbnail'].get('width', 0))
-    height = max(0, ref['thumbnail'].get('height', 0))
-
-    if not width and not height:
-        return
-    if not isinstance(width, int) or not isinstance(height, int):
+    specs = ref.get('thumbnail')
+    if not isinstance(specs, list):
+        specs = [specs]
+    sizes = [size for size in (_thumbnailSize(spec) for spec in specs) if size]
+    if not sizes:
         return
 
     item = ModelImporter.model('item').load(file['itemId'], force=True)
-    crop = bool(ref['thumbnail'].get('crop', True))
-    utils.scheduleThumbnailJob(
-        file=file, attachToType='item', attachToId=item['_id'], user=event.info['currentUser'],
-        width=width, height=height, crop=crop)
+    if len(sizes) == 1:
+        utils.scheduleThumbnailJob(
+            file=file, attachToType='item', attachToId=item['_id'],
+            user=event.info['currentUser'], **sizes[0])
+    else:
+        utils.scheduleThumbnailJob(
+            file=file, attachToType='item', attachToId=item['_id'],
+            user=event.info['currentUser'], sizes=sizes)
 
 
 def load(info):
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+class PluginSettings:
+    MAX_PIXELS = 'thumbnails.max_pixels'
+    CACHE_MAX_SIZE = 'thumbnails.cache_max_size'
+
+
+# The number of pixels that thumbnail creation decodes at most by default
+DEFAULT_MAX_PIXELS = 64 * 1024 * 1024
+
+# The total size in bytes of the cached thumbnails by default
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
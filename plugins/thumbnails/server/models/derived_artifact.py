@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import datetime
+import hashlib
+import json
+import pymongo
+import threading
+import time
+
+from girder.constants import SortDir
+from girder.models.model_base import Model
+from girder.plugins.thumbnails.constants import PluginSettings
+
+
+class DerivedArtifact(Model):
+    """
+    This model is a cache of files derived from the contents of other files,
+    such as thumbnails. Each entry is identified by the SHA-512 of its source,
+    the operation, and its parameters, so files with the same contents share
+    their derived files. The cached file is a copy that is attached to its
+    entry and references the same stored data. Once the total size exceeds the
+    ``thumbnails.cache_max_size`` setting, the least recently used entries are
+    evicted.
+
+    Rather than computing the total size on every store, each process keeps a
+    running total, which is computed again when it exceeds the maximum size or
+    is more than ``sizeRefreshInterval`` seconds old, to account for the
+    entries stored by other processes.
+    """
+    sizeRefreshInterval = 60
+
+    def initialize(self):
+        self.name = 'derived_artifact'
+        self.ensureIndices(['sourceSha512', 'lastUsed', ('key', {'unique': True})])
+        self._sizeLock = threading.Lock()
+        self._runningSize = None
+        self._runningSizeTime = 0
+
+    def validate(self, doc):
+        return doc
+
+    @staticmethod
+    def cacheKey(sourceSha512, operation, params):
+        """
+        Return the identifier of an entry.
+
+        :param sourceSha512: The SHA-512 of the contents of the source file.
+        :type sourceSha512: str
+        :param operation: The name of the operation, such as ``thumbnail``.
+        :type operation: str
+        :param params: The parameters of the operation.
+        :type params: dict
+        :rtype: str
+        """
+        return hashlib.sha256(json.dumps(
+            [sourceSha512, operation, params], sort_keys=True).encode('utf8')).hexdigest()
+
+    def lookup(self, sourceSha512, operation, params):
+        """
+        Find the cached file derived from some contents, recording its use.
+
+        :returns: The cached file document, or None if there is none.
+        """
+        entry = self.collection.find_one_and_update({
+            'key': self.cacheKey(sourceSha512, operation, params),
+            'fileId': {'$exists': True}
+        }, {
+            '$set': {'lastUsed': datetime.datetime.utcnow()},
+            '$inc': {'hits': 1}
+        }, return_document=pymongo.ReturnDocument.AFTER)
+        if entry is None:
+            return None
+
+        file = self.model('file').load(entry['fileId'], force=True)
+        if file is None:
+            self.remove(entry)
+        return file
+
+    def store(self, sourceSha512, operation, params, file):
+        """
+        Add a derived file to the cache, and evict entries if the cache has
+        grown too large. Nothing is stored if the cache is disabled or already
+        has an entry for the same source, operation, and parameters.
+
+        :param file: The derived file, which is copied into the cache.
+        :type file: dict
+        :returns: The new entry, or None.
+        """
+        maxSize = self.model('setting').get(PluginSettings.CACHE_MAX_SIZE)
+        if not maxSize or file['size'] > maxSize:
+            return None
+
+        now = datetime.datetime.utcnow()
+        try:
+            entry = self.save({
+                'key': self.cacheKey(sourceSha512, operation, params),
+                'sourceSha512': sourceSha512,
+                'operation': operation,
+                'params': params,
+                'size': file['size'],
+                'created': now,
+                'lastUsed': now,
+                'hits': 0
+            })
+        except pymongo.errors.DuplicateKeyError:
+            # Another job stored the same file first
+            return None
+        self._addSize(file['size'])
+
+        blob = self.copyArtifact(file)
+        blob['attachedToType'] = ['derived_artifact', 'thumbnails']
+        blob['attachedToId'] = entry['_id']
+        blob = self.model('file').save(blob)
+        entry['fileId'] = blob['_id']
+        self.update({'_id': entry['_id']}, {'$set': {'fileId': blob['_id']}})
+
+        self.evict(maxSize)
+        return entry
+
+    def copyArtifact(self, file):
+        """
+        Copy a cached or derived file so that the copy references the same
+        stored data. The copy is not saved, and is not attached to anything.
+
+        :param file: The file to copy.
+        :type file: dict
+        :returns: The unsaved file document.
+        """
+        copy = {k: v for k, v in file.items() if k not in (
+            '_id', 'itemId', 'attachedToType', 'attachedToId', 'isThumbnail')}
+        copy['created'] = datetime.datetime.utcnow()
+        self.model('file').getAssetstoreAdapter(copy).copyFile(file, copy)
+        return copy
+
+    def remove(self, entry, **kwargs):
+        """
+        Remove an entry and its cached file. The stored data is only deleted if
+        no other file references it.
+        """
+        result = super(DerivedArtifact, self).remove(entry, **kwargs)
+        if result is not None and result.deleted_count:
+            self._addSize(-entry['size'])
+        if entry.get('fileId'):
+            file = self.model('file').load(entry['fileId'], force=True)
+            if file is not None:
+                self.model('file').remove(file)
+
+    def evict(self, maxSize):
+        """
+        Remove the least recently used entries until the total size of the
+        cache is at most ``maxSize`` bytes. The total size is only computed
+        when the running total exceeds ``maxSize``.
+
+        :returns: The number of entries that were removed.
+        """
+        removed = 0
+        if self._estimateSize() <= maxSize:
+            return removed
+        excess = self._estimateSize(refresh=True) - maxSize
+        if excess <= 0:
+            return removed
+
+        for entry in self.find({}, sort=[('lastUsed', SortDir.ASCENDING)]):
+            self.remove(entry)
+            removed += 1
+            excess -= entry['size']
+            if excess <= 0:
+                break
+        return removed
+
+    def purge(self, sourceSha512=None):
+        """
+        Remove entries from the cache.
+
+        :param sourceSha512: If set, only remove the entries derived from
+            contents with this SHA-512.
+        :type sourceSha512: str or None
+        :returns: The number of entries that were removed.
+        """
+        query = {'sourceSha512': sourceSha512} if sourceSha512 else {}
+        removed = 0
+        for entry in self.find(query):
+            self.remove(entry)
+            removed += 1
+        return removed
+
+    def _addSize(self, size):
+        with self._sizeLock:
+            if self._runningSize is not None:
+                self._runningSize += size
+
+    def _estimateSize(self, refresh=False):
+        """
+        Return the running total of the size of the cache, computing it again
+        with :py:meth:`totalSize` if requested or if it is out of date.
+        """
+        now = time.time()
+        with self._sizeLock:
+            if (not refresh and self._runningSize is not None and
+                    now - self._runningSizeTime < self.sizeRefreshInterval):
+                return self._runningSize
+        size = self.totalSize()
+        with self._sizeLock:
+            self._runningSize = size
+            self._runningSizeTime = now
+        return size
+
+    def totalSize(self):
+        """
+        Return the total size of the cached files in bytes.
+        """
+        result = list(self.collection.aggregate([
+            {'$group': {'_id': None, 'size': {'$sum': '$size'}}}
+        ]))
+        return result[0]['size'] if result else 0
+
+    def stats(self):
+        """
+        Return the number of entries, their total size and number of hits,
+        and the maximum size of the cache.
+        """
+        result = list(self.collection.aggregate([{'$group': {
+            '_id': None,
+            'count': {'$sum': 1},
+            'size': {'$sum': '$size'},
+            'hits': {'$sum': '$hits'}
+        }}]))
+        stats = result[0] if result else {'count': 0, 'size': 0, 'hits': 0}
+        stats.pop('_id', None)
+        stats['maxSize'] = self.model('setting').get(PluginSettings.CACHE_MAX_SIZE)
+        return stats
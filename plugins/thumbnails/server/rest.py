@@ -20,7 +20,7 @@
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
 from girder.api.rest import filtermodel, Resource, RestException
-from girder.constants import AccessType
+from girder.constants import AccessType, SortDir
 from . import utils
 
 
@@ -29,6 +29,8 @@ class Thumbnail(Resource):
         super(Thumbnail, self).__init__()
         self.resourceName = 'thumbnail'
         self.route('POST', (), self.createThumbnail)
+        self.route('GET', ('cache',), self.getCache)
+        self.route('DELETE', ('cache',), self.purgeCache)
 
     @access.user
     @filtermodel(model='job', plugin='jobs')
@@ -63,3 +65,33 @@ class Thumbnail(Resource):
             raise RestException('You must specify a valid width, height, or both.')
 
         return utils.scheduleThumbnailJob(file, attachToType, attachToId, user, width, height, crop)
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get statistics about the cache of thumbnails and list its entries.')
+        .notes('Must be a system administrator to call this. Thumbnails are cached by the '
+               'SHA-512 of the contents of their source file and their size, so files with '
+               'the same contents share them.')
+        .param('sourceSha512', 'Only list the entries derived from contents with this '
+               'SHA-512.', required=False)
+        .pagingParams(defaultSort='lastUsed', defaultSortDir=SortDir.DESCENDING)
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def getCache(self, sourceSha512, limit, offset, sort):
+        cacheModel = self.model('derived_artifact', 'thumbnails')
+        query = {'sourceSha512': sourceSha512} if sourceSha512 else {}
+        stats = cacheModel.stats()
+        stats['entries'] = list(cacheModel.find(query, limit=limit, offset=offset, sort=sort))
+        return stats
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Remove entries from the cache of thumbnails.')
+        .notes('Must be a system administrator to call this. Thumbnails that have been '
+               'attached to resources are not affected.')
+        .param('sourceSha512', 'Only remove the entries derived from contents with this '
+               'SHA-512.', required=False)
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def purgeCache(self, sourceSha512):
+        return {'removed': self.model('derived_artifact', 'thumbnails').purge(sourceSha512)}
@@ -1,20 +1,27 @@
 from girder.utility.model_importer import ModelImporter
 
 
-def scheduleThumbnailJob(file, attachToType, attachToId, user, width=0, height=0, crop=True):
+def scheduleThumbnailJob(file, attachToType, attachToId, user, width=0, height=0, crop=True,
+                         sizes=None):
     """
-    Schedule a local thumbnail creation job and return it.
+    Schedule a local thumbnail creation job and return it. If ``sizes`` is
+    passed, it is a list of dicts with the ``width``, ``height``, and ``crop``
+    of several thumbnails, which are all created from a single decode of the
+    image.
     """
+    kwargs = {
+        'fileId': str(file['_id']),
+        'attachToType': attachToType,
+        'attachToId': str(attachToId)
+    }
+    if sizes:
+        kwargs['sizes'] = sizes
+    else:
+        kwargs.update(width=width, height=height, crop=crop)
+
     jm = ModelImporter.model('job', 'jobs')
     job = jm.createLocalJob(
         title='Generate thumbnail for %s' % file['name'], user=user, type='thumbnails.create',
-        public=False, module='girder.plugins.thumbnails.worker', kwargs={
-            'fileId': str(file['_id']),
-            'width': width,
-            'height': height,
-            'crop': crop,
-            'attachToType': attachToType,
-            'attachToId': str(attachToId)
-        })
+        public=False, module='girder.plugins.thumbnails.worker', kwargs=kwargs)
     jm.scheduleJob(job)
     return job
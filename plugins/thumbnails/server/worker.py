@@ -18,17 +18,24 @@
 ###############################################################################
 
 from bson.objectid import ObjectId
+import collections
 import functools
+import math
 import six
 import sys
+import tempfile
 import traceback
 import dicom
 import numpy as np
 
 from girder import events
+from girder.models.model_base import GirderException
 from girder.plugins.jobs.constants import JobStatus
+from girder.utility import assetstore_utilities
+from girder.utility.filesystem_assetstore_adapter import FilesystemAssetstoreAdapter
 from girder.utility.model_importer import ModelImporter
 from PIL import Image
+from .constants import PluginSettings
 
 
 def run(job):
@@ -36,8 +43,13 @@ def run(job):
     jobModel.updateJob(job, status=JobStatus.RUNNING)
 
     try:
-        newFile = createThumbnail(**job['kwargs'])
-        log = 'Created thumbnail file %s.' % newFile['_id']
+        if 'sizes' in job['kwargs']:
+            newFiles = createThumbnails(**job['kwargs'])
+            log = 'Created thumbnail files %s.' % ', '.join(
+                str(newFile['_id']) for newFile in newFiles)
+        else:
+            newFile = createThumbnail(**job['kwargs'])
+            log = 'Created thumbnail file %s.' % newFile['_id']
         jobModel.updateJob(job, status=JobStatus.SUCCESS, log=log)
     except Exception:
         t, val, tb = sys.exc_info()
@@ -51,63 +63,121 @@ def createThumbnail(width, height, crop, fileId, attachToType, attachToId):
     Creates the thumbnail. Validation and access control must be done prior
     to the invocation of this method.
     """
-    fileModel = ModelImporter.model('file')
-    file = fileModel.load(fileId, force=True)
-    streamFn = functools.partial(fileModel.download, file, headers=False)
-
-    event = events.trigger('thumbnails.create', info={
-        'file': file,
+    return createThumbnails([{
         'width': width,
         'height': height,
-        'crop': crop,
-        'attachToType': attachToType,
-        'attachToId': attachToId,
-        'streamFn': streamFn
-    })
+        'crop': crop
+    }], fileId, attachToType, attachToId)[0]
+
 
-    if len(event.responses):
-        resp = event.responses[-1]
-        newFile = resp['file']
+def createThumbnails(sizes, fileId, attachToType, attachToId):
+    """
+    Creates thumbnails of several sizes from the same file, decoding the image
+    only once. Validation and access control must be done prior to the
+    invocation of this method.
 
-        if event.defaultPrevented:
-            if resp.get('attach', True):
-                newFile = attachThumbnail(
-                    file, newFile, attachToType, attachToId, width, height)
-            return newFile
+    :param sizes: The ``width``, ``height``, and ``crop`` of each thumbnail.
+    :type sizes: list of dict
+    :returns: The thumbnail file documents, in the order of ``sizes``.
+    """
+    file = ModelImporter.model('file').load(fileId, force=True)
+    thumbnails = [None] * len(sizes)
+    # The sizes to render from each source file, which handlers of the
+    # thumbnails.create event may replace
+    sources = collections.OrderedDict()
+
+    for index, size in enumerate(sizes):
+        source, thumbnail = _triggerCreate(file, size, attachToType, attachToId)
+        if thumbnail is not None:
+            thumbnails[index] = thumbnail
         else:
-            file = newFile
-            streamFn = functools.partial(
-                fileModel.download, file, headers=False)
+            sources.setdefault(source['_id'], (source, []))[1].append(index)
+
+    for source, indices in six.viewvalues(sources):
+        if 'assetstoreId' not in source:
+            # TODO we could thumbnail link files if we really wanted.
+            raise Exception('File %s has no assetstore.' % fileId)
+
+        pending = []
+        for index in indices:
+            thumbnails[index] = _cachedThumbnail(source, sizes[index], attachToType, attachToId)
+            if thumbnails[index] is None:
+                pending.append(index)
+        if not pending:
+            continue
+
+        images = renderThumbnails(source, [sizes[index] for index in pending])
+        for index, (image, width, height) in zip(pending, images):
+            thumbnails[index] = _saveThumbnail(
+                source, image, attachToType, attachToId, width, height)
+            if source.get('sha512'):
+                ModelImporter.model('derived_artifact', 'thumbnails').store(
+                    source['sha512'], 'thumbnail', _cacheParams(sizes[index]),
+                    thumbnails[index])
+
+    return thumbnails
+
+
+def _cacheParams(size):
+    return {
+        'width': size['width'],
+        'height': size['height'],
+        'crop': bool(size['crop'])
+    }
 
-    if 'assetstoreId' not in file:
-        # TODO we could thumbnail link files if we really wanted.
-        raise Exception('File %s has no assetstore.' % fileId)
 
-    stream = streamFn()
-    data = b''.join(stream())
+def _cachedThumbnail(file, size, attachToType, attachToId):
+    """
+    Create a thumbnail from a copy of a cached thumbnail of the same contents,
+    if there is one, without reading the file.
+    """
+    if not file.get('sha512'):
+        return None
 
-    image = _getImage(file['mimeType'], file['exts'], data)
+    cacheModel = ModelImporter.model('derived_artifact', 'thumbnails')
+    cached = cacheModel.lookup(file['sha512'], 'thumbnail', _cacheParams(size))
+    if cached is None:
+        return None
 
-    if not width:
-        width = int(height * image.size[0] / image.size[1])
-    elif not height:
-        height = int(width * image.size[1] / image.size[0])
-    elif crop:
-        x1 = y1 = 0
-        x2, y2 = image.size
-        wr = float(image.size[0]) / width
-        hr = float(image.size[1]) / height
+    thumbnail = ModelImporter.model('file').save(cacheModel.copyArtifact(cached))
+    return attachThumbnail(
+        file, thumbnail, attachToType, attachToId,
+        cached['derivedFrom']['width'], cached['derivedFrom']['height'])
 
-        if hr > wr:
-            y1 = int(y2 / 2 - height * wr / 2)
-            y2 = int(y2 / 2 + height * wr / 2)
-        else:
-            x1 = int(x2 / 2 - width * hr / 2)
-            x2 = int(x2 / 2 + width * hr / 2)
-        image = image.crop((x1, y1, x2, y2))
 
-    image.thumbnail((width, height), Image.ANTIALIAS)
+def _triggerCreate(file, size, attachToType, attachToId):
+    """
+    Let handlers of the ``thumbnails.create`` event create a thumbnail, or
+    replace the file it is made from. Returns the source file and the
+    thumbnail, if a handler created it.
+    """
+    streamFn = functools.partial(ModelImporter.model('file').download, file, headers=False)
+
+    event = events.trigger('thumbnails.create', info={
+        'file': file,
+        'width': size['width'],
+        'height': size['height'],
+        'crop': size['crop'],
+        'attachToType': attachToType,
+        'attachToId': attachToId,
+        'streamFn': streamFn
+    })
 
+    if not len(event.responses):
+        return file, None
+
+    resp = event.responses[-1]
+    newFile = resp['file']
+
+    if not event.defaultPrevented:
+        return newFile, None
+    if resp.get('attach', True):
+        newFile = attachThumbnail(
+            file, newFile, attachToType, attachToId, size['width'], size['height'])
+    return file, newFile
+
+
+def _saveThumbnail(file, image, attachToType, attachToId, width, height):
     uploadModel = ModelImporter.model('upload')
 
     out = six.BytesIO()
@@ -163,20 +233,184 @@ def attachThumbnail(file, thumbnail, attachToType, attachToId, width, height):
     return ModelImporter.model('file').save(thumbnail)
 
 
-def _getImage(mimeType, extension, data):
+def renderThumbnails(file, sizes, maxPixels=None):
     """
-    Check extension of image and opens it.
+    Render thumbnails of several sizes from a file, which is read in place
+    rather than loaded into memory. Files in filesystem assetstores are opened
+    directly, and others are read with random access through ``File.open``.
+    DICOM and TIFF files in other assetstores are first copied to a temporary
+    file on disk, since their readers need a real file.
 
-    :param extension: The extension of the image that needs to be opened.
-    :param data: The image file stream.
+    :param file: The image file.
+    :type file: dict
+    :param sizes: The ``width``, ``height``, and ``crop`` of each thumbnail.
+    :type sizes: list of dict
+    :param maxPixels: The maximum number of pixels to decode, or None to use
+        the ``thumbnails.max_pixels`` setting.
+    :type maxPixels: int or None
+    :returns: A list of the thumbnail image, width, and height of each size.
+    """
+    if maxPixels is None:
+        maxPixels = ModelImporter.model('setting').get(PluginSettings.MAX_PIXELS)
+
+    exts = file.get('exts') or ['']
+    isDicom = exts[-1] == 'dcm' or file.get('mimeType') == 'application/dicom'
+    isTiff = exts[-1] in ('tif', 'tiff') or file.get('mimeType') == 'image/tiff'
+
+    with _openFile(file, spool=isDicom or isTiff) as handle:
+        return decodeThumbnails(handle, sizes, maxPixels, isDicom=isDicom)
+
+
+def decodeThumbnails(handle, sizes, maxPixels, isDicom=False):
+    """
+    Decode an image once and render thumbnails of several sizes from it. Only
+    as much of the image as the largest thumbnail needs is decoded: JPEG
+    images are decoded at a reduced scale, and the smallest sufficient page of
+    a multi-page TIFF image, such as a level of a pyramid or an embedded
+    thumbnail, is used.
+
+    :param handle: The image, opened as a seekable file-like object.
+    :param sizes: The ``width``, ``height``, and ``crop`` of each thumbnail.
+    :type sizes: list of dict
+    :param maxPixels: The maximum number of pixels to decode. Larger images
+        raise an exception instead.
+    :type maxPixels: int
+    :param isDicom: Whether the image is a DICOM file.
+    :type isDicom: bool
+    :returns: A list of the thumbnail image, width, and height of each size.
     """
-    if (extension and extension[-1] == 'dcm') or mimeType == 'application/dicom':
-        # Open the dicom image
-        dicomData = dicom.read_file(six.BytesIO(data))
-        return scaleDicomLevels(dicomData)
+    if isDicom:
+        image = _readDicom(handle, maxPixels)
+        fullSize = image.size
     else:
-        # Open other types of images
-        return Image.open(six.BytesIO(data))
+        image = Image.open(handle)
+        fullSize = image.size
+        image = _decode(image, _decodeSize(fullSize, sizes), maxPixels)
+
+    return [_thumbnail(image, fullSize, size) for size in sizes]
+
+
+def _openFile(file, spool=False):
+    """
+    Open a file for random access, copying it to a temporary file if
+    ``spool`` is set and it is not in a filesystem assetstore.
+    """
+    assetstore = ModelImporter.model('assetstore').load(file['assetstoreId'])
+    adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+    if isinstance(adapter, FilesystemAssetstoreAdapter):
+        return open(adapter.fullPath(file), 'rb')
+    if not spool:
+        return ModelImporter.model('file').open(file)
+
+    handle = tempfile.TemporaryFile()
+    for chunk in ModelImporter.model('file').download(file, headers=False)():
+        handle.write(chunk)
+    handle.seek(0)
+    return handle
+
+
+def _targetSize(fullSize, size):
+    """
+    Return the width and height of a thumbnail, computing a missing one from
+    the aspect ratio of the image.
+    """
+    width, height = size['width'], size['height']
+    if not width:
+        width = int(height * fullSize[0] / fullSize[1])
+    elif not height:
+        height = int(width * fullSize[1] / fullSize[0])
+    return width, height
+
+
+def _decodeSize(fullSize, sizes):
+    """
+    Return the smallest size the image can be decoded at to render all of the
+    thumbnails without enlarging it.
+    """
+    scale = 0
+    for size in sizes:
+        width, height = _targetSize(fullSize, size)
+        scales = (float(width) / fullSize[0], float(height) / fullSize[1])
+        if size['crop'] and size['width'] and size['height']:
+            scale = max(scale, max(scales))
+        else:
+            scale = max(scale, min(scales))
+    scale = min(scale, 1)
+    return (max(int(math.ceil(fullSize[0] * scale)), 1),
+            max(int(math.ceil(fullSize[1] * scale)), 1))
+
+
+def _decode(image, target, maxPixels):
+    """
+    Decode an image at a reduced resolution that is at least as large as
+    ``target``, if its format supports one.
+    """
+    if image.format == 'TIFF':
+        _seekLevel(image, target)
+    elif image.format == 'JPEG':
+        image.draft(image.mode, target)
+
+    if image.size[0] * image.size[1] > maxPixels:
+        raise GirderException(
+            'The image is too large to create a thumbnail (%d x %d pixels).' % image.size)
+    image.load()
+    return image
+
+
+def _seekLevel(image, target):
+    """
+    Select the smallest page of a multi-page TIFF image that is at least as
+    large as ``target`` and has the same aspect ratio as the first page.
+    """
+    image.seek(0)
+    width, height = image.size
+    best, bestPixels = 0, width * height
+    for frame in range(1, getattr(image, 'n_frames', 1)):
+        image.seek(frame)
+        w, h = image.size
+        if (w >= target[0] and h >= target[1] and w * h < bestPixels and
+                abs(float(w) / h - float(width) / height) < 0.02 * width / height):
+            best, bestPixels = frame, w * h
+    image.seek(best)
+
+
+def _thumbnail(image, fullSize, size):
+    """
+    Render a thumbnail from an image that may have been decoded at a reduced
+    resolution, cropping it as the original image would have been.
+    """
+    width, height = _targetSize(fullSize, size)
+
+    if size['crop'] and size['width'] and size['height']:
+        x1 = y1 = 0
+        x2, y2 = image.size
+        wr = float(image.size[0]) / width
+        hr = float(image.size[1]) / height
+
+        if hr > wr:
+            y1 = int(y2 / 2 - height * wr / 2)
+            y2 = int(y2 / 2 + height * wr / 2)
+        else:
+            x1 = int(x2 / 2 - width * hr / 2)
+            x2 = int(x2 / 2 + width * hr / 2)
+        thumbnail = image.crop((x1, y1, x2, y2))
+    else:
+        thumbnail = image.copy()
+
+    thumbnail.thumbnail((width, height), Image.ANTIALIAS)
+    return thumbnail, width, height
+
+
+def _readDicom(handle, maxPixels):
+    """
+    Read a DICOM image and adjust its levels, unless it is too large.
+    """
+    dicomData = dicom.read_file(handle)
+    if dicomData.Rows * dicomData.Columns > maxPixels:
+        raise GirderException(
+            'The image is too large to create a thumbnail (%d x %d pixels).' % (
+                dicomData.Columns, dicomData.Rows))
+    return scaleDicomLevels(dicomData)
 
 
 def scaleDicomLevels(dicomData):
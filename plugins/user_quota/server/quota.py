@@ -26,7 +26,7 @@ from girder.api.describe import Description, autoDescribeRoute
 from girder.api.rest import Resource, RestException
 from girder.constants import AccessType
 from girder.models.model_base import GirderException, ValidationException
-from girder.utility import assetstore_utilities
+from girder.utility import assetstore_utilities, size_accounting
 from girder.utility.system import formatSize
 from . import constants
 
@@ -372,17 +372,19 @@ class QuotaPolicy(Resource):
         fileSizeQuota = self._getFileSizeQuota(model, resource)
         if not fileSizeQuota:
             return None
-        newSize = resource['size'] + upload['size'] - origSize
+        # Include size changes that have not been written to the database yet
+        usedSize = resource['size'] + size_accounting.pending(model, resource['_id'])
+        newSize = usedSize + upload['size'] - origSize
         # always allow replacement with a smaller object
         if newSize <= fileSizeQuota or upload['size'] < origSize:
             return None
-        left = fileSizeQuota - resource['size']
+        left = fileSizeQuota - usedSize
         if left < 0:
             left = 0
         return {'fileSizeQuota': fileSizeQuota,
                 'sizeNeeded': upload['size'] - origSize,
                 'quotaLeft': left,
-                'quotaUsed': resource['size']}
+                'quotaUsed': usedSize}
 
     def checkUploadStart(self, event):
         """
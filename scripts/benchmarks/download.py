@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Measure the throughput of concurrent downloads of one file from one or more
+Girder API URLs.
+
+To compare file delivery modes, pass the API URL of a Girder server that
+streams files itself and the API URL of the same server behind a front-end
+server that uses X-Accel-Redirect or X-Sendfile::
+
+    python scripts/benchmarks/download.py --token <token> --file <file id> \\
+        stream=http://localhost:8080/api/v1 \\
+        x-accel-redirect=http://localhost/girder/api/v1
+"""
+
+import argparse
+import threading
+import time
+
+import requests
+
+
+def download(session, url, token, rangeSize):
+    headers = {'Girder-Token': token}
+    if rangeSize:
+        headers['Range'] = 'bytes=0-%d' % (rangeSize - 1)
+    resp = session.get(url, headers=headers, stream=True)
+    resp.raise_for_status()
+    received = 0
+    for chunk in resp.iter_content(chunk_size=1024 * 1024):
+        received += len(chunk)
+    return received
+
+
+def benchmark(apiUrl, args):
+    url = '%s/file/%s/download' % (apiUrl.rstrip('/'), args.file)
+    counts = [args.requests // args.concurrency] * args.concurrency
+    for index in range(args.requests % args.concurrency):
+        counts[index] += 1
+    received = []
+    errors = []
+
+    def worker(count):
+        session = requests.Session()
+        try:
+            for _ in range(count):
+                received.append(download(session, url, args.token, args.range))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(count, )) for count in counts]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if errors:
+        raise errors[0]
+    return sum(received), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('urls', nargs='+', metavar='LABEL=URL',
+                        help='the labeled API URLs to download from')
+    parser.add_argument('--token', required=True,
+                        help='a token with read access to the file')
+    parser.add_argument('--file', required=True,
+                        help='the id of the file to download')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='number of downloads from each URL')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of downloads in progress at once')
+    parser.add_argument('--range', type=int, default=0,
+                        help='download only this many bytes with a Range header')
+    args = parser.parse_args()
+
+    print('%-20s %14s %10s %10s %12s' % (
+        'mode', 'bytes', 'seconds', 'requests/s', 'MB/s'))
+    for labeledUrl in args.urls:
+        label, _, apiUrl = labeledUrl.partition('=')
+        if not apiUrl or '://' in label:
+            label, apiUrl = labeledUrl, labeledUrl
+        size, elapsed = benchmark(apiUrl, args)
+        print('%-20s %14d %10.3f %10.1f %12.1f' % (
+            label, size, elapsed, args.requests / elapsed,
+            size / elapsed / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
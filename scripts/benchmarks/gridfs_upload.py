@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Measure the throughput of writing uploads to a GridFS assetstore, with one
+insert per chunk and a lookup of the last chunk on every request as uploads
+used to be written, and with batched inserts.
+
+This uses the MongoDB server configured for Girder and writes to a scratch
+database that is dropped afterwards::
+
+    python scripts/benchmarks/gridfs_upload.py --size 256 --request-size 64
+"""
+
+import argparse
+import os
+import time
+
+from girder.models import getDbConnection
+from girder.utility import config
+from girder.utility.gridfs_assetstore_adapter import GridFsAssetstoreAdapter
+
+DATABASE = 'girder_benchmark_gridfs_upload'
+
+
+def upload(adapter, size, requestSize, legacy):
+    data = os.urandom(requestSize)
+    record = adapter.initUpload({'size': size, 'received': 0})
+    if legacy:
+        # Without the recorded chunk count, each request looks up the last chunk
+        del record['chunkCount']
+    start = time.time()
+    while record['received'] < size:
+        record = adapter.uploadChunk(record, data[:size - record['received']])
+    elapsed = time.time() - start
+    adapter.cancelUpload(record)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--size', type=int, default=256,
+                        help='size of each upload in MB')
+    parser.add_argument('--request-size', type=int, default=64,
+                        help='size of the data sent with each request in MB')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='number of chunks written with each insert_many')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of uploads in each mode')
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    requestSize = args.request_size * 1024 * 1024
+    dbConfig = config.getConfig()['database']
+    getDbConnection().drop_database(DATABASE)
+    adapter = GridFsAssetstoreAdapter({'_id': None, 'db': DATABASE})
+
+    print('%-10s %10s %12s' % ('mode', 'seconds', 'MB/s'))
+    try:
+        for label, batchSize, legacy in (
+                ('unbatched', 1, True), ('batched', args.batch_size, False)):
+            dbConfig['gridfs_insert_batch_size'] = batchSize
+            elapsed = min(upload(adapter, size, requestSize, legacy)
+                          for _ in range(args.repeat))
+            print('%-10s %10.3f %12.1f' % (label, elapsed, args.size / elapsed))
+    finally:
+        getDbConnection().drop_database(DATABASE)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Count the MongoDB commands issued by the setting lookups that a typical REST
+request performs, with and without the in-process setting cache.
+
+This uses the database configured for Girder, so point GIRDER_MONGO_URI at a
+scratch database before running it::
+
+    GIRDER_MONGO_URI=mongodb://localhost:27017/girder_bench \\
+        python scripts/benchmarks/setting_cache.py --requests 1000
+"""
+
+import argparse
+import time
+
+import pymongo.monitoring
+
+
+class CommandCounter(pymongo.monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# The listener must be registered before Girder opens its database connection.
+counter = CommandCounter()
+pymongo.monitoring.register(counter)
+
+from girder.constants import SettingKey  # noqa: E402
+from girder.utility import config  # noqa: E402
+from girder.utility.model_importer import ModelImporter  # noqa: E402
+
+# Settings that are read while serving a typical REST request
+REQUEST_SETTINGS = (
+    SettingKey.CORS_ALLOW_ORIGIN,
+    SettingKey.CORS_ALLOW_METHODS,
+    SettingKey.CORS_ALLOW_HEADERS,
+    SettingKey.COOKIE_LIFETIME,
+    SettingKey.SECURE_COOKIE,
+    SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE,
+    SettingKey.PLUGINS_ENABLED
+)
+
+
+def simulateRequests(settingModel, requests):
+    counter.count = 0
+    start = time.time()
+    for _ in range(requests):
+        for key in REQUEST_SETTINGS:
+            settingModel.get(key)
+    return counter.count, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='number of requests to simulate')
+    args = parser.parse_args()
+
+    cacheConfig = config.getConfig().setdefault('cache', {})
+    settingModel = ModelImporter.model('setting')
+    settingModel.set(SettingKey.COOKIE_LIFETIME, 30)
+
+    results = []
+    for label, ttl in (('uncached', 0), ('cached', 60)):
+        cacheConfig['setting_ttl'] = ttl
+        settingModel.clearCache()
+        commands, elapsed = simulateRequests(settingModel, args.requests)
+        results.append((label, commands, elapsed))
+
+    print('%-10s %12s %14s %12s' % ('mode', 'commands', 'per request', 'seconds'))
+    for label, commands, elapsed in results:
+        print('%-10s %12d %14.3f %12.3f' % (
+            label, commands, float(commands) / args.requests, elapsed))
+
+
+if __name__ == '__main__':
+    main()
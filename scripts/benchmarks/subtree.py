@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Compare the recursive, $graphLookup, and materialized ancestor implementations
+of folder subtree size and count on a generated folder hierarchy.
+
+This generates its data in the database configured for Girder, so point
+GIRDER_MONGO_URI at a scratch database before running it::
+
+    GIRDER_MONGO_URI=mongodb://localhost:27017/girder_bench \\
+        python scripts/benchmarks/subtree.py --levels 10 --folders 50000
+"""
+
+import argparse
+import datetime
+import time
+
+from bson.objectid import ObjectId
+
+from girder.constants import AccessType
+from girder.utility.model_importer import ModelImporter
+
+
+def levelSizes(levels, folders):
+    """
+    Find the number of folders at each depth of a tree with a roughly constant
+    branching factor and the requested total number of folders.
+    """
+    low, high = 1.0, float(folders)
+    for _ in range(100):
+        branching = (low + high) / 2
+        if sum(branching ** depth for depth in range(1, levels + 1)) > folders:
+            high = branching
+        else:
+            low = branching
+    sizes = [max(1, int(round(low ** depth))) for depth in range(1, levels + 1)]
+    sizes[-1] += folders - sum(sizes)
+    return sizes
+
+
+def generateTree(user, levels, folders, itemsPerFolder):
+    folderModel = ModelImporter.model('folder')
+    itemModel = ModelImporter.model('item')
+    now = datetime.datetime.utcnow()
+    access = {'users': [{'id': user['_id'], 'level': AccessType.ADMIN, 'flags': []}],
+              'groups': []}
+    root = folderModel.createFolder(user, 'benchmark root', parentType='user', creator=user)
+
+    parents = [root]
+    for size in levelSizes(levels, folders):
+        docs = []
+        for index in range(size):
+            parent = parents[index % len(parents)]
+            docs.append({
+                '_id': ObjectId(),
+                'name': 'folder %d' % index,
+                'lowerName': 'folder %d' % index,
+                'parentId': parent['_id'],
+                'parentCollection': 'folder',
+                'ancestors': parent['ancestors'] + [parent['_id']],
+                'baseParentType': 'user',
+                'baseParentId': user['_id'],
+                'creatorId': user['_id'],
+                'created': now,
+                'updated': now,
+                'size': itemsPerFolder,
+                'public': False,
+                'access': access,
+                'description': ''
+            })
+        folderModel.collection.insert_many(docs)
+        if itemsPerFolder:
+            itemModel.collection.insert_many([{
+                'name': 'item %d' % index,
+                'lowerName': 'item %d' % index,
+                'folderId': folder['_id'],
+                'ancestors': folder['ancestors'] + [folder['_id']],
+                'baseParentType': 'user',
+                'baseParentId': user['_id'],
+                'creatorId': user['_id'],
+                'created': now,
+                'updated': now,
+                'size': 1,
+                'description': ''
+            } for folder in docs for index in range(itemsPerFolder)])
+        parents = docs
+    return root
+
+
+def timeIt(func):
+    start = time.time()
+    result = func()
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--levels', type=int, default=10,
+                        help='depth of the generated hierarchy')
+    parser.add_argument('--folders', type=int, default=50000,
+                        help='total number of generated folders')
+    parser.add_argument('--items', type=int, default=1,
+                        help='number of items in each generated folder')
+    args = parser.parse_args()
+
+    folderModel = ModelImporter.model('folder')
+    userModel = ModelImporter.model('user')
+    user = userModel.findOne({'login': 'subtreebenchmark'}) or userModel.createUser(
+        login='subtreebenchmark', password='password', firstName='Subtree',
+        lastName='Benchmark', email='subtreebenchmark@example.com')
+    # The first user created is an admin, which would bypass permission checks.
+    user = userModel.save(dict(user, admin=False))
+    root = generateTree(user, args.levels, args.folders, args.items)
+
+    modes = (
+        ('recursive', False, False),
+        ('graphLookup', True, False),
+        ('ancestors', True, True)
+    )
+    print('%-12s %10s %10s %10s %18s' % (
+        'mode', 'size', 'count', 'seconds', 'filtered seconds'))
+    try:
+        for label, graphLookup, ancestors in modes:
+            if label == 'graphLookup' and not folderModel.supportsGraphLookup():
+                continue
+            folderModel._graphLookupSupported = graphLookup
+            folderModel.hasCompleteAncestors = lambda: ancestors
+            size, sizeTime = timeIt(lambda: folderModel.getSizeRecursive(root))
+            count, countTime = timeIt(lambda: folderModel.subtreeCount(root))
+            filtered, filteredTime = timeIt(lambda: folderModel.subtreeCount(
+                root, user=user, level=AccessType.READ))
+            assert count == filtered
+            print('%-12s %10d %10d %10.3f %18.3f' % (
+                label, size, count, sizeTime + countTime, filteredTime))
+    finally:
+        del folderModel.hasCompleteAncestors
+        folderModel._graphLookupSupported = None
+        folderModel.remove(root)
+
+
+if __name__ == '__main__':
+    main()
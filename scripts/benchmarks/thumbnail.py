@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Measure the peak memory and time of creating thumbnails of large images, by
+reading the whole file and decoding the full image once for each size as
+thumbnails used to be created, and with the streaming thumbnail engine, which
+decodes each image once at the smallest resolution the sizes need.
+
+Synthetic JPEG and PNG images are generated, and other images, such as
+pyramidal TIFF or DICOM files, can be passed as arguments. The streaming
+engine fails on images that exceed the limit on decoded pixels. The thumbnails
+plugin must be installed::
+
+    python scripts/benchmarks/thumbnail.py --pixels 12000 slide.tiff
+"""
+
+import argparse
+import multiprocessing
+import os
+import psutil
+import resource
+import shutil
+import six
+import tempfile
+import time
+
+from PIL import Image
+
+from girder.utility.server import configureServer
+
+
+def legacy(path, sizes, maxPixels):
+    from girder.plugins.thumbnails import worker
+
+    for size in sizes:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.endswith('.dcm'):
+            image = worker.scaleDicomLevels(worker.dicom.read_file(six.BytesIO(data)))
+        else:
+            image = Image.open(six.BytesIO(data))
+        image.thumbnail(worker._targetSize(image.size, size), Image.ANTIALIAS)
+
+
+def streaming(path, sizes, maxPixels):
+    from girder.plugins.thumbnails import worker
+
+    with open(path, 'rb') as f:
+        worker.decodeThumbnails(f, sizes, maxPixels, isDicom=path.endswith('.dcm'))
+
+
+def measure(mode, path, sizes, maxPixels, results):
+    # Report the memory used beyond what this process started with
+    start = psutil.Process().memory_info().rss
+    elapsed = time.time()
+    mode(path, sizes, maxPixels)
+    elapsed = time.time() - elapsed
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    results.put((elapsed, max(peak - start, 0)))
+
+
+def run(mode, path, sizes, maxPixels):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=measure, args=(mode, path, sizes, maxPixels, results))
+    process.start()
+    process.join()
+    # Nothing is reported if the process failed
+    return None if results.empty() else results.get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('images', nargs='*', help='additional images to measure')
+    parser.add_argument('--pixels', type=int, default=12000,
+                        help='width and height of the generated images')
+    parser.add_argument('--sizes', default='64,256,512',
+                        help='comma separated widths of the thumbnails')
+    parser.add_argument('--max-pixels', type=int, default=64 * 1024 * 1024,
+                        help='maximum number of pixels the streaming engine decodes')
+    args = parser.parse_args()
+
+    configureServer(plugins=['thumbnails'])
+    sizes = [{'width': int(width), 'height': 0, 'crop': True}
+             for width in args.sizes.split(',')]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        images = []
+        for fmt in ('JPEG', 'PNG'):
+            path = os.path.join(tmpdir, 'large.%s' % fmt.lower())
+            Image.effect_mandelbrot(
+                (args.pixels, args.pixels), (-2, -1.5, 1, 1.5), 100).convert('RGB').save(path, fmt)
+            images.append(path)
+        images.extend(args.images)
+
+        print('%-24s %-10s %10s %12s' % ('image', 'mode', 'seconds', 'peak MB'))
+        for path in images:
+            for label, mode in (('legacy', legacy), ('streaming', streaming)):
+                result = run(mode, path, sizes, args.max_pixels)
+                if result is None:
+                    print('%-24s %-10s %10s %12s' % (
+                        os.path.basename(path)[:24], label, 'failed', ''))
+                    continue
+                elapsed, peak = result
+                print('%-24s %-10s %10.3f %12.1f' % (
+                    os.path.basename(path)[:24], label, elapsed, peak / 1024.0 / 1024))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -35,7 +35,7 @@ import warnings
 
 from six import BytesIO
 from six.moves import urllib
-from girder.utility import model_importer, plugin_utilities
+from girder.utility import model_importer, plugin_utilities, process_cache
 from girder.utility.server import setup as setupServer
 from girder.constants import AccessType, ROOT_DIR, SettingKey
 from girder.models import getDbConnection
@@ -129,6 +129,8 @@ def dropTestDatabase(dropModels=True):
     usedDBs[dbName] = True
     if dropModels:
         model_importer.reinitializeAll()
+    else:
+        process_cache.clearAll()
 
 
 def dropGridFSDatabase(dbName):
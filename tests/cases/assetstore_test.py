@@ -25,14 +25,16 @@ import json
 import mock
 import moto
 import os
+import shutil
 import six
+import tempfile
 import time
 import zipfile
 
 from .. import base, mock_s3
 from girder import events
 from girder.constants import AssetstoreType, ROOT_DIR
-from girder.utility import assetstore_utilities
+from girder.utility import assetstore_utilities, s3_assetstore_adapter
 from girder.utility.progress import ProgressContext
 from girder.utility.s3_assetstore_adapter import makeBotoConnectParams
 from girder.utility import path as path_util
@@ -290,6 +292,93 @@ class AssetstoreTestCase(base.TestCase):
         self.assertIsNone(self.model('file').load(_file['_id'], force=True))
         self.assertTrue(os.path.isfile(_file['path']))
 
+    def testFilesystemAssetstoreIncrementalImport(self):
+        folder = six.next(self.model('folder').childFolders(
+            self.admin, parentType='user', force=True, filters={
+                'name': 'Public'
+            }))
+        root = tempfile.mkdtemp()
+        try:
+            for relpath in ('a.txt', 'sub/b.txt', 'sub/c.txt', 'sub/deep/d.txt', 'gone/e.txt'):
+                fullPath = os.path.join(root, relpath)
+                if not os.path.isdir(os.path.dirname(fullPath)):
+                    os.makedirs(os.path.dirname(fullPath))
+                with open(fullPath, 'w') as f:
+                    f.write(relpath)
+
+            params = {
+                'importPath': root,
+                'destinationType': 'folder',
+                'destinationId': folder['_id'],
+                'incremental': 'true'
+            }
+            path = '/assetstore/%s/import' % str(self.assetstore['_id'])
+            resp = self.request(path, method='POST', params=params, user=self.admin)
+            self.assertStatusOk(resp)
+
+            def lookup(relpath):
+                resp = self.request('/resource/lookup', user=self.admin, params={
+                    'path': '/user/admin/Public/' + relpath, 'test': True
+                })
+                self.assertStatusOk(resp)
+                return resp.json and self.model('file').load(resp.json['_id'], force=True)
+
+            files = {relpath: lookup(relpath) for relpath in (
+                'a.txt/a.txt', 'sub/b.txt/b.txt', 'sub/c.txt/c.txt', 'sub/deep/d.txt/d.txt',
+                'gone/e.txt/e.txt')}
+            for file in six.viewvalues(files):
+                self.assertTrue(file['imported'])
+                self.assertEqual(file['size'], os.path.getsize(file['path']))
+            sub = self.model('folder').load(self.model('item').load(
+                files['sub/b.txt/b.txt']['itemId'], force=True)['folderId'], force=True)
+            self.assertEqual(sub['importSignature']['count'], 2)
+            self.assertEqual(sub['size'], 18)
+
+            # Unchanged directories are not looked up again
+            with mock.patch('girder.utility.bulk_import.BulkImporter.importFiles',
+                            side_effect=lambda entries: []) as importFiles:
+                resp = self.request(path, method='POST', params=params, user=self.admin)
+                self.assertStatusOk(resp)
+                self.assertEqual(importFiles.call_count, 0)
+
+            # Changed and removed files and directories are found
+            os.remove(os.path.join(root, 'sub', 'c.txt'))
+            with open(os.path.join(root, 'sub', 'b.txt'), 'w') as f:
+                f.write('changed contents')
+            with open(os.path.join(root, 'sub', 'f.txt'), 'w') as f:
+                f.write('new')
+            shutil.rmtree(os.path.join(root, 'gone'))
+            fileModel = self.model('file')
+            with mock.patch.object(fileModel, 'find', wraps=fileModel.find) as find:
+                resp = self.request(path, method='POST', params=params, user=self.admin)
+                self.assertStatusOk(resp)
+            # Files of removed directories are found by their items rather
+            # than by matching the paths of every imported file
+            for call in find.call_args_list:
+                self.assertNotIn('path', call[0][0] if call[0] else call[1].get('query', {}))
+
+            b = self.model('file').load(files['sub/b.txt/b.txt']['_id'], force=True)
+            self.assertEqual(b['size'], 16)
+            self.assertNotIn('tombstoned', b)
+            self.assertIn('tombstoned', self.model('file').load(
+                files['sub/c.txt/c.txt']['_id'], force=True))
+            self.assertIn('tombstoned', self.model('file').load(
+                files['gone/e.txt/e.txt']['_id'], force=True))
+            self.assertNotIn('tombstoned', self.model('file').load(
+                files['sub/deep/d.txt/d.txt']['_id'], force=True))
+            self.assertEqual(lookup('sub/f.txt/f.txt')['size'], 3)
+            self.assertEqual(self.model('folder').load(sub['_id'], force=True)['size'], 28)
+
+            # A file that reappears is no longer tombstoned
+            with open(os.path.join(root, 'sub', 'c.txt'), 'w') as f:
+                f.write('sub/c.txt')
+            resp = self.request(path, method='POST', params=params, user=self.admin)
+            self.assertStatusOk(resp)
+            self.assertNotIn('tombstoned', self.model('file').load(
+                files['sub/c.txt/c.txt']['_id'], force=True))
+        finally:
+            shutil.rmtree(root)
+
     def testFilesystemAssetstoreFindInvalidFiles(self):
         # Create several files in the assetstore, some of which point to real
         # files on disk and some that don't
@@ -797,6 +886,83 @@ class AssetstoreTestCase(base.TestCase):
             path='/folder/%s' % parentFolder['_id'], method='DELETE', user=self.admin)
         self.assertStatusOk(resp)
 
+    @moto.mock_s3
+    def testS3AssetstoreImport(self):
+        params = {
+            'name': 'S3 Assetstore',
+            'type': AssetstoreType.S3,
+            'bucket': 'bucketname',
+            'accessKeyId': 'someKey',
+            'secret': 'someSecret',
+            'prefix': '/foo/bar/'
+        }
+        botoParams = makeBotoConnectParams(params['accessKeyId'], params['secret'])
+        client = mock_s3.createBucket(botoParams, 'bucketname')
+        resp = self.request(path='/assetstore', method='POST', user=self.admin, params=params)
+        self.assertStatusOk(resp)
+        assetstore = self.model('assetstore').load(resp.json['_id'])
+
+        keys = ['data/top.txt'] + ['data/%s/%d.txt' % (prefix, i)
+                                   for prefix in ('a', 'b', 'b/c') for i in range(5)]
+        for key in keys:
+            client.put_object(Bucket='bucketname', Key=key, Body=b'abc')
+
+        def importInto(name):
+            folder = self.model('folder').createFolder(
+                self.admin, name, parentType='user', creator=self.admin)
+            self.model('assetstore').importData(
+                assetstore, parent=folder, parentType='folder',
+                params={'importPath': 'data', 'fileExcludeRegex': r'^4'},
+                progress=ProgressContext(False), user=self.admin)
+            return folder
+
+        def listTree(folder, path=''):
+            names = [path + item['name'] for item in self.model('folder').childItems(folder)]
+            for child in self.model('folder').childFolders(folder, 'folder', user=self.admin):
+                names.extend(listTree(child, path + child['name'] + '/'))
+            return sorted(names)
+
+        # Keys are listed in pages, and prefixes are imported in parallel
+        s3_assetstore_adapter._S3Import.pageSize = 2
+        try:
+            folder = importInto('import')
+            expected = ['a/%d.txt' % i for i in range(4)] + [
+                'b/%d.txt' % i for i in range(4)] + [
+                'b/c/%d.txt' % i for i in range(4)] + ['top.txt']
+            self.assertEqual(listTree(folder), sorted(expected))
+            sizes = {child['name']: child['size'] for child in self.model('folder').find(
+                {'baseParentId': self.admin['_id']})}
+            self.assertEqual(sizes['import'], 3)
+            self.assertEqual(sizes['c'], 12)
+            file = self.model('file').findOne({'name': '0.txt', 's3Key': 'data/b/c/0.txt'})
+            self.assertTrue(file['imported'])
+            self.assertEqual(file['exts'], ['txt'])
+            self.assertIsNone(self.model('import_checkpoint').findOne())
+
+            # Importing again reuses the existing items and files
+            itemCount = self.model('item').find().count()
+            self.model('assetstore').importData(
+                assetstore, parent=folder, parentType='folder',
+                params={'importPath': 'data'}, progress=ProgressContext(False),
+                user=self.admin)
+            self.assertEqual(self.model('item').find().count(), itemCount + 3)
+
+            # An interrupted import resumes from its checkpoint
+            folder = self.model('folder').createFolder(
+                self.admin, 'resumed', parentType='user', creator=self.admin)
+            checkpoint = self.model('import_checkpoint')
+            checkpoint.record(assetstore, folder, 'data/', 'data/', complete=True)
+            checkpoint.record(assetstore, folder, 'data/', 'data/a/', complete=True)
+            checkpoint.record(assetstore, folder, 'data/', 'data/b/', after='data/b/c/1.txt')
+            self.model('assetstore').importData(
+                assetstore, parent=folder, parentType='folder',
+                params={'importPath': 'data'}, progress=ProgressContext(False),
+                user=self.admin)
+            self.assertEqual(listTree(folder), ['b/c/2.txt', 'b/c/3.txt', 'b/c/4.txt'])
+            self.assertIsNone(checkpoint.findOne())
+        finally:
+            del s3_assetstore_adapter._S3Import.pageSize
+
     def testMoveBetweenAssetstores(self):
         folder = six.next(self.model('folder').childFolders(
             self.admin, parentType='user', force=True, filters={
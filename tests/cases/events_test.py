@@ -19,6 +19,7 @@
 
 import mock
 import six
+import threading
 import time
 import unittest
 
@@ -140,6 +141,81 @@ class EventsTestCase(unittest.TestCase):
             self.assertEqual(self.responses, ['foo'])
             events.daemon.stop()
 
+    def testAsyncEventPool(self):
+        daemon = events.AsyncEventsDaemon(workers=3, maxQueueSize=100)
+        lock = threading.Lock()
+        handled = []
+        running = [0, 0]
+
+        def handler(event):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+                handled.append(event.info)
+
+        with events.bound('_test.event', '_test.handler', handler):
+            for i in range(5):
+                daemon.trigger('_test.event', ('a', i), key='a')
+                daemon.trigger('_test.event', ('b', i), key='b')
+                daemon.trigger('_test.event', ('none', i))
+            self.assertEqual(daemon.stats()['queued'], 15)
+
+            daemon.start()
+            startTime = time.time()
+            while len(handled) < 15 and time.time() - startTime < 15:
+                time.sleep(0.05)
+            daemon.stop()
+
+        self.assertEqual(len(handled), 15)
+        # Events were handled concurrently, but in order for each key
+        self.assertGreater(running[1], 1)
+        for key in ('a', 'b'):
+            self.assertEqual([i for k, i in handled if k == key], list(range(5)))
+
+        stats = daemon.stats()
+        self.assertEqual(stats['handled'], 15)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['maxQueueSize'], 100)
+        self.assertGreaterEqual(stats['maxDuration'], 0.05)
+
+        # Stopping lets idle workers exit
+        startTime = time.time()
+        while daemon.stats()['workers'] and time.time() - startTime < 15:
+            time.sleep(0.05)
+        self.assertEqual(daemon.stats()['workers'], 0)
+
+    def testAsyncEventFromHandler(self):
+        # A handler that triggers events while the queue is full must not wait
+        # for its own worker to make room
+        daemon = events.AsyncEventsDaemon(workers=1, maxQueueSize=1)
+        handled = []
+
+        def outer(event):
+            for i in range(3):
+                daemon.trigger('_test.inner', i, key='inner')
+            handled.append('outer')
+
+        def inner(event):
+            handled.append(event.info)
+
+        with events.bound('_test.outer', '_test.handler', outer), \
+                events.bound('_test.inner', '_test.handler', inner):
+            daemon.trigger('_test.outer')
+            daemon.start()
+            startTime = time.time()
+            while daemon.stats()['handled'] < 4 and time.time() - startTime < 15:
+                time.sleep(0.05)
+            stats = daemon.stats()
+            daemon.stop()
+
+        self.assertEqual(handled, ['outer', 0, 1, 2])
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['waitingForKey'], 0)
+
     @mock.patch.object(events, 'daemon', new=events.ForegroundEventsDaemon())
     def testForegroundDaemon(self):
         self.assertIsInstance(events.daemon, events.ForegroundEventsDaemon)
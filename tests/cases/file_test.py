@@ -18,12 +18,16 @@
 ###############################################################################
 
 import boto3
+import filelock
 import httmock
 import io
 import json
+import mock
 import moto
 import os
 import shutil
+import six
+import time
 import zipfile
 
 from hashlib import sha512
@@ -33,7 +37,7 @@ from girder import events
 from girder.constants import SettingKey
 from girder.models import getDbConnection
 from girder.models.model_base import AccessException, GirderException
-from girder.utility import gridfs_assetstore_adapter
+from girder.utility import assetstore_utilities, config, gridfs_assetstore_adapter, prefetch
 from girder.utility.filesystem_assetstore_adapter import DEFAULT_PERMS
 from girder.utility.s3_assetstore_adapter import makeBotoConnectParams, S3AssetstoreAdapter
 from six.moves import urllib
@@ -235,6 +239,15 @@ class FileTestCase(base.TestCase):
         self.assertEqual(file['name'], name)
         self.assertEqual(file['size'], len(chunk1 + chunk2))
 
+        # The file can be found from the ID of the completed upload
+        resp = self.request(path='/file/upload/%s/file' % uploadId, user=self.user)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['_id'], file['_id'])
+        resp = self.request(path='/file/upload/%s/file' % uploadId, user=self.secondUser)
+        self.assertStatus(resp, 403)
+        resp = self.request(path='/file/upload/%s/file' % file['_id'], user=self.user)
+        self.assertStatus(resp, 400)
+
         return file
 
     def _testDownloadFile(self, file, contents, contentDisposition=None):
@@ -796,6 +809,168 @@ class FileTestCase(base.TestCase):
             '%93%81%20%F0%9F%98%83'
         self._testDownloadFile(file, chunk1 + chunk2, testval)
 
+    def testFileHandleRandomAccess(self):
+        contents = os.urandom(10000)
+        file = self.model('upload').uploadFromFile(
+            io.BytesIO(contents), len(contents), 'random.bin', parentType='folder',
+            parent=self.privateFolder, user=self.user)
+
+        with self.model('file').open(file) as handle:
+            ranges = []
+            readRange = handle._adapter.readRange
+
+            def recordRange(file, offset, length):
+                ranges.append((offset, length))
+                return readRange(file, offset, length)
+
+            handle._adapter.readRange = recordRange
+            handle.blockSize = 1000
+            handle.cacheBlocks = 4
+
+            # Reads only fetch the blocks that contain them, once
+            self.assertEqual(handle.pread(10, 5005), contents[5005:5015])
+            self.assertEqual(handle.pread(100, 5900), contents[5900:6000])
+            self.assertEqual(ranges, [(5000, 1000)])
+            self.assertEqual(handle.pread(1500, 4500), contents[4500:6000])
+            self.assertEqual(ranges, [(5000, 1000), (4000, 1000)])
+            self.assertEqual(handle.tell(), 0)
+
+            # Sequential reads fetch growing runs of blocks
+            del ranges[:]
+            handle.seek(0)
+            buf = bytearray(700)
+            data = b''
+            while True:
+                length = handle.readinto(buf)
+                if not length:
+                    break
+                data += bytes(buf[:length])
+            self.assertEqual(data, contents)
+            self.assertEqual(ranges, [
+                (0, 1000), (1000, 1000), (2000, 2000), (4000, 2000), (6000, 2000),
+                (8000, 2000)])
+
+            # Only the most recently used blocks are kept
+            self.assertEqual(sorted(handle._blocks), [6, 7, 8, 9])
+            self.assertEqual(handle.pread(-1, 9990), contents[9990:])
+            self.assertEqual(handle.pread(10, 10000), b'')
+
+    def testFilesystemDeleteFiles(self):
+        assetstore = self.model('assetstore').getCurrent()
+        fileModel = self.model('file')
+        contents = b'shared contents'
+        first = self.model('upload').uploadFromFile(
+            io.BytesIO(contents), len(contents), 'first', parentType='folder',
+            parent=self.privateFolder, user=self.user)
+        path = os.path.join(assetstore['root'], first['path'])
+
+        def copyFile(file, **kwargs):
+            copy = {k: v for k, v in six.viewitems(file) if k != '_id'}
+            copy.update(kwargs)
+            return fileModel.save(copy, validate=False)
+
+        # A file that starts to refer to the data while it is being deleted,
+        # such as a copy, keeps it
+        realLock = filelock.FileLock
+        copies = []
+
+        def lockAndCopy(lockPath):
+            if not copies:
+                copies.append(copyFile(first, name='copy'))
+            return realLock(lockPath)
+
+        with mock.patch('filelock.FileLock', side_effect=lockAndCopy):
+            fileModel.bulkRemove([first])
+        self.assertEqual(len(copies), 1)
+        self.assertTrue(os.path.isfile(path))
+
+        # Files without a hash keep data that another file refers to by path
+        legacy = copyFile(copies[0], name='legacy')
+        fileModel.update({'_id': legacy['_id']}, {'$unset': {'sha512': True}})
+        legacy = fileModel.load(legacy['_id'], force=True)
+        self.assertNotIn('sha512', legacy)
+        fileModel.bulkRemove([legacy])
+        self.assertTrue(os.path.isfile(path))
+
+        # The data is deleted with the last file that refers to it
+        fileModel.bulkRemove(copies)
+        self.assertFalse(os.path.isfile(path))
+
+    def testFilesystemDelegatedDownload(self):
+        assetstore = self.model('assetstore').getCurrent()
+        contents = b'delegated contents'
+        file = self.model('upload').uploadFromFile(
+            io.BytesIO(contents), len(contents), 'delegated.txt', parentType='folder',
+            parent=self.privateFolder, user=self.user, mimeType='text/plain')
+        path = os.path.abspath(os.path.join(assetstore['root'], file['path']))
+        downloadPath = '/file/%s/download' % file['_id']
+        serverConfig = config.getConfig()['server']
+
+        try:
+            serverConfig['file_delivery'] = 'x-accel-redirect'
+            serverConfig['file_delivery_prefix'] = '/internal/'
+            resp = self.request(path=downloadPath, user=self.user, isJson=False)
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.headers['X-Accel-Redirect'],
+                             '/internal' + urllib.parse.quote(path))
+            self.assertEqual(resp.headers['Content-Type'], 'text/plain;charset=utf-8')
+            self.assertEqual(resp.headers['Content-Disposition'],
+                             'attachment; filename="delegated.txt"')
+            self.assertEqual(self.getBody(resp), '')
+
+            # The front-end server applies the Range header itself
+            resp = self.request(path=downloadPath, user=self.user, isJson=False,
+                                additionalHeaders=[('Range', 'bytes=2-7')])
+            self.assertStatusOk(resp)
+            self.assertIn('X-Accel-Redirect', resp.headers)
+            self.assertNotIn('Content-Range', resp.headers)
+
+            # But it does not know about the offset parameter
+            resp = self.request(path=downloadPath, user=self.user, isJson=False,
+                                params={'offset': 2})
+            self.assertStatus(resp, 206)
+            self.assertNotIn('X-Accel-Redirect', resp.headers)
+            self.assertEqual(self.getBody(resp), contents[2:].decode('utf8'))
+
+            serverConfig['file_delivery'] = 'x-sendfile'
+            resp = self.request(path=downloadPath, user=self.user, isJson=False)
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.headers['X-Sendfile'], urllib.parse.quote(path))
+            self.assertEqual(self.getBody(resp), '')
+
+            # Paths are percent-encoded for both servers
+            importDir = os.path.join(assetstore['root'], 'import')
+            if not os.path.isdir(importDir):
+                os.makedirs(importDir)
+            importPath = os.path.join(importDir, u'a b%\u00e9.txt')
+            with open(importPath, 'wb') as f:
+                f.write(contents)
+            item = self.model('item').createItem('imported', self.user, self.privateFolder)
+            imported = assetstore_utilities.getAssetstoreAdapter(assetstore).importFile(
+                item, importPath, self.user)
+            importedPath = '/file/%s/download' % imported['_id']
+            quoted = urllib.parse.quote(os.path.abspath(importPath).encode('utf8'))
+            self.assertIn('a%20b%25%C3%A9.txt', quoted)
+            resp = self.request(path=importedPath, user=self.user, isJson=False)
+            self.assertEqual(resp.headers['X-Sendfile'], quoted)
+            serverConfig['file_delivery'] = 'x-accel-redirect'
+            resp = self.request(path=importedPath, user=self.user, isJson=False)
+            self.assertEqual(resp.headers['X-Accel-Redirect'], '/internal' + quoted)
+            serverConfig['file_delivery'] = 'x-sendfile'
+
+            # Access is still checked by Girder
+            resp = self.request(path=downloadPath, isJson=False)
+            self.assertStatus(resp, 401)
+            self.assertNotIn('X-Sendfile', resp.headers)
+        finally:
+            serverConfig.pop('file_delivery', None)
+            serverConfig.pop('file_delivery_prefix', None)
+
+        resp = self.request(path=downloadPath, user=self.user, isJson=False)
+        self.assertStatusOk(resp)
+        self.assertNotIn('X-Sendfile', resp.headers)
+        self.assertEqual(self.getBody(resp), contents.decode('utf8'))
+
     def testGridFsAssetstore(self):
         """
         Test usage of the GridFS assetstore type.
@@ -1014,6 +1189,46 @@ class FileTestCase(base.TestCase):
         # the S3 download will fail )
         self._testCopyFile(file, assertContent=False)
 
+    def testPrefetch(self):
+        """
+        Test reading the chunks of a download ahead on a background thread.
+        """
+        read = []
+
+        def chunks(count, failAt=None):
+            try:
+                for i in range(count):
+                    if i == failAt:
+                        raise GirderException('Chunk %d is missing.' % i)
+                    read.append(i)
+                    yield i
+            finally:
+                read.append('closed')
+
+        # Chunks are returned in order, with or without the background thread
+        self.assertEqual(list(prefetch.prefetch(chunks(10), window=3)), list(range(10)))
+        self.assertEqual(read[-1], 'closed')
+        self.assertEqual(list(prefetch.prefetch(chunks(4), window=0)), list(range(4)))
+
+        # Errors are raised after the chunks that were read before them
+        stream = prefetch.prefetch(chunks(5, failAt=2), window=3)
+        self.assertEqual([next(stream), next(stream)], [0, 1])
+        with six.assertRaisesRegex(self, GirderException, 'Chunk 2 is missing.'):
+            next(stream)
+
+        # Closing the stream early stops reading, with at most a window of
+        # chunks read ahead
+        del read[:]
+        stream = prefetch.prefetch(chunks(1000), window=2)
+        self.assertEqual(next(stream), 0)
+        stream.close()
+        for _ in range(50):
+            if read and read[-1] == 'closed':
+                break
+            time.sleep(0.1)
+        self.assertEqual(read[-1], 'closed')
+        self.assertLessEqual(len(read), 6)
+
     def testLinkFile(self):
         params = {
             'parentType': 'folder',
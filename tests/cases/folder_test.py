@@ -19,6 +19,8 @@
 
 import datetime
 import json
+import mock
+import pymongo
 import six
 
 from .. import base
@@ -521,6 +523,57 @@ class FolderTestCase(base.TestCase):
         self.assertEqual(item, None)
         self.assertEqual(subitem, None)
 
+    def testBulkRemove(self):
+        folderModel = self.model('folder')
+        itemModel = self.model('item')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin, name='top')
+        sub = folderModel.createFolder(
+            parent=top, parentType='folder', creator=self.admin, name='sub')
+        subsub = folderModel.createFolder(
+            parent=sub, parentType='folder', creator=self.admin, name='subsub')
+        for index, folder in enumerate((top, sub, subsub, sub, subsub)):
+            item = itemModel.createItem('item %d' % index, self.admin, folder)
+            self.model('file').createFile(self.admin, item, 'file', 10, {'_id': 0})
+        self.assertEqual(self.model('user').load(self.admin['_id'], force=True)['size'], 50)
+
+        kept = itemModel.createItem('kept', self.admin, top)
+        removed = {}
+
+        def removeMany(event):
+            removed.setdefault(event.name, []).append(len(event.info['documents']))
+
+        def remove(event):
+            removed.setdefault(event.name, []).append(event.info['_id'])
+            if event.info['_id'] == kept['_id']:
+                event.preventDefault()
+
+        folderModel.bulkRemoveBatchSize = 1
+        try:
+            with events.bound('model.file.remove_many', 'test', removeMany), \
+                    events.bound('model.item.remove_many', 'test', removeMany), \
+                    events.bound('model.folder.remove_many', 'test', removeMany), \
+                    events.bound('model.file.remove', 'test', remove), \
+                    events.bound('model.item.remove', 'test', remove), \
+                    events.bound('model.folder.remove', 'test', remove):
+                folderModel.clean(top)
+        finally:
+            del folderModel.bulkRemoveBatchSize
+
+        # Each document triggers its own remove event as well, and documents
+        # whose removal is prevented are kept
+        self.assertEqual(removed['model.item.remove_many'], [1, 1, 1, 1, 1])
+        self.assertEqual(len(removed['model.item.remove']), 6)
+        self.assertEqual(sum(removed['model.file.remove_many']), 5)
+        self.assertEqual(len(removed['model.file.remove']), 5)
+        self.assertEqual(removed['model.folder.remove_many'], [1, 1])
+        self.assertEqual(set(removed['model.folder.remove']), {sub['_id'], subsub['_id']})
+        self.assertEqual(
+            [item['_id'] for item in itemModel.find({'ancestors': top['_id']})], [kept['_id']])
+        self.assertIsNone(folderModel.load(sub['_id'], force=True))
+        self.assertEqual(folderModel.load(top['_id'], force=True)['size'], 0)
+        self.assertEqual(self.model('user').load(self.admin['_id'], force=True)['size'], 0)
+
     def testLazyFieldComputation(self):
         """
         Demonstrate that a folder that is saved in the database without
@@ -585,6 +638,128 @@ class FolderTestCase(base.TestCase):
         for parent in parents:
             self.assertIn('_accessLevel', parent['object'])
 
+    def testAncestors(self):
+        folderModel = self.model('folder')
+        itemModel = self.model('item')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin, name='top')
+        middle = folderModel.createFolder(
+            parent=top, parentType='folder', creator=self.admin, name='middle')
+        bottom = folderModel.createFolder(
+            parent=middle, parentType='folder', creator=self.admin, name='bottom')
+        item = itemModel.createItem('item', self.admin, bottom)
+        other = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin, name='other')
+
+        self.assertEqual(top['ancestors'], [])
+        self.assertEqual(bottom['ancestors'], [top['_id'], middle['_id']])
+        self.assertEqual(item['ancestors'], [top['_id'], middle['_id'], bottom['_id']])
+        self.assertTrue(folderModel.hasCompleteAncestors())
+        self.assertEqual(folderModel.subtreeCount(top), 4)
+        self.assertEqual(folderModel.subtreeCount(top, includeItems=False), 3)
+
+        # Moving a folder rewrites the ancestors of everything beneath it
+        folderModel.move(middle, other, 'folder')
+        bottom = folderModel.load(bottom['_id'], force=True)
+        item = itemModel.load(item['_id'], force=True)
+        self.assertEqual(bottom['ancestors'], [other['_id'], middle['_id']])
+        self.assertEqual(item['ancestors'], [other['_id'], middle['_id'], bottom['_id']])
+        self.assertEqual(folderModel.subtreeCount(top), 1)
+        self.assertEqual(folderModel.subtreeCount(other), 4)
+
+        parents = folderModel.parentsToRoot(bottom, user=self.admin)
+        self.assertEqual([p['object']['_id'] for p in parents],
+                         [self.admin['_id'], other['_id'], middle['_id']])
+
+        # Ancestors missing from older documents are computed when loaded
+        folderModel.update({'_id': bottom['_id']}, {'$unset': {'ancestors': True}})
+        itemModel.update({'_id': item['_id']}, {'$unset': {'ancestors': True}})
+        itemModel.load(item['_id'], force=True)
+        self.assertEqual(folderModel.find({'_id': bottom['_id']})[0]['ancestors'],
+                         [other['_id'], middle['_id']])
+        self.assertEqual(itemModel.find({'_id': item['_id']})[0]['ancestors'],
+                         [other['_id'], middle['_id'], bottom['_id']])
+
+    def testSubtreeAggregation(self):
+        folderModel = self.model('folder')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin, name='top', public=True)
+        hidden = folderModel.createFolder(
+            parent=top, parentType='folder', creator=self.admin, name='hidden', public=False)
+        visible = folderModel.createFolder(
+            parent=top, parentType='folder', creator=self.admin, name='visible')
+        folderModel.createFolder(
+            parent=hidden, parentType='folder', creator=self.admin, name='sub', public=True)
+        folderModel.createFolder(
+            parent=visible, parentType='folder', creator=self.admin, name='sub')
+        item = self.model('item').createItem('item', self.admin, visible)
+        self.model('file').createFile(self.admin, item, 'file', 13, {'_id': 0})
+        top = folderModel.load(top['_id'], force=True)
+
+        def subtreeResults():
+            return (
+                folderModel.getSizeRecursive(top),
+                folderModel.subtreeCount(top, user=self.user, level=AccessType.READ),
+                folderModel.subtreeCount(top, includeItems=False, user=self.user,
+                                         level=AccessType.READ),
+                folderModel.subtreeCount(top, user=self.admin, level=AccessType.READ)
+            )
+
+        # Each aggregation is recorded as "ancestors" or "graphLookup", and
+        # those of the given kinds fail as if they exceeded the memory limit
+        realAggregate = folderModel.collection.aggregate
+        attempts = []
+
+        def failing(*kinds):
+            def aggregate(pipeline, *args, **kwargs):
+                kind = 'graphLookup' if any(
+                    '$graphLookup' in stage for stage in pipeline) else 'ancestors'
+                attempts.append(kind)
+                if kind in kinds:
+                    raise pymongo.errors.OperationFailure('Exceeded memory limit')
+                return realAggregate(pipeline, *args, **kwargs)
+            return mock.patch.object(folderModel.collection, 'aggregate', new=aggregate)
+
+        # The hidden folder and its public child are not counted for the user
+        expected = (13, 4, 3, 6)
+        graphLookup = folderModel.supportsGraphLookup()
+        try:
+            # Sizes are summed by the ancestors of the documents
+            with failing():
+                self.assertEqual(subtreeResults(), expected)
+            self.assertEqual(attempts[0], 'ancestors')
+
+            if graphLookup:
+                # If that fails, the subtree is traversed with $graphLookup
+                del attempts[:]
+                with failing('ancestors'):
+                    self.assertEqual(subtreeResults(), expected)
+                self.assertEqual(attempts[:2], ['ancestors', 'graphLookup'])
+
+                # Without complete ancestors, $graphLookup is used directly
+                del attempts[:]
+                with failing(), mock.patch.object(
+                        folderModel, 'hasCompleteAncestors', return_value=False):
+                    self.assertEqual(subtreeResults(), expected)
+                self.assertEqual(set(attempts), {'graphLookup'})
+
+            # If every aggregation fails, the subtree is visited by recursion
+            del attempts[:]
+            with failing('ancestors', 'graphLookup'):
+                self.assertEqual(subtreeResults(), expected)
+            self.assertIn('ancestors', attempts)
+            self.assertEqual('graphLookup' in attempts, graphLookup)
+
+            # As it is when the server does not support $graphLookup
+            del attempts[:]
+            folderModel._graphLookupSupported = False
+            with failing(), mock.patch.object(
+                    folderModel, 'hasCompleteAncestors', return_value=False):
+                self.assertEqual(subtreeResults(), expected)
+            self.assertEqual(attempts, [])
+        finally:
+            folderModel._graphLookupSupported = None
+
     def testFolderAccessAndDetails(self):
         # create a folder to work with
         folder = self.model('folder').createFolder(
@@ -754,3 +929,46 @@ class FolderTestCase(base.TestCase):
             path='/folder/%s/copy' % subFolder['_id'], method='POST',
             user=self.admin, params={'public': 'false', 'progress': True})
         self.assertStatusOk(resp)
+
+    def testSetMetadataMany(self):
+        folderModel = self.model('folder')
+        parent = folderModel.createFolder(self.admin, 'parent', parentType='user', public=True)
+        children = [folderModel.createFolder(parent, 'child %d' % i, creator=self.admin)
+                    for i in range(3)]
+        folderModel.setUserAccess(children[0], self.user, AccessType.WRITE, save=True)
+
+        resp = self.request(path='/folder/metadata', method='PUT', user=self.user, params={
+            'updates': json.dumps([{'_id': str(folder['_id']), 'metadata': {'a': 1}}
+                                   for folder in children])
+        })
+        self.assertStatus(resp, 403)
+
+        resp = self.request(path='/folder/metadata', method='PUT', user=self.user, params={
+            'query': json.dumps({'parentId': {'$oid': str(parent['_id'])}}),
+            'metadata': json.dumps({'a': 1})
+        })
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'updated': 1})
+
+        # Only admins may pass other queries
+        query = {'parentId': {'$oid': str(parent['_id'])}, 'name': {'$regex': 'child'}}
+        resp = self.request(path='/folder/metadata', method='PUT', user=self.user, params={
+            'query': json.dumps(query),
+            'metadata': json.dumps({'c': 1})
+        })
+        self.assertStatus(resp, 400)
+        resp = self.request(path='/folder/metadata', method='PUT', user=self.admin, params={
+            'query': json.dumps(query),
+            'metadata': json.dumps({'c': 1})
+        })
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'updated': 3})
+
+        resp = self.request(path='/folder/metadata', method='PUT', user=self.admin, params={
+            'updates': json.dumps([{'_id': str(folder['_id']), 'metadata': {'b': i}}
+                                   for i, folder in enumerate(children)])
+        })
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'updated': 3})
+        metas = [folderModel.load(folder['_id'], force=True)['meta'] for folder in children]
+        self.assertEqual(metas, [{'a': 1, 'b': 0, 'c': 1}, {'b': 1, 'c': 1}, {'b': 2, 'c': 1}])
@@ -21,6 +21,7 @@ from .. import base
 from girder.utility import hash_state
 import hashlib
 import sys
+import zlib
 
 
 def setUpModule():
@@ -77,3 +78,31 @@ class HashStateTestCase(base.TestCase):
 
         for algo in algorithms:
             self._simpleHashingTest(algo)
+
+    def testMultiHash(self):
+        """
+        Test computing several digests in one pass, serializing their state
+        between chunks.
+        """
+        data = b''.join(self.chunks)
+        state = hash_state.MultiHash().serialize()
+        for chunk in self.chunks:
+            checksum = hash_state.MultiHash.restore(state)
+            checksum.update(chunk)
+            state = checksum.serialize()
+
+        digests = hash_state.MultiHash.restore(state).digests()
+        self.assertEqual(set(digests), set(hash_state.UPLOAD_ALGORITHMS))
+        self.assertEqual(digests['crc32'], zlib.crc32(data) & 0xFFFFFFFF)
+        for algo in ('md5', 'sha256', 'sha512'):
+            self.assertEqual(digests[algo], hashlib.new(algo, data).hexdigest())
+
+        # Uploads started before several digests were computed only resume
+        # their SHA-512
+        upload = {'sha512state': hash_state.serializeHex(hashlib.sha512())}
+        checksum = hash_state.restoreUpload(upload)
+        checksum.update(data)
+        hash_state.serializeUpload(upload, checksum)
+        self.assertNotIn('sha512state', upload)
+        self.assertEqual(hash_state.restoreUpload(upload).digests(),
+                         {'sha512': hashlib.sha512(data).hexdigest()})
@@ -26,6 +26,7 @@ import zipfile
 
 from .. import base
 
+from girder import events
 from girder.constants import AccessType
 
 
@@ -783,3 +784,113 @@ class ItemTestCase(base.TestCase):
         self.assertEqual(item1['_id'], item3['_id'])
         self.assertEqual(item2['name'], 'to be reused (1)')
         self.assertEqual(item3['name'], 'to be reused')
+
+    def testBatchedPermissionFiltering(self):
+        itemModel = self.model('item')
+        items = []
+        for i in range(5):
+            items.append(itemModel.createItem(
+                'public %d' % i, creator=self.users[0], folder=self.publicFolder))
+            items.append(itemModel.createItem(
+                'private %d' % i, creator=self.users[0], folder=self.privateFolder))
+        ids = [item['_id'] for item in items]
+
+        # Use a small batch size so that results span several batches
+        itemModel.accessBatchSize = 3
+        try:
+            for user in (None, self.users[0], self.users[1]):
+                expected = [item['name'] for item in items
+                            if itemModel.hasAccess(item, user=user)]
+                cursor = itemModel.find({'_id': {'$in': ids}}, sort=[('_id', 1)])
+                results = itemModel.filterResultsByPermission(
+                    cursor, user=user, level=AccessType.READ, offset=1, limit=4)
+                self.assertEqual([item['name'] for item in results], expected[1:5])
+        finally:
+            del itemModel.accessBatchSize
+
+        resources = itemModel.resolveAccessResources(
+            [self.publicFolder['_id'], self.privateFolder['_id']])
+        self.assertTrue(resources[self.publicFolder['_id']]['public'])
+        self.assertNotIn('name', resources[self.publicFolder['_id']])
+
+        # Files resolve their access through their item's folder
+        file = self.model('file').createFile(
+            creator=self.users[0], item=items[1], name='file', size=0,
+            assetstore=self.assetstore)
+        self.assertTrue(self.model('file').hasAccess(file, user=self.users[0]))
+        self.assertFalse(self.model('file').hasAccess(file, user=self.users[1]))
+        self.assertFalse(self.model('file').hasAccess(file, user=None))
+
+    def testSetMetadataMany(self):
+        itemModel = self.model('item')
+        public = [itemModel.createItem(
+            'public %d' % i, creator=self.users[0], folder=self.publicFolder)
+            for i in range(3)]
+        private = itemModel.createItem(
+            'private', creator=self.users[0], folder=self.privateFolder)
+        itemModel.setMetadata(public[0], {'old': 1, 'keep': 2})
+
+        # Set different metadata on each item, deleting null values
+        triggered = []
+        updates = [{'_id': str(item['_id']), 'metadata': {'index': i, 'old': None}}
+                   for i, item in enumerate(public)]
+        with events.bound('model.item.set_metadata_many', 'test',
+                          lambda event: triggered.append(event.info)):
+            resp = self.request(path='/item/metadata', method='PUT', user=self.users[0],
+                                params={'updates': json.dumps(updates)})
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'updated': 3})
+        self.assertEqual(len(triggered), 1)
+        self.assertEqual(len(triggered[0]['updates']), 3)
+        for i, item in enumerate(public):
+            item = itemModel.load(item['_id'], force=True)
+            self.assertEqual(item['meta']['index'], i)
+            self.assertNotIn('old', item['meta'])
+        self.assertEqual(itemModel.load(public[0]['_id'], force=True)['meta']['keep'], 2)
+
+        # All items must be writable, and nothing is changed otherwise
+        updates.append({'_id': str(private['_id']), 'metadata': {'index': 9}})
+        resp = self.request(path='/item/metadata', method='PUT', user=self.users[1],
+                            params={'updates': json.dumps(updates)})
+        self.assertStatus(resp, 403)
+        resp = self.request(path='/item/metadata', method='PUT', user=self.users[0],
+                            params={'updates': json.dumps([{
+                                '_id': str(self.publicFolder['_id']), 'metadata': {}}])})
+        self.assertStatus(resp, 400)
+        resp = self.request(path='/item/metadata', method='PUT', user=self.users[0],
+                            params={'updates': json.dumps([{
+                                '_id': str(private['_id']), 'metadata': {'a.b': 1}}])})
+        self.assertStatus(resp, 400)
+        self.assertEqual(itemModel.load(private['_id'], force=True)['meta'], {})
+
+        # A query only updates the matching items that the user can write
+        self.model('folder').setUserAccess(
+            self.publicFolder, self.users[1], AccessType.WRITE, save=True)
+        resp = self.request(path='/item/metadata', method='PUT', user=self.users[1], params={
+            'query': json.dumps({'folderId': {'$oid': str(self.publicFolder['_id'])},
+                                 'meta.index': 1}),
+            'metadata': json.dumps({'tagged': True})
+        })
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {'updated': 1})
+        tagged = itemModel.find({'meta.tagged': True}, fields=['name'])
+        self.assertEqual([item['name'] for item in tagged], ['public 1'])
+
+        # Other users may only match a folder and exact metadata values
+        for query in ({'meta.index': 1},
+                      {'folderId': str(self.publicFolder['_id'])},
+                      {'folderId': {'$oid': str(self.publicFolder['_id'])},
+                       'name': {'$in': ['public 1', 'private']}},
+                      {'folderId': {'$oid': str(self.publicFolder['_id'])},
+                       '$where': 'sleep(1000)'},
+                      {'folderId': {'$oid': str(self.publicFolder['_id'])},
+                       'meta.index': {'$gt': 0}}):
+            resp = self.request(path='/item/metadata', method='PUT', user=self.users[1], params={
+                'query': json.dumps(query),
+                'metadata': json.dumps({'tagged': False})
+            })
+            self.assertStatus(resp, 400)
+        self.assertEqual(itemModel.find({'meta.tagged': False}).count(), 0)
+
+        resp = self.request(path='/item/metadata', method='PUT', user=self.users[1])
+        self.assertStatus(resp, 400)
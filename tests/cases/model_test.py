@@ -18,6 +18,7 @@
 ###############################################################################
 
 from .. import base
+from girder.constants import registerAccessFlag
 from girder.models.model_base import AccessControlledModel, Model, AccessType
 from girder.utility.model_importer import ModelImporter
 
@@ -189,3 +190,45 @@ class ModelTestCase(base.TestCase):
         self.assertEqual(len(doc1['access']['users']), 1)
         self.assertEqual(len(doc1['access']['groups']), 0)
         self.assertIsNone(doc1.get('creatorId'))
+
+    def testFindWithPermissions(self):
+        registerAccessFlag('fake_flag', 'Fake flag')
+        admin, user1, user2 = [self.model('user').createUser(
+            email='user%d@place.com' % i, login='user%d' % i, firstName='First',
+            lastName='Last', password='mypassword') for i in range(3)]
+        group = self.model('group').createGroup(name='agroup', creator=admin)
+        self.model('group').addUser(group, user2, level=AccessType.READ)
+        user2 = self.model('user').load(user2['_id'], force=True)
+
+        model = self.model('fake_ac')
+        docs = []
+        for i in range(8):
+            doc = {'index': i}
+            model.setPublic(doc, i % 2 == 0)
+            if i % 3 == 0:
+                model.setUserAccess(doc, user1, level=AccessType.WRITE)
+            if i % 4 == 0:
+                model.setGroupAccess(
+                    doc, group, level=AccessType.ADMIN, flags='fake_flag', force=True)
+            if i == 5:
+                model.setPublicFlags(doc, 'fake_flag', force=True)
+            docs.append(model.save(doc))
+
+        # The query-based filter must agree with the python-based filter
+        for user in (None, admin, user1, user2):
+            for level in (AccessType.READ, AccessType.WRITE, AccessType.ADMIN):
+                for flags in (None, 'fake_flag'):
+                    expected = [d['index'] for d in model.filterResultsByPermission(
+                        model.find({}, sort=[('index', 1)]), user=user,
+                        level=level, flags=flags)]
+                    cursor = model.findWithPermissions(
+                        {}, sort=[('index', 1)], user=user, level=level, flags=flags)
+                    self.assertEqual([d['index'] for d in cursor], expected)
+                    self.assertEqual(cursor.count(), len(expected))
+
+        # Offset and limit are applied after the permission filter
+        results = model.findWithPermissions(
+            {}, sort=[('index', 1)], user=user1, level=AccessType.READ, offset=1, limit=2)
+        self.assertEqual([d['index'] for d in results], [2, 3])
+        results = model.list(user=None, sort=[('index', 1)], offset=2)
+        self.assertEqual([d['index'] for d in results], [4, 6])
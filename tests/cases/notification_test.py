@@ -17,12 +17,17 @@
 #  limitations under the License.
 ###############################################################################
 
+import mock
+import threading
 import time
 
+from bson.objectid import ObjectId
+
 from .. import base
 
 from girder.models.model_base import ValidationException
 from girder.models.notification import ProgressState
+from girder.utility import notification_stream
 from girder.utility.progress import ProgressContext
 
 
@@ -146,3 +151,58 @@ class NotificationTestCase(base.TestCase):
         token = resp.json['token']
         tokenDoc = self.model('token').load(token, force=True, objectId=False)
         self._testStream(None, tokenDoc)
+
+    def testStreamDelivery(self):
+        other = self.model('user').createUser(
+            email='other@email.com', login='other', firstName='first',
+            lastName='last', password='mypasswd')
+        notificationModel = self.model('notification')
+
+        def notify():
+            time.sleep(0.5)
+            notificationModel.createNotification('test', {'n': 1}, other)
+            notificationModel.createNotification('test', {'n': 2}, self.admin)
+
+        # Notifications created while the stream is open are sent to it once
+        thread = threading.Thread(target=notify)
+        thread.start()
+        resp = self.request(path='/notification/stream', method='GET',
+                            user=self.admin, isJson=False,
+                            params={'timeout': 2})
+        thread.join()
+        messages = self.getSseMessages(resp)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['data'], {'n': 2})
+
+        # Closed streams stop receiving notifications
+        self.assertEqual(notification_stream._subscriptions, {})
+
+    def testStreamResume(self):
+        database = self.model('notification').database
+        # A broadcast that has been overwritten in the capped collection
+        newest = {'_id': ObjectId()}
+
+        def waitFor(condition):
+            for _ in range(100):
+                item = subscription.get(timeout=0.1)
+                if condition(item):
+                    return item
+            self.fail('Timed out waiting for the notification stream.')
+
+        with mock.patch.object(
+                notification_stream, '_newestBroadcast', return_value=newest) as newestBroadcast:
+            subscription = notification_stream.subscribe(self.admin)
+            try:
+                # Kill the cursor of the tailer, so that it is opened again
+                # after the newest broadcast is gone
+                time.sleep(0.5)
+                database[notification_stream.BROADCAST_COLLECTION].drop()
+                waitFor(lambda item: newestBroadcast.called and
+                        item is notification_stream.RESYNC)
+
+                # New notifications are still delivered
+                self.model('notification').createNotification('test', {'n': 1}, self.admin)
+                notification = waitFor(lambda item: isinstance(item, dict))
+                self.assertEqual(notification['data'], {'n': 1})
+            finally:
+                notification_stream.unsubscribe(subscription)
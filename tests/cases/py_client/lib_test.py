@@ -30,6 +30,7 @@ import hashlib
 import httmock
 
 from girder import config, events
+from girder.constants import SettingKey
 from tests import base
 
 os.environ['GIRDER_PORT'] = os.environ.get('GIRDER_TEST_PORT', '20200')
@@ -392,6 +393,9 @@ class PythonClientTestCase(base.TestCase):
                     non_multipart.append(1)
             return original_post(*args, **kwargs)
 
+        # The same contents are uploaded repeatedly, so the server would
+        # otherwise create the later files without any data being sent
+        self.client.uploadDeduplication = False
         with mock.patch.object(self.client, 'post', new=mock_post):
             with open(path) as fh:
                 self.client.uploadFile(
@@ -527,6 +531,145 @@ class PythonClientTestCase(base.TestCase):
         sha.update(contents.encode('utf8'))
         self.assertEqual(file['sha512'], sha.hexdigest())
 
+    def testUploadRetryAndResume(self):
+        self.model('setting').set(SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE, 0)
+        self.client.MAX_CHUNK_SIZE = 4
+        self.client.uploadRetries = 1
+        self.client.uploadRetryBackoff = 0
+        contents = b'0123456789'
+        sha = hashlib.sha512(contents).hexdigest()
+
+        # Lose the response to the first chunk; the client should find from
+        # the upload offset that the chunk was received and continue.
+        original_post = self.client.post
+        failures = []
+
+        def mock_post(path, *args, **kwargs):
+            resp = original_post(path, *args, **kwargs)
+            if path.startswith('file/chunk') and not failures:
+                failures.append(path)
+                raise requests.ConnectionError('Connection lost')
+            return resp
+
+        with mock.patch.object(self.client, 'post', new=mock_post):
+            file = self.client.uploadFile(
+                self.publicFolder['_id'], six.BytesIO(contents), name='retry',
+                size=len(contents), parentType='folder')
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(self.model('file').load(file['_id'], force=True)['sha512'], sha)
+
+        # Lose the response to the final chunk, after which the server has
+        # already finalized the upload; the file it created is returned.
+        def mock_post_final(path, *args, **kwargs):
+            resp = original_post(path, *args, **kwargs)
+            if path.startswith('file/chunk?offset=8') and not failures[1:]:
+                failures.append(path)
+                raise requests.ConnectionError('Connection lost')
+            return resp
+
+        with mock.patch.object(self.client, 'post', new=mock_post_final):
+            file = self.client.uploadFile(
+                self.publicFolder['_id'], six.BytesIO(contents), name='retry final',
+                size=len(contents), parentType='folder')
+        self.assertEqual(len(failures), 2)
+        self.assertEqual(file['name'], 'retry final')
+        self.assertEqual(self.model('file').load(file['_id'], force=True)['sha512'], sha)
+
+        # The file is found by the ID of the upload, not by its name and size
+        retried = file
+        failures = []
+
+        def mock_post_completed(path, *args, **kwargs):
+            resp = original_post(path, *args, **kwargs)
+            if path.startswith('file/chunk?offset=8') and not failures:
+                failures.append(resp)
+                # Another upload of the same name and size finishes first
+                self.client.uploadFile(
+                    retried['itemId'], six.BytesIO(contents), name='retry final',
+                    size=len(contents))
+                raise requests.ConnectionError('Connection lost')
+            return resp
+
+        with mock.patch.object(self.client, 'post', new=mock_post_completed):
+            file = self.client.uploadFile(
+                retried['itemId'], six.BytesIO(contents), name='retry final',
+                size=len(contents))
+        self.assertEqual(file['_id'], failures[0]['_id'])
+        self.assertNotEqual(file['_id'], retried['_id'])
+
+        # Resuming an upload that was already completed returns its file
+        upload = self.client.post('file', parameters={
+            'parentType': 'folder',
+            'parentId': self.publicFolder['_id'],
+            'name': 'completed',
+            'size': len(contents)
+        })
+        completed = self.client.post(
+            'file/chunk?offset=0&uploadId=%s' % upload['_id'], data=contents)
+        file = self.client.resumeUpload(upload['_id'], six.BytesIO(contents), len(contents))
+        self.assertEqual(file['_id'], completed['_id'])
+
+        # Resume an upload of which only the first chunk was sent
+        upload = self.client.post('file', parameters={
+            'parentType': 'folder',
+            'parentId': self.publicFolder['_id'],
+            'name': 'resume',
+            'size': len(contents)
+        })
+        self.client.post('file/chunk?offset=0&uploadId=%s' % upload['_id'], data=contents[:4])
+        progress = []
+        # The stream does not have to start at the beginning of the data
+        stream = six.BytesIO(b'xx' + contents)
+        stream.seek(2)
+        file = self.client.resumeUpload(
+            upload['_id'], stream, len(contents), progressCallback=progress.append)
+        self.assertEqual([p['current'] for p in progress], [8, 10])
+        self.assertEqual(self.model('file').load(file['_id'], force=True)['sha512'], sha)
+
+    def testUploadDeduplication(self):
+        self.model('setting').set(SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE, 0)
+        self.client.MAX_CHUNK_SIZE = 4
+        contents = b'0123456789'
+        original = self.client.uploadFile(
+            self.publicFolder['_id'], six.BytesIO(contents), name='original',
+            size=len(contents), parentType='folder')
+
+        original_post = self.client.post
+        chunks = []
+
+        def mock_post(path, *args, **kwargs):
+            if path.startswith('file/chunk'):
+                chunks.append(path)
+            return original_post(path, *args, **kwargs)
+
+        # The server already has the contents, so none are sent
+        stream = six.BytesIO(b'xx' + contents)
+        stream.seek(2)
+        with mock.patch.object(self.client, 'post', new=mock_post):
+            file = self.client.uploadFile(
+                self.publicFolder['_id'], stream, name='duplicate',
+                size=len(contents), parentType='folder')
+        self.assertEqual(chunks, [])
+        self.assertNotEqual(file['_id'], original['_id'])
+        self.assertEqual(file['name'], 'duplicate')
+        self.assertEqual(
+            self.model('file').load(file['_id'], force=True)['sha512'],
+            hashlib.sha512(contents).hexdigest())
+
+        # New contents and streams that cannot seek are uploaded
+        with mock.patch.object(self.client, 'post', new=mock_post):
+            self.client.uploadFile(
+                self.publicFolder['_id'], six.BytesIO(b'9876543210'), name='new',
+                size=len(contents), parentType='folder')
+            self.assertEqual(len(chunks), 3)
+
+            stream = six.BytesIO(contents)
+            stream.tell = mock.Mock(side_effect=IOError)
+            self.client.uploadFile(
+                self.publicFolder['_id'], stream, name='unseekable',
+                size=len(contents), parentType='folder')
+            self.assertEqual(len(chunks), 6)
+
     def testListFile(self):
         # Creating item
         item = self.client.createItem(self.publicFolder['_id'],
@@ -637,6 +780,85 @@ class PythonClientTestCase(base.TestCase):
             with self.assertRaises(requests.HTTPError):
                 self.client.downloadFile(file['_id'], obj)
 
+    def testConcurrentDownload(self):
+        self.client.upload(self.libTestDir, self.publicFolder['_id'])
+        dest = os.path.join(self.libTestDir, 'download')
+
+        client = girder_client.GirderClient(port=os.environ['GIRDER_PORT'], downloadWorkers=4)
+        client.authenticate(self.user['login'], self.password)
+        client.downloadFolderRecursive(self.publicFolder['_id'], dest)
+        self.assertIsNone(client._session)
+        self.assertIsNone(client._downloadPool)
+
+        for subDir in ('', 'sub0', 'sub1', 'sub2'):
+            for name in ('f', 'f1'):
+                path = os.path.join(subDir, name)
+                with open(os.path.join(self.libTestDir, path)) as f:
+                    expected = f.read()
+                with open(os.path.join(dest, '_libTestDir', path)) as f:
+                    self.assertEqual(f.read(), expected)
+                self.assertFalse(os.path.exists(
+                    os.path.join(dest, '_libTestDir', path + '.partial')))
+
+        # An interrupted download only requests the remaining bytes
+        item = self.client.createItem(self.publicFolder['_id'], 'Resumed')
+        file = self.client.uploadFileToItem(item['_id'], os.path.join(self.libTestDir, 'f'))
+        with open(os.path.join(self.libTestDir, 'f'), 'rb') as f:
+            contents = f.read()
+        path = os.path.join(dest, 'resumed')
+        ranges = []
+
+        @httmock.urlmatch(path=r'.*/file/.+/download$')
+        def interrupted(url, request):
+            return {'status_code': 200, 'content': contents[:10]}
+
+        @httmock.urlmatch(path=r'.*/file/.+/download$')
+        def mock(url, request):
+            ranges.append(request.headers.get('Range'))
+
+        with httmock.HTTMock(interrupted):
+            with self.assertRaises(girder_client.IncorrectDownloadLengthError):
+                client.downloadFile(file['_id'], path)
+        self.assertEqual(os.path.getsize(path + '.partial'), 10)
+        with httmock.HTTMock(mock):
+            client.downloadFile(file['_id'], path)
+        self.assertEqual(ranges, ['bytes=10-'])
+        self.assertFalse(os.path.exists(path + '.partial'))
+        self.assertFalse(os.path.exists(path + '.partial.json'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), contents)
+
+        # A partial file of an older version of the file is not resumed
+        with httmock.HTTMock(interrupted):
+            with self.assertRaises(girder_client.IncorrectDownloadLengthError):
+                client.downloadFile(file['_id'], path)
+        newContents = b'new contents of the file'
+        self.client.uploadFileContents(file['_id'], six.BytesIO(newContents), len(newContents))
+        del ranges[:]
+        with httmock.HTTMock(mock):
+            client.downloadFile(file['_id'], path)
+        self.assertEqual(ranges, [None])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), newContents)
+
+        # Neither is one without a record of its version
+        with open(path + '.partial', 'wb') as f:
+            f.write(b'stale')
+        client.downloadFile(file['_id'], path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), newContents)
+
+        # A download that is too long is discarded
+        @httmock.urlmatch(path=r'.*/file/.+/download$')
+        def tooLong(url, request):
+            return {'status_code': 200, 'content': newContents + b'extra'}
+
+        with httmock.HTTMock(tooLong):
+            with self.assertRaises(girder_client.IncorrectDownloadLengthError):
+                client.downloadFile(file['_id'], path + '2')
+        self.assertFalse(os.path.exists(path + '2'))
+        self.assertFalse(os.path.exists(path + '2.partial'))
+
     def testAddMetadataToItem(self):
         item = self.client.createItem(self.publicFolder['_id'],
                                       'Itemty McItemFace', '')
@@ -655,6 +877,31 @@ class PythonClientTestCase(base.TestCase):
         updatedFolder = self.model('folder').load(self.publicFolder['_id'], force=True)
         self.assertEqual(updatedFolder['meta'], meta)
 
+    def testAddMetadataToItems(self):
+        items = [self.client.createItem(self.publicFolder['_id'], 'item %d' % i, '')
+                 for i in range(5)]
+        updated = self.client.addMetadataToItems(
+            {item['_id']: {'index': i} for i, item in enumerate(items)}, batchSize=2)
+        self.assertEqual(updated, 5)
+        for i, item in enumerate(items):
+            self.assertEqual(self.model('item').load(item['_id'], force=True)['meta'],
+                             {'index': i})
+
+        updated = self.client.addMetadataToItems(
+            query={'folderId': {'$oid': self.publicFolder['_id']}},
+            metadata={'index': None, 'tagged': True})
+        self.assertEqual(updated, 5)
+        for item in items:
+            self.assertEqual(self.model('item').load(item['_id'], force=True)['meta'],
+                             {'tagged': True})
+
+    def testAddMetadataToFolders(self):
+        updated = self.client.addMetadataToFolders(
+            [(self.publicFolder['_id'], {'nothing': 'to see here!'})])
+        self.assertEqual(updated, 1)
+        updatedFolder = self.model('folder').load(self.publicFolder['_id'], force=True)
+        self.assertEqual(updatedFolder['meta'], {'nothing': 'to see here!'})
+
     def testPatch(self):
         patchUrl = 'patch'
         patchRequest = {
@@ -20,8 +20,10 @@
 import datetime
 import io
 import json
+import mock
 import os
 import six
+import struct
 import zipfile
 
 from .. import base
@@ -772,6 +774,142 @@ class ResourceTestCase(base.TestCase):
         footer = zip.footer()
         self.assertEqual(footer[-6:], b'\xFF\xFF\xFF\xFF\x00\x00')
 
+    def testZip64LocalHeader(self):
+        def genFile():
+            yield b'data'
+
+        # A file known to be larger than 4GB is marked as Zip64 in its local
+        # header, so that readers expect 8 byte sizes in its data descriptor.
+        zip = girder.utility.ziputil.ZipGenerator(compression=girder.utility.ziputil.STORE)
+        body = b''.join(zip.addFile(genFile, 'big', size=5 * 1024 * 1024 * 1024))
+        (signature, extractVersion, flags, compression, _, _, crc, compressSize, fileSize,
+         nameLength, extraLength) = struct.unpack('<4sHHHHHLLLHH', body[:30])
+        self.assertEqual(signature, b'PK\x03\x04')
+        self.assertEqual(extractVersion, 45)
+        self.assertEqual((compressSize, fileSize), (0xFFFFFFFF, 0xFFFFFFFF))
+        self.assertEqual(body[30:30 + nameLength], b'big')
+        self.assertEqual(extraLength, 20)
+        self.assertEqual(struct.unpack('<HH', body[33:37]), (1, 16))
+        # The data descriptor has 8 byte sizes
+        self.assertEqual(len(body), 30 + nameLength + extraLength + 4 + 24)
+        self.assertEqual(struct.unpack('<4sLQQ', body[-24:])[2:], (4, 4))
+
+        # Small files are not
+        zip = girder.utility.ziputil.ZipGenerator(compression=girder.utility.ziputil.STORE)
+        body = b''.join(zip.addFile(genFile, 'small', size=4))
+        self.assertEqual(struct.unpack('<4sHHHHHLLLHH', body[:30])[-1], 0)
+        self.assertEqual(len(body), 30 + 5 + 4 + 16)
+
+    def testParallelZip(self):
+        def genFile(name, chunks):
+            def stream():
+                for _ in range(chunks):
+                    yield name * 1000
+            return stream
+
+        files = [('file%d.txt' % i, genFile('file%d' % i, i % 4 + 1)) for i in range(40)]
+        files.append(('image.png', genFile('image', 2)))
+
+        zip = girder.utility.ziputil.ZipGenerator(
+            'Root', compression=girder.utility.ziputil.DEFLATE)
+        body = b''.join(list(zip.addFiles(files, workers=4, window=8)) + [zip.footer()])
+        zip = zipfile.ZipFile(io.BytesIO(body), 'r')
+        self.assertTrue(zip.testzip() is None)
+        # Entries are written in the order they were listed
+        self.assertEqual(zip.namelist(), ['Root/' + path for path, _ in files])
+        self.assertEqual(zip.read('Root/file7.txt'), b'file7' * 4000)
+        self.assertEqual(zip.getinfo('Root/file7.txt').compress_type, zipfile.ZIP_DEFLATED)
+        # Files that are already compressed are stored
+        self.assertEqual(zip.getinfo('Root/image.png').compress_type, zipfile.ZIP_STORED)
+
+        # Errors reading a file are raised by the archive's generator
+        def failingFile():
+            yield 'partial'
+            raise Exception('Failed to read file.')
+
+        zip = girder.utility.ziputil.ZipGenerator()
+        with six.assertRaisesRegex(self, Exception, 'Failed to read file.'):
+            for data in zip.addFiles(files[:3] + [('bad', failingFile)] + files, workers=2):
+                pass
+
+        # Without workers, files are read one at a time
+        zip = girder.utility.ziputil.ZipGenerator()
+        body = b''.join(list(zip.addFiles(files, workers=0)) + [zip.footer()])
+        self.assertTrue(zipfile.ZipFile(io.BytesIO(body), 'r').testzip() is None)
+
+    def testSeekableZipDownload(self):
+        self._createFiles()
+        self.model('file').update({}, {'$unset': {'crc32': True}})
+        path = '/folder/%s/download' % self.adminPublicFolder['_id']
+        resp = self.request(path=path, user=self.admin, isJson=False)
+        self.assertStatusOk(resp)
+        body = self.getBody(resp, text=False)
+        self.assertEqual(int(resp.headers['Content-Length']), len(body))
+        etag = resp.headers['ETag']
+        zip = zipfile.ZipFile(io.BytesIO(body), 'r')
+        self.assertTrue(zip.testzip() is None)
+        self.assertGreater(len(zip.namelist()), 1)
+
+        # Ranges are not offered until the CRCs are known, which are recorded
+        # as the archive is downloaded
+        self.assertEqual(resp.headers['Accept-Ranges'], 'none')
+        self.assertGreater(self.model('file').find({'crc32': {'$exists': True}}).count(), 0)
+
+        # Any range of the archive can then be requested
+        resp = self.request(path=path, user=self.admin, isJson=False,
+                            additionalHeaders=[('Range', 'bytes=10-99')])
+        self.assertStatus(resp, 206)
+        self.assertEqual(resp.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(resp.headers['Content-Range'], 'bytes 10-99/%d' % len(body))
+        self.assertEqual(self.getBody(resp, text=False), body[10:100])
+
+        # Without recorded CRCs, resuming gets the whole archive rather than
+        # reading every file to generate the end of it
+        self.model('file').update({}, {'$unset': {'crc32': True}})
+        with mock.patch.object(girder.utility.ziputil._SeekableEntry, 'computeCrc') as computeCrc:
+            resp = self.request(path=path, user=self.admin, isJson=False,
+                                additionalHeaders=[('Range', 'bytes=50-'), ('If-Range', etag)])
+            self.assertStatusOk(resp)
+            self.assertNotIn('Content-Range', resp.headers)
+            self.assertEqual(self.getBody(resp, text=False), body)
+        self.assertFalse(computeCrc.called)
+        resp = self.request(path=path, user=self.admin, isJson=False,
+                            additionalHeaders=[('Range', 'bytes=50-'), ('If-Range', etag)])
+        self.assertStatus(resp, 206)
+        self.assertEqual(self.getBody(resp, text=False), body[50:])
+
+        # A stale If-Range gets the whole archive
+        resp = self.request(path=path, user=self.admin, isJson=False,
+                            additionalHeaders=[('Range', 'bytes=50-'), ('If-Range', '"stale"')])
+        self.assertStatusOk(resp)
+        self.assertEqual(self.getBody(resp, text=False), body)
+
+        # Several ranges get the whole archive
+        resp = self.request(path=path, user=self.admin, isJson=False,
+                            additionalHeaders=[('Range', 'bytes=0-9,50-59')])
+        self.assertStatusOk(resp)
+        self.assertNotIn('Content-Range', resp.headers)
+        self.assertEqual(self.getBody(resp, text=False), body)
+
+        # Ranges past the end of the archive cannot be satisfied
+        resp = self.request(path=path, user=self.admin, isJson=False,
+                            additionalHeaders=[('Range', 'bytes=%d-' % len(body))])
+        self.assertStatus(resp, 416)
+        self.assertEqual(resp.headers['Content-Range'], 'bytes */%d' % len(body))
+        self.assertEqual(self.getBody(resp, text=False), b'')
+
+        # Items and collections are served the same way
+        for path, params in (('/item/%s/download' % self.items[0]['_id'], {'format': 'zip'}),
+                             ('/collection/%s/download' % self.collection['_id'], {})):
+            resp = self.request(path=path, user=self.admin, isJson=False, params=params)
+            self.assertStatusOk(resp)
+            body = self.getBody(resp, text=False)
+            self.assertTrue(zipfile.ZipFile(io.BytesIO(body), 'r').testzip() is None)
+            resp = self.request(path=path, user=self.admin, isJson=False, params=params,
+                                additionalHeaders=[('Range', 'bytes=10-')])
+            self.assertStatus(resp, 206)
+            self.assertEqual(self.getBody(resp, text=False), body[10:])
+
     def testResourceTimestamps(self):
         self._createFiles()
 
@@ -18,9 +18,11 @@
 #############################################################################
 
 import six
+import time
 from .. import base
+from girder.constants import SettingDefault, SettingKey
 from girder.models.model_base import ValidationException
-from girder.utility import setting_utilities
+from girder.utility import process_cache, setting_utilities
 
 
 def setUpModule():
@@ -108,3 +110,39 @@ class SettingTestCase(base.TestCase):
             return 'default value'
 
         self.assertEqual(self.model('setting').get('test.key'), 'default value')
+
+    def testSettingCache(self):
+        settingModel = self.model('setting')
+        settingModel.set(SettingKey.BRAND_NAME, 'Brand 1')
+        self.assertEqual(settingModel.get(SettingKey.BRAND_NAME), 'Brand 1')
+
+        # Changing the database directly is not seen until the cache is cleared
+        settingModel.collection.update_one(
+            {'key': SettingKey.BRAND_NAME}, {'$set': {'value': 'Brand 2'}})
+        self.assertEqual(settingModel.get(SettingKey.BRAND_NAME), 'Brand 1')
+
+        # Setting the value through the model updates the cache immediately
+        settingModel.set(SettingKey.BRAND_NAME, 'Brand 3')
+        self.assertEqual(settingModel.get(SettingKey.BRAND_NAME), 'Brand 3')
+
+        # Mutating a returned value must not affect the cache
+        settingModel.set(SettingKey.COLLECTION_CREATE_POLICY, {
+            'open': False, 'groups': [], 'users': []})
+        policy = settingModel.get(SettingKey.COLLECTION_CREATE_POLICY)
+        policy['open'] = True
+        self.assertFalse(settingModel.get(SettingKey.COLLECTION_CREATE_POLICY)['open'])
+
+        # Simulate a change made by another process
+        settingModel.collection.update_one(
+            {'key': SettingKey.BRAND_NAME}, {'$set': {'value': 'Brand 4'}})
+        settingModel.database[process_cache.INVALIDATION_COLLECTION].insert_one(
+            {'cache': 'setting', 'key': SettingKey.BRAND_NAME})
+        for _ in range(50):
+            if settingModel.get(SettingKey.BRAND_NAME) == 'Brand 4':
+                break
+            time.sleep(0.1)
+        self.assertEqual(settingModel.get(SettingKey.BRAND_NAME), 'Brand 4')
+
+        settingModel.unset(SettingKey.BRAND_NAME)
+        self.assertEqual(settingModel.get(SettingKey.BRAND_NAME),
+                         SettingDefault.defaults[SettingKey.BRAND_NAME])
@@ -17,7 +17,11 @@
 #  limitations under the License.
 ###############################################################################
 
+import mock
+import pymongo
+
 from .. import base
+from girder.utility import size_accounting
 
 
 def setUpModule():
@@ -192,3 +196,76 @@ class SizeTestCase(base.TestCase):
         self.assertStatusOk(resp)
         self.assertNodeSize(self.admin, 'user', 0)
         self.assertNodeSize(self.coll2, 'collection', 1)
+
+    def testDeferredSizeChanges(self):
+        with size_accounting.deferred():
+            for i in range(3):
+                self.model('file').createFile(
+                    creator=self.admin, item=self.item1, name='File%d' % i,
+                    size=100, assetstore=self.assetstore)
+
+            # The changes are merged and not yet written, but are included
+            # when the documents are filtered
+            self.assertEqual(size_accounting.pending('folder', self.folder1['_id']), 300)
+            self.assertNodeSize(self.item1, 'item', 1)
+            self.assertNodeSize(self.folder1, 'folder', 1)
+            self.assertNodeSize(self.coll1, 'collection', 11)
+            folder = self.model('folder').load(self.folder1['_id'], force=True)
+            self.assertEqual(self.model('folder').filter(folder, self.admin)['size'], 301)
+
+        self.assertEqual(size_accounting.pending('folder', self.folder1['_id']), 0)
+        self.assertNodeSize(self.item1, 'item', 301)
+        self.assertNodeSize(self.folder1, 'folder', 301)
+        self.assertNodeSize(self.coll1, 'collection', 311)
+
+        # Moving an item uses its current size even if the caller's copy is
+        # out of date
+        with size_accounting.deferred():
+            self.model('file').createFile(
+                creator=self.admin, item=self.item1, name='File3', size=1000,
+                assetstore=self.assetstore)
+            self.model('item').move(self.item1, self.folder2)
+        self.assertNodeSize(self.item1, 'item', 1301)
+        self.assertNodeSize(self.folder1, 'folder', 0)
+        self.assertNodeSize(self.folder2, 'folder', 1311)
+        self.assertNodeSize(self.coll1, 'collection', 1311)
+
+        # Likewise when the folder containing it is emptied
+        with size_accounting.deferred():
+            self.model('file').createFile(
+                creator=self.admin, item=self.item1, name='File4', size=10000,
+                assetstore=self.assetstore)
+            self.model('folder').clean(self.folder2)
+        self.assertNodeSize(self.folder2, 'folder', 0)
+        self.assertNodeSize(self.coll1, 'collection', 0)
+
+    def testFlushFailure(self):
+        # If writing the changes to one model fails, the changes to every
+        # model that was not written are kept for the next flush
+        with mock.patch('girder.models.folder.Folder.incrementMany',
+                        side_effect=Exception('failed')):
+            with self.assertRaises(Exception):
+                with size_accounting.deferred():
+                    size_accounting.add('item', self.item1['_id'], 5)
+                    size_accounting.add('folder', self.folder1['_id'], 5)
+                    size_accounting.add('collection', self.coll1['_id'], 5)
+        size_accounting.flush()
+        self.assertNodeSize(self.item1, 'item', 6)
+        self.assertNodeSize(self.folder1, 'folder', 6)
+        self.assertNodeSize(self.coll1, 'collection', 16)
+
+        # Only the increments of a bulk write that failed are retried
+        self.model('collection').collection.update_one(
+            {'_id': self.coll2['_id']}, {'$set': {'size': 'invalid'}})
+        with self.assertRaises(pymongo.errors.BulkWriteError):
+            with size_accounting.deferred():
+                size_accounting.add('collection', self.coll1['_id'], 5)
+                size_accounting.add('collection', self.coll2['_id'], 5)
+        self.assertNodeSize(self.coll1, 'collection', 21)
+        self.assertEqual(size_accounting.pending('collection', self.coll2['_id']), 5)
+        self.assertEqual(size_accounting.pending('collection', self.coll1['_id']), 0)
+
+        self.model('collection').collection.update_one(
+            {'_id': self.coll2['_id']}, {'$set': {'size': 0}})
+        size_accounting.flush()
+        self.assertNodeSize(self.coll2, 'collection', 5)
@@ -389,10 +389,24 @@ class SystemTestCase(base.TestCase):
 
         resp = self.request(path='/system/check', user=user, method='PUT')
         self.assertStatusOk(resp)
+        self.assertEqual(resp.json['ancestorsFixed'], 0)
         self.assertEqual(resp.json['baseParentsFixed'], 0)
         self.assertEqual(resp.json['orphansRemoved'], 0)
         self.assertEqual(resp.json['sizesChanged'], 0)
 
+        self.model('folder').update(
+            {'_id': f3['_id']}, update={'$unset': {'ancestors': True}})
+        self.model('item').update(
+            {'_id': i4['_id']}, update={'$set': {'ancestors': []}})
+
+        resp = self.request(path='/system/check', user=user, method='PUT')
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['ancestorsFixed'], 2)
+        self.assertEqual(resp.json['baseParentsFixed'], 0)
+        self.assertEqual(
+            self.model('item').load(i4['_id'], force=True)['ancestors'],
+            self.model('folder').load(f3['_id'], force=True)['ancestors'] + [f3['_id']])
+
         self.model('item').update(
             {'_id': i1['_id']}, update={'$set': {'baseParentId': None}})
 
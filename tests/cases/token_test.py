@@ -17,12 +17,15 @@
 #  limitations under the License.
 ###############################################################################
 
+import mock
 import random
+import time
 
 from .. import base
 from girder.constants import TokenScope
 from girder.models.token import genToken
 from girder.models.model_base import AccessException
+from girder.utility import process_cache
 
 
 def setUpModule():
@@ -98,3 +101,94 @@ class TokensTestCase(base.TestCase):
         # If specified scope does not exist raise an error
         with self.assertRaises(AccessException):
             tokenModel.requireScope(token, anotherScope)
+
+    def testAuthCache(self):
+        tokenModel = self.model('token')
+        userModel = self.model('user')
+        admin = userModel.createUser(
+            'admin', 'password', 'Admin', 'Admin', 'admin@email.com')
+        user = userModel.createUser(
+            'user', 'password', 'User', 'User', 'user@email.com')
+        token = tokenModel.createToken(user)
+
+        # Repeated requests with the same token are served from the cache
+        resp = self.request(path='/user/me', token=token)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['login'], 'user')
+        hits = tokenModel.cache.stats()['hits']
+        resp = self.request(path='/user/me', token=token)
+        self.assertStatusOk(resp)
+        self.assertEqual(tokenModel.cache.stats()['hits'], hits + 1)
+
+        # Creating tokens and changing only the sizes of users don't evict
+        # anything from the caches of other processes
+        tokenInvalidations = tokenModel.cache.invalidations
+        userInvalidations = userModel.cache.invalidations
+        tokenModel.createToken(user)
+        userModel.increment({'_id': user['_id']}, 'size', 10, multi=False)
+        userModel.incrementMany('size', {user['_id']: -10, admin['_id']: 0})
+        self.assertEqual(tokenModel.cache.invalidations, tokenInvalidations)
+        self.assertEqual(userModel.cache.invalidations, userInvalidations)
+
+        # Group membership changes are seen immediately
+        group = self.model('group').createGroup('Group', admin)
+        self.model('group').addUser(group, user)
+        self.assertIn(group['_id'], userModel.loadCached(user['_id'])['groups'])
+        self.model('group').remove(group)
+        self.assertEqual(userModel.loadCached(user['_id'])['groups'], [])
+
+        # Mutating a returned value must not affect the cache
+        cached = userModel.loadCached(user['_id'])
+        cached['admin'] = True
+        self.assertFalse(userModel.loadCached(user['_id'])['admin'])
+
+        # Deleted tokens can no longer be used
+        tokenModel.remove(token)
+        resp = self.request(path='/user/me', token=token)
+        self.assertStatusOk(resp)
+        self.assertIsNone(resp.json)
+
+        # A copy loaded by another request while the token is being deleted
+        # is not kept
+        token = tokenModel.createToken(user)
+        deleteOne = tokenModel.collection.delete_one
+
+        def concurrentDelete(*args, **kwargs):
+            self.assertIsNotNone(tokenModel.loadCached(token['_id']))
+            return deleteOne(*args, **kwargs)
+
+        with mock.patch.object(tokenModel.collection, 'delete_one', concurrentDelete):
+            tokenModel.remove(token)
+        self.assertIsNone(tokenModel.loadCached(token['_id']))
+
+        # Likewise for a user being updated
+        updateOne = userModel.collection.update_one
+
+        def concurrentUpdate(*args, **kwargs):
+            self.assertFalse(userModel.loadCached(user['_id'])['admin'])
+            return updateOne(*args, **kwargs)
+
+        with mock.patch.object(userModel.collection, 'update_one', concurrentUpdate):
+            userModel.update({'_id': user['_id']}, {'$set': {'admin': True}}, multi=False)
+        self.assertTrue(userModel.loadCached(user['_id'])['admin'])
+
+        # Simulate a change made by another process
+        token = tokenModel.createToken(user)
+        self.assertIsNotNone(tokenModel.loadCached(token['_id']))
+        tokenModel.collection.delete_one({'_id': token['_id']})
+        tokenModel.database[process_cache.INVALIDATION_COLLECTION].insert_one(
+            {'cache': 'token', 'key': token['_id']})
+        for _ in range(50):
+            if tokenModel.loadCached(token['_id']) is None:
+                break
+            time.sleep(0.1)
+        self.assertIsNone(tokenModel.loadCached(token['_id']))
+
+        # Only administrators may see cache statistics
+        resp = self.request(path='/system/cache', user=user)
+        self.assertStatus(resp, 403)
+        resp = self.request(path='/system/cache', user=admin)
+        self.assertStatusOk(resp)
+        for name in ('setting', 'token', 'user'):
+            self.assertIn(name, resp.json)
+        self.assertGreater(resp.json['token']['hits'], 0)
@@ -18,16 +18,19 @@
 ###############################################################################
 
 import boto3
+import hashlib
 import json
+import mock
 import os
 import re
 import requests
 import six
 import threading
+import zlib
 from six.moves import range
 
 from girder import events
-from girder.utility import assetstore_utilities
+from girder.utility import assetstore_utilities, config, gridfs_assetstore_adapter
 
 from .. import base
 from .. import mongo_replicaset
@@ -339,6 +342,10 @@ class UploadTestCase(base.TestCase):
         files.append(self.model('upload').uploadFromFile(
             data, size, 'progress', parentType='folder', parent=self.folder,
             assetstore=self.assetstore))
+        # All digests are computed while the data is received
+        self.assertEqual(files[0]['crc32'], zlib.crc32(b' ' * size) & 0xFFFFFFFF)
+        self.assertEqual(files[0]['md5'], hashlib.md5(b' ' * size).hexdigest())
+        self.assertEqual(files[0]['sha256'], hashlib.sha256(b' ' * size).hexdigest())
         fullPath0 = adapter.fullPath(files[0])
         conditionRemoveDone = threading.Condition()
         conditionInEvent = threading.Condition()
@@ -380,6 +387,71 @@ class UploadTestCase(base.TestCase):
         self.assertEqual(fullPath0, fullPath1)
         self.assertTrue(os.path.exists(fullPath1))
 
+    def testDuplicateUpload(self):
+        contents = (Chunk1 + Chunk2).encode('utf8')
+        sha512 = hashlib.sha512(contents).hexdigest()
+        privateFolder = self.model('folder').createFolder(
+            self.user, 'Secret', parentType='user', public=False, creator=self.user)
+        original = self.model('upload').uploadFromFile(
+            six.BytesIO(contents), len(contents), 'original.txt', parentType='folder',
+            parent=privateFolder, user=self.user)
+        otherUser = self.model('user').createUser(
+            'other', 'password', 'Other', 'User', 'other@email.com')
+        otherFolder = self.model('folder').createFolder(
+            otherUser, 'Other', parentType='user', creator=otherUser)
+        params = {
+            'parentType': 'folder',
+            'name': 'duplicate.txt',
+            'size': len(contents),
+            'sha512': sha512
+        }
+
+        resp = self.request(path='/file', method='POST', user=self.user,
+                            params=dict(params, parentId=self.folder['_id'], sha512='abc'))
+        self.assertStatus(resp, 400)
+
+        # A user who cannot read the existing file must upload the contents
+        resp = self.request(path='/file', method='POST', user=otherUser,
+                            params=dict(params, parentId=otherFolder['_id']))
+        self.assertStatusOk(resp)
+        self.assertNotIn('_modelType', resp.json)
+        self.assertEqual(resp.json['received'], 0)
+
+        # Contents of a different size are not a duplicate
+        resp = self.request(path='/file', method='POST', user=self.user,
+                            params=dict(params, parentId=self.folder['_id'], size=3))
+        self.assertStatusOk(resp)
+        self.assertNotIn('_modelType', resp.json)
+
+        # A user who can read it gets a file without sending any data
+        finalized = []
+        events.bind('model.file.finalizeUpload.after', 'duplicate_test',
+                    lambda event: finalized.append(event.info['file']['_id']))
+        try:
+            resp = self.request(path='/file', method='POST', user=self.user,
+                                params=dict(params, parentId=self.folder['_id']))
+        finally:
+            events.unbind('model.file.finalizeUpload.after', 'duplicate_test')
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['_modelType'], 'file')
+        self.assertEqual(resp.json['name'], 'duplicate.txt')
+        self.assertEqual(resp.json['size'], len(contents))
+        self.assertEqual(finalized, [resp.json['_id']])
+        duplicate = self.model('file').load(resp.json['_id'], force=True)
+        self.assertNotEqual(duplicate['itemId'], original['itemId'])
+        self.assertEqual(duplicate['sha512'], sha512)
+        self.assertEqual(duplicate['path'], original['path'])
+        item = self.model('item').load(duplicate['itemId'], force=True)
+        self.assertEqual(item['folderId'], self.folder['_id'])
+        self.assertEqual(item['size'], len(contents))
+
+        # The shared data outlives the original file
+        self.model('file').remove(original)
+        resp = self.request(path='/file/%s/download' % duplicate['_id'], user=self.user,
+                            isJson=False)
+        self.assertStatusOk(resp)
+        self.assertEqual(self.getBody(resp), Chunk1 + Chunk2)
+
     def testGridFSAssetstoreUpload(self):
         # Clear any old DB data
         base.dropGridFSDatabase('girder_test_upload_assetstore')
@@ -390,6 +462,43 @@ class UploadTestCase(base.TestCase):
         self.assetstore = assetstore
         self._testUpload()
 
+    @mock.patch.object(gridfs_assetstore_adapter, 'CHUNK_SIZE', 4)
+    def testGridFSBatchedChunks(self):
+        base.dropGridFSDatabase('girder_test_upload_batched')
+        self.model('assetstore').remove(self.model('assetstore').getCurrent())
+        assetstore = self.model('assetstore').createGridFsAssetstore(
+            name='Test', db='girder_test_upload_batched')
+        adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+        data = b'abcdefghijklmnopqrstuvwxyz'
+
+        with mock.patch.dict(config.getConfig()['database'],
+                             {'gridfs_insert_batch_size': 3}), \
+                mock.patch.object(adapter.chunkColl, 'insert_many',
+                                  wraps=adapter.chunkColl.insert_many) as insertMany:
+            upload = self.model('upload').createUpload(
+                user=self.user, name='batched.txt', parentType='folder',
+                parent=self.folder, size=len(data))
+            # Simulate chunks written by an earlier attempt at this request
+            adapter.chunkColl.insert_one({
+                'uuid': upload['chunkUuid'], 'n': 1, 'data': b'XXXX'})
+            upload = adapter.uploadChunk(upload, data[:12])
+            self.assertEqual(upload['chunkCount'], 3)
+            self.assertEqual(adapter.requestOffset(upload), 12)
+            upload = adapter.uploadChunk(upload, data[12:])
+            self.assertEqual(upload['chunkCount'], 7)
+
+        # The chunks of each request are written three at a time
+        self.assertEqual(insertMany.call_count, 3)
+        chunks = list(adapter.chunkColl.find(
+            {'uuid': upload['chunkUuid']}, sort=[('n', 1)]))
+        self.assertEqual([chunk['n'] for chunk in chunks], list(range(7)))
+        self.assertEqual(b''.join(chunk['data'] for chunk in chunks), data)
+        file = adapter.finalizeUpload(upload, {})
+        self.assertEqual(hashlib.sha512(data).hexdigest(), file['sha512'])
+        self.assertEqual(hashlib.sha256(data).hexdigest(), file['sha256'])
+        self.assertEqual(hashlib.md5(data).hexdigest(), file['md5'])
+        self.assertEqual(zlib.crc32(data) & 0xFFFFFFFF, file['crc32'])
+
     def testGridFSReplicaSetAssetstoreUpload(self):
         verbose = 0
         if 'REPLICASET' in os.environ.get('EXTRADEBUG', '').split():